@@ -115,4 +115,26 @@ LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
 
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
-CRISPY_TEMPLATE_PACK = "bootstrap5"
\ No newline at end of file
+CRISPY_TEMPLATE_PACK = "bootstrap5"
+
+# Numero massimo di distinte base tenute in memoria da ogni processo
+BOM_CACHE_DIMENSIONE = 128
+
+# Dimensione massima (MB) della cache su disco dei PDF generati (MEDIA_ROOT/cache_pdf)
+PDF_CACHE_DIMENSIONE_MB = 200
+
+# Oltre questo numero stimato di bolle il PDF viene generato dal comando esegui_lavori
+LAVORI_SOGLIA_BOLLE = 200
+# Oltre questo numero di documenti l'esportazione ZIP viene preparata dal comando esegui_lavori
+LAVORI_SOGLIA_DOCUMENTI = 50
+
+# Processi usati per generare i PDF delle esportazioni ZIP (0 = nel processo web)
+ESPORTAZIONE_PROCESSI = 2
+ESPORTAZIONE_MAX_DOCUMENTI = 500
+
+# I PDF generati al volo (non in cache) oltre questa dimensione passano da memoria a file temporaneo
+PDF_IN_MEMORIA_KB = 1024
+
+# Importazione ordini da CSV/XLSX: errori mostrati al massimo e ordini scritti per ogni blocco
+IMPORTAZIONE_MAX_ERRORI = 200
+IMPORTAZIONE_BLOCCO = 500
@@ -25,10 +25,12 @@ urlpatterns = [
     # Modelli
     path('modelli/', views.ModelloListView.as_view(), name='modello_list'),
     path('modelli/nuovo/', views.ModelloCreateView.as_view(), name='modello_create'),
+    path('modelli/nuovi-in-blocco/', views.ModelliInBloccoView.as_view(), name='modelli_in_blocco'),
     path('modelli/<int:pk>/', views.ModelloDetailView.as_view(), name='modello_detail'),
     path('modelli/<int:pk>/modifica/', views.ModelloUpdateView.as_view(), name='modello_update'),
     path('modelli/<int:pk>/elimina/', views.ModelloDeleteView.as_view(), name='modello_delete'),
     path('modelli/<int:pk>/duplica/', views.modello_duplicate, name='modello_duplicate'),
+    path('modelli/<int:pk>/misure/', views.matrice_misure_modello, name='modello_misure'),
 
     # Tipi Componente
     path('tipicomponente/', views.TipoComponenteListView.as_view(), name='tipocomponente_list'),
@@ -61,6 +63,7 @@ urlpatterns = [
     # Ordini
     path('ordini/', views.OrdineListView.as_view(), name='ordine_list'),
     path('ordini/nuovo/', views.OrdineCreateView.as_view(), name='ordine_create'),
+    path('ordini/importa/', views.importa_ordini_view, name='ordini_importa'),
     path('modelli/<int:modello_id>/ordini/nuovo/', views.OrdineCreateView.as_view(), name='ordine_create_for_modello'),
     path('ordini/<int:pk>/', views.OrdineDetailView.as_view(), name='ordine_detail'),
     path('ordini/<int:pk>/modifica/', views.OrdineUpdateView.as_view(), name='ordine_update'),
@@ -70,6 +73,7 @@ urlpatterns = [
 
     # URL per la pagina di generazione delle bolle di lavoro personalizzate
     path('ordini/<int:pk>/genera-bolle/', views.GeneraBolleView.as_view(), name='ordine_genera_bolle'),
+    path('ordini/genera-bolle/', views.GeneraBolleMultipleView.as_view(), name='ordini_genera_bolle'),
 
     # Aggiungi una vista per caricare dinamicamente i componenti
     path('api/modello/<int:modello_id>/componenti/', views.load_modello_components, name='api_load_modello_components'),        
@@ -91,6 +95,15 @@ urlpatterns = [
     path('report/materiali/<int:pk>/', views.scheda_materiali_pdf, name='scheda_materiali_pdf'),
     path('report/modello/<int:pk>/', views.scheda_modello_pdf, name='scheda_modello_pdf'),
     path('report/dashboard/', views.report_dashboard, name='report_dashboard'),
+    path('report/esporta/', views.esporta_documenti, name='esporta_documenti'),
+
+    # Ricerca globale (clienti, modelli, codici componente)
+    path('ricerca/', views.ricerca, name='ricerca'),
+
+    # Lavori in background (PDF pesanti)
+    path('lavori/<int:pk>/', views.lavoro_detail, name='lavoro_detail'),
+    path('lavori/<int:pk>/stato/', views.lavoro_stato, name='lavoro_stato'),
+    path('lavori/<int:pk>/download/', views.lavoro_download, name='lavoro_download'),
 
     # Autenticazione
     path('login/', auth_views.LoginView.as_view(template_name='registration/login.html'), name='login'),
@@ -8,7 +8,8 @@ from .models import (
     Taglia,
     Articolo,
     Ordine,
-    DettaglioOrdine
+    DettaglioOrdine,
+    LavoroDocumento
 )
 
 @admin.register(Cliente)
@@ -76,7 +77,21 @@ class OrdineAdmin(admin.ModelAdmin):
     date_hierarchy = 'data_ordine'
     ordering = ('-data_ordine',)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('modello__cliente').con_totale_paia()
+
+    @admin.display(description='Quantità totale', ordering='totale_paia')
+    def quantita_totale(self, obj):
+        return obj.totale_paia
+
 # Non è necessario registrare DettaglioOrdine o Articolo separatamente
 # se li gestiamo solo come inline, ma può essere utile per il debug.
 # admin.site.register(DettaglioOrdine)
-# admin.site.register(Articolo)
\ No newline at end of file
+# admin.site.register(Articolo)
+
+
+@admin.register(LavoroDocumento)
+class LavoroDocumentoAdmin(admin.ModelAdmin):
+    list_display = ('id', 'nome_file', 'tipo', 'stato', 'created_by', 'created_at', 'completato_il')
+    list_filter = ('stato', 'tipo')
+    readonly_fields = ('parametri', 'errore', 'iniziato_il', 'completato_il')
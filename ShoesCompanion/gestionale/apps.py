@@ -7,6 +7,10 @@ class GestionaleConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'gestionale'
 
+    def ready(self):
+        # Registra i receiver dei segnali (versione distinta base, ecc.)
+        from . import signals  # noqa: F401
+
 # Application definition
 INSTALLED_APPS = [
     'django_tables2',
@@ -0,0 +1,216 @@
+"""
+Strumenti per i benchmark: generazione di dati sintetici e misura di
+tempo, query e memoria. Usati dai comandi di management benchmark_*,
+che lavorano sempre dentro una transazione annullata alla fine, e dal
+test dei budget di query delle viste.
+"""
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.contrib.auth.tokens import default_token_generator
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, get_resolver, reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from .documenti import cache_pdf
+from .models import (Articolo, Cliente, Colore, Componente, DettaglioOrdine, LavoroDocumento,
+                     Modello, Ordine, StrutturaModello, Taglia, TipoComponente, SQ_METER_TO_SQ_FOOT)
+
+
+class RollbackBenchmark(Exception):
+    """Sollevata per annullare la transazione dei dati sintetici."""
+
+
+def genera_dati_sintetici(n_modelli=5, n_componenti=15, n_taglie=30, n_ordini=50,
+                          paia_per_taglia=20, prefisso='BENCH'):
+    """
+    Crea un catalogo sintetico (cliente, modelli con componenti e misure per
+    ogni taglia) e degli ordini con tutte le taglie valorizzate.
+    Usa bulk_create per restare veloce anche con migliaia di righe.
+    """
+    cliente = Cliente.objects.create(nome=f"{prefisso} Cliente")
+    colore = Colore.objects.create(nome=f"{prefisso} Nero", valore_hex='#000000')
+
+    taglie = []
+    for i in range(n_taglie):
+        taglia, _ = Taglia.objects.get_or_create(numero=Decimal('30') + Decimal('0.5') * i)
+        taglie.append(taglia)
+
+    tipi = [TipoComponente.objects.get_or_create(nome=f"{prefisso} Componente {i:02d}")[0] for i in range(n_componenti)]
+    unita = ['SUPERFICIE', 'SUPERFICIE', 'PAIA', 'PEZZI', 'METRI']
+
+    modelli = Modello.objects.bulk_create([
+        Modello(cliente=cliente, nome=f"{prefisso} Modello {i:03d}", codice_articolo=f"ART{i:03d}", forma=f"F{i % 7}")
+        for i in range(n_modelli)
+    ])
+    componenti = Componente.objects.bulk_create([
+        Componente(modello=modello, nome_componente=tipo, unita_misura=unita[j % len(unita)], colore=colore,
+                   descrizione=f"Materiale {j}", cod_componente=f"C{j:03d}", cod_colore=f"K{j % 4}")
+        for modello in modelli for j, tipo in enumerate(tipi)
+    ])
+
+    articoli = []
+    for c, componente in enumerate(componenti):
+        for t, taglia in enumerate(taglie):
+            if componente.unita_misura == 'SUPERFICIE':
+                mq = (Decimal('0.0800') + Decimal('0.0017') * t + Decimal('0.0001') * (c % 11)).quantize(Decimal('0.0001'))
+                articoli.append(Articolo(componente=componente, taglia=taglia, superficie_mq=mq,
+                                         superficie_piedi_quadri=(mq * SQ_METER_TO_SQ_FOOT).quantize(Decimal('0.0001'))))
+            else:
+                articoli.append(Articolo(componente=componente, taglia=taglia,
+                                         quantita_unitaria=Decimal('1.00') + Decimal('0.05') * (t % 5)))
+    Articolo.objects.bulk_create(articoli, batch_size=1000)
+
+    ordini = Ordine.objects.bulk_create([
+        Ordine(modello=modelli[i % n_modelli], stato='CONFERMATO', note=f"{prefisso} ordine {i}")
+        for i in range(n_ordini)
+    ])
+    DettaglioOrdine.objects.bulk_create([
+        DettaglioOrdine(ordine=ordine, taglia=taglia, quantita=paia_per_taglia + (i + t) % 7)
+        for i, ordine in enumerate(ordini) for t, taglia in enumerate(taglie)
+    ], batch_size=1000)
+
+    return {
+        'cliente': cliente,
+        'colore': colore,
+        'taglie': taglie,
+        'tipi': tipi,
+        'modelli': modelli,
+        'componenti': componenti,
+        'ordini': ordini,
+    }
+
+
+def misura(funzione, ripetizioni=1, memoria=True):
+    """
+    Esegue la funzione 'ripetizioni' volte e restituisce un dizionario con
+    tempo medio (ms), query per esecuzione, picco di memoria (KB) e il
+    risultato dell'ultima esecuzione.
+    Il picco di memoria viene misurato in un'esecuzione in più, a parte:
+    tracemalloc rallenta molto il codice e falserebbe i tempi. Con
+    memoria=False la si salta e il picco è None.
+    """
+    tempi = []
+    risultato = None
+    # Conta le query senza il registro di connection.queries, che si ferma
+    # alle ultime 9000 e falserebbe i casi con molte query
+    query = []
+    with connection.execute_wrapper(lambda execute, *args: query.append(1) or execute(*args)):
+        for _ in range(ripetizioni):
+            inizio = time.perf_counter()
+            risultato = funzione()
+            tempi.append(time.perf_counter() - inizio)
+
+    picco = None
+    if memoria:
+        tracemalloc.start()
+        try:
+            funzione()
+            _, picco = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {
+        'tempo_ms': sum(tempi) / len(tempi) * 1000,
+        'query': len(query) / ripetizioni,
+        'picco_kb': picco / 1024 if picco is not None else None,
+        'risultato': risultato,
+    }
+
+
+def esegui_in_rollback(funzione):
+    """Esegue la funzione in una transazione che viene sempre annullata."""
+    risultato = None
+    try:
+        with transaction.atomic():
+            risultato = funzione()
+            raise RollbackBenchmark()
+    except RollbackBenchmark:
+        pass
+    return risultato
+
+
+# --- Misura delle viste ---
+
+URL_ESCLUSI = {
+    'logout': "accetta solo POST",
+}
+# Oggetto del catalogo usato per i parametri di ogni URL
+OGGETTI_URL = {
+    'cliente': ('cliente_detail', 'cliente_update', 'cliente_delete'),
+    'modello': ('modello_detail', 'modello_update', 'modello_delete', 'modello_duplicate', 'modello_misure',
+                'componente_create_for_modello', 'ordine_create_for_modello',
+                'api_load_modello_components', 'scheda_modello_pdf'),
+    'tipo': ('tipocomponente_detail', 'tipocomponente_update', 'tipocomponente_delete'),
+    'componente': ('componente_update', 'componente_delete', 'manage_articoli_componente'),
+    'colore': ('colore_detail', 'colore_update', 'colore_delete'),
+    'taglia': ('taglia_detail', 'taglia_update', 'taglia_delete'),
+    'ordine': ('ordine_detail', 'ordine_update', 'ordine_delete', 'ordine_conferma', 'ordine_annulla',
+               'ordine_genera_bolle', 'dettaglioordine_create_for_ordine',
+               'bolla_ordine_pdf', 'scheda_materiali_pdf'),
+    'struttura': ('strutturamodello_detail', 'strutturamodello_update', 'strutturamodello_delete'),
+    'dettaglio': ('dettaglioordine_update', 'dettaglioordine_delete'),
+    'lavoro': ('lavoro_detail', 'lavoro_stato', 'lavoro_download'),
+}
+
+
+def url_da_misurare():
+    """URL con nome del progetto che rispondono a una GET (l'admin di Django resta fuori)."""
+    return [p for p in get_resolver().url_patterns
+            if isinstance(p, URLPattern) and p.name and p.name not in URL_ESCLUSI]
+
+
+def catalogo_viste(prefisso, utente, **dimensioni):
+    """Dati sintetici con un oggetto per ogni chiave di OGGETTI_URL."""
+    dati = genera_dati_sintetici(prefisso=prefisso, paia_per_taglia=3, **dimensioni)
+    ordine = dati['ordini'][0]
+    struttura = StrutturaModello.objects.create(nome=f"{prefisso} Struttura")
+    struttura.tipi_componente.set(dati['tipi'])
+    lavoro = LavoroDocumento.objects.create(tipo='bolle_lavoro', stato='COMPLETATO', created_by=utente,
+                                            nome_file='bolle.pdf', parametri={'ordine': ordine.pk})
+    lavoro.file.save('bolle.pdf', ContentFile(b'%PDF-1.4\n%%EOF\n'))
+    return {
+        'cliente': dati['cliente'],
+        'modello': dati['modelli'][0],
+        'tipo': dati['tipi'][0],
+        'componente': dati['componenti'][0],
+        'colore': dati['colore'],
+        'taglia': dati['taglie'][0],
+        'ordine': ordine,
+        'struttura': struttura,
+        'dettaglio': ordine.dettagli.first(),
+        'lavoro': lavoro,
+    }
+
+
+def indirizzo_url(pattern, catalogo, utente):
+    if pattern.name == 'password_reset_confirm':
+        return reverse(pattern.name, kwargs={
+            'uidb64': urlsafe_base64_encode(force_bytes(utente.pk)),
+            'token': default_token_generator.make_token(utente),
+        })
+    parametri = pattern.pattern.converters
+    if not parametri:
+        return reverse(pattern.name)
+    chiave = next(chiave for chiave, nomi in OGGETTI_URL.items() if pattern.name in nomi)
+    return reverse(pattern.name, kwargs={nome: catalogo[chiave].pk for nome in parametri})
+
+
+def misura_url(client, url):
+    """
+    GET dell'URL, contenuto in streaming compreso.
+    Restituisce (query eseguite, millisecondi, risposta).
+    """
+    # I PDF vanno generati, non letti dalla cache della misura precedente
+    cache_pdf.svuota()
+    with CaptureQueriesContext(connection) as queries:
+        inizio = time.perf_counter()
+        # Il client chiude la risposta da sé (quelle in streaming una volta lette tutte)
+        response = client.get(url)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        millisecondi = (time.perf_counter() - inizio) * 1000
+    return list(queries.captured_queries), millisecondi, response
@@ -0,0 +1,119 @@
+"""
+Suddivisione di un ordine in bolle di lavoro.
+
+Due modalità:
+- SEQUENZIALE: riempie ogni bolla scorrendo le taglie in ordine (stesso
+  risultato dell'algoritmo storico), in tempo lineare rispetto a taglie e
+  righe prodotte.
+- BILANCIATA: usa il numero minimo di bolle possibile e distribuisce paia e
+  taglie in modo uniforme: le bolle differiscono al più di un paio, e ogni
+  taglia compare in ogni bolla con al più un paio di differenza.
+"""
+from math import ceil
+
+SEQUENZIALE = 'SEQUENZIALE'
+BILANCIATA = 'BILANCIATA'
+
+MODALITA_CHOICES = [
+    (SEQUENZIALE, 'Sequenziale (riempie le bolle taglia per taglia)'),
+    (BILANCIATA, 'Bilanciata (minimo numero di bolle, paia distribuite uniformemente)'),
+]
+
+
+def numero_minimo_bolle(quantita, max_totale, max_per_taglia=None):
+    """
+    Numero minimo di bolle che rispetta i vincoli: basta che il totale stia in
+    max_totale per bolla e che ogni taglia stia in max_per_taglia per bolla.
+    """
+    totale = sum(quantita)
+    if totale == 0:
+        return 0
+    bolle = ceil(totale / max_totale)
+    if max_per_taglia:
+        bolle = max(bolle, max(ceil(q / max_per_taglia) for q in quantita))
+    return bolle
+
+
+def _sequenziale(taglie, quantita, max_totale, max_per_taglia):
+    # Lista concatenata delle taglie ancora da distribuire: ogni bolla visita
+    # solo taglie non esaurite e si ferma appena è piena, quindi ogni visita
+    # aggiunge almeno un paio. Costo O(taglie + righe delle bolle).
+    n = len(taglie)
+    rimanenti = list(quantita)
+    successiva = list(range(1, n + 1))
+    testa = 0
+
+    bolle = []
+    while testa < n:
+        bolla = {}
+        spazio = max_totale
+        precedente = None
+        i = testa
+        while i < n and spazio > 0:
+            da_aggiungere = min(rimanenti[i], max_per_taglia or rimanenti[i], spazio)
+            bolla[taglie[i]] = da_aggiungere
+            spazio -= da_aggiungere
+            rimanenti[i] -= da_aggiungere
+            if rimanenti[i] == 0:
+                # Taglia esaurita: la si toglie dalla lista
+                if precedente is None:
+                    testa = successiva[i]
+                else:
+                    successiva[precedente] = successiva[i]
+            else:
+                precedente = i
+            i = successiva[i]
+        bolle.append(bolla)
+    return bolle
+
+
+def _bilanciata(taglie, quantita, max_totale, max_per_taglia):
+    # Con B bolle ogni taglia ne riceve q // B in ogni bolla; i q % B paia
+    # restanti vanno a bolle consecutive, con un cursore circolare condiviso
+    # tra le taglie, così anche i totali delle bolle differiscono al più di uno.
+    # Per costruzione nessuna bolla supera ceil(totale / B) <= max_totale paia
+    # né ceil(q / B) <= max_per_taglia paia di una taglia.
+    numero_bolle = numero_minimo_bolle(quantita, max_totale, max_per_taglia)
+    bolle = [{} for _ in range(numero_bolle)]
+    cursore = 0
+    for taglia, q in zip(taglie, quantita):
+        base, resto = divmod(q, numero_bolle)
+        if base:
+            for bolla in bolle:
+                bolla[taglia] = base
+        for k in range(resto):
+            bolle[(cursore + k) % numero_bolle][taglia] = base + 1
+        cursore = (cursore + resto) % numero_bolle
+    return bolle
+
+
+def distribuisci_bolle(quantita_per_taglia, max_totale, max_per_taglia=None, modalita=SEQUENZIALE):
+    """
+    Suddivide le quantità in bolle di lavoro.
+    - quantita_per_taglia: coppie (taglia, quantita) già nell'ordine di stampa
+    - max_totale: paia massime per bolla
+    - max_per_taglia: paia massime di una stessa taglia per bolla (None = nessun limite)
+    Restituisce una lista di dizionari {taglia: quantita}, senza quantità nulle.
+    """
+    if max_totale < 1 or (max_per_taglia is not None and max_per_taglia < 1):
+        raise ValueError("I limiti delle bolle devono essere almeno 1.")
+    taglie, quantita = [], []
+    for taglia, q in quantita_per_taglia:
+        if q and q > 0:
+            taglie.append(taglia)
+            quantita.append(q)
+
+    if modalita == BILANCIATA:
+        return _bilanciata(taglie, quantita, max_totale, max_per_taglia)
+    if modalita == SEQUENZIALE:
+        return _sequenziale(taglie, quantita, max_totale, max_per_taglia)
+    raise ValueError(f"Modalità di suddivisione sconosciuta: {modalita}")
+
+
+def crea_distribuzione_bolle(dettagli_ordine, max_totale, max_per_taglia=None, modalita=SEQUENZIALE):
+    """
+    Suddivide i dettagli di un ordine (con la taglia caricata) in bolle di lavoro.
+    """
+    # Ordinamento in Python: funziona anche con i dettagli già precaricati
+    dettagli = sorted(dettagli_ordine, key=lambda d: d.taglia.numero)
+    return distribuisci_bolle(((d.taglia, d.quantita) for d in dettagli), max_totale, max_per_taglia, modalita)
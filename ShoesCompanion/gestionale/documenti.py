@@ -0,0 +1,480 @@
+"""
+Documenti PDF (bolle, schede materiali e schede modello) e cache su disco
+dei file generati.
+
+I generatori scrivono il PDF in un file già aperto; documento_pdf() li
+richiama solo quando gli input del documento sono cambiati, altrimenti
+restituisce il file salvato sotto MEDIA_ROOT.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from django.conf import settings
+from django.db.models import Prefetch, Sum
+from reportlab.lib.units import cm
+from reportlab.platypus import PageBreak, Paragraph, Spacer, Table
+
+from .bolle import SEQUENZIALE, crea_distribuzione_bolle
+from .layout_pdf import (BOLLA_ETICHETTA, BOLLA_VALORE, COMPONENTE_DETTAGLI, COMPONENTE_ETICHETTA,
+                         COMPONENTE_TITOLO, COMPONENTE_VALORE, ETICHETTA, INTESTAZIONE_COMPONENTI_BOLLA,
+                         INTESTAZIONE_TABELLA, SEZIONE, STILE_COMPONENTI, STILE_COMPONENTI_BOLLA,
+                         STILE_INTESTAZIONE, STILE_MATERIALI, STILE_MISURE, STILE_NOTE, STILE_NUMERAZIONE,
+                         STILE_TITOLO_COMPONENTE, STILI, TITOLO, TOTALE, VALORE, DatiBolla, DocumentoBolle,
+                         ParagrafoRipetuto, dettagli_materiale, documento_a4, foto_modello)
+from .materiali import distinta_base_ordine, distinte_base_ordini, riepilogo_materiali
+from .models import DettaglioOrdine, Modello, Taglia
+
+
+# ==============================================================================
+# GENERAZIONE DEI DOCUMENTI
+# ==============================================================================
+
+def genera_bolla_ordine(ordine, destinazione):
+    """Bolla d'ordine: intestazione, numerazione completa e distinta componenti."""
+    # Usiamo margini più stretti per far stare tutto comodamente
+    doc = documento_a4(destinazione, 1.5*cm)
+    elements = [Paragraph("Bolla d'Ordine", TITOLO)]
+
+    # --- INTESTAZIONE DETTAGLIATA ---
+    info_header_data = [
+        [
+            Paragraph(f"<b>Ordine N:</b> {ordine.id}<br/>"
+                      f"<b>Data:</b> {ordine.data_ordine.strftime('%d/%m/%Y')}<br/>"
+                      f"<b>Cliente:</b> {ordine.modello.cliente.nome}", STILI['Normal']),
+            Paragraph(f"<b>Modello:</b> {ordine.modello.nome}<br/>"
+                      f"<b>Articolo:</b> {ordine.modello.codice_articolo or '-'}<br/>"
+                      f"<b>Forma:</b> {ordine.modello.forma or '-'}", STILI['Normal']),
+            foto_modello(ordine.modello)
+        ]
+    ]
+    elements.append(Table(info_header_data, colWidths=[7*cm, 7*cm, 4*cm], style=STILE_INTESTAZIONE))
+
+    # --- TABELLA NUMERAZIONE COMPLETA ---
+    elements.append(Paragraph("Dettagli Quantità per Taglia", SEZIONE))
+    
+    tutte_le_taglie = Taglia.objects.order_by('numero').all()
+    dettagli_map = {d.taglia_id: d for d in ordine.dettagli.all()}
+
+    header_row = [Paragraph(str(t), ETICHETTA) for t in tutte_le_taglie]
+    quantita_row = [Paragraph(str(dettagli_map.get(t.pk).quantita if t.pk in dettagli_map else ''), VALORE) for t in tutte_le_taglie]
+    
+    col_width = (18 * cm) / len(tutte_le_taglie) # Larghezza colonne dinamica
+    elements.append(Table([header_row, quantita_row], colWidths=[col_width]*len(header_row), style=STILE_NUMERAZIONE))
+    
+    # Aggiungiamo il totale paia
+    elements.append(Spacer(1, 0.2*cm))
+    elements.append(Paragraph(f"<b>TOTALE PAIA: {ordine.quantita_totale}</b>", TOTALE))
+    elements.append(Spacer(1, 0.5*cm))
+
+    # --- SEZIONE COMPONENTI DINAMICA ---
+    elements.append(Paragraph("Distinta Componenti", SEZIONE))
+    
+    componenti_del_modello = distinta_base_ordine(ordine).componenti
+    if componenti_del_modello:
+        componenti_data = [[
+            Paragraph('COMPONENTE', ETICHETTA),
+            Paragraph('MATERIALE / DETTAGLI', ETICHETTA)
+        ]]
+        for comp in componenti_del_modello:
+            componenti_data.append([
+                Paragraph(comp.nome_componente.nome, COMPONENTE_ETICHETTA),
+                dettagli_materiale(comp.descrizione, comp.colore, comp.cod_componente, comp.cod_colore, COMPONENTE_VALORE)
+            ])
+        elements.append(Table(componenti_data, colWidths=[5*cm, 13*cm], style=STILE_COMPONENTI))
+    else:
+        elements.append(Paragraph("Nessun componente di base definito per questo modello.", STILI['Italic']))
+        
+    # --- NOTE ---
+    if ordine.note:
+        elements.append(Spacer(1, 0.5*cm))
+        elements.append(Table([[Paragraph('NOTE ORDINE', SEZIONE)], [Paragraph(ordine.note, COMPONENTE_VALORE)]],
+                              colWidths=[18*cm], rowHeights=[None, 2*cm], style=STILE_NOTE))
+
+    doc.build(elements)
+
+def genera_scheda_materiali(ordine, destinazione):
+    """Scheda materiali: fabbisogno totale dell'ordine per componente."""
+    materiali = riepilogo_materiali(ordine)
+    
+    doc = documento_a4(destinazione, 2*cm)
+    elements = [Paragraph("", TITOLO)]
+
+    # --- INTESTAZIONE CON DETTAGLI ORDINE E FOTO ---
+    quantita_totale = ordine.dettagli.aggregate(Sum('quantita'))['quantita__sum'] or 0
+    
+    info_header_data = [
+        [
+            Paragraph(f"<b>Ordine N:</b> {ordine.id}<br/>"
+                      f"<b>Data:</b> {ordine.data_ordine.strftime('%d/%m/%Y')}<br/>"
+                      f"<b>Cliente:</b> {ordine.modello.cliente.nome}", STILI['Normal']),
+            Paragraph(f"<b>Modello:</b> {ordine.modello.nome}<br/>"
+                      f"<b>Articolo:</b> {ordine.modello.codice_articolo or '-'}<br/>"
+                      f"<b>Totale Paia:</b> {quantita_totale}", STILI['Normal']),
+            foto_modello(ordine.modello)
+        ]
+    ]
+    elements.append(Table(info_header_data, colWidths=[7*cm, 6*cm, 4*cm], style=STILE_INTESTAZIONE))
+    elements.append(Spacer(1, 1*cm))
+
+    # --- TABELLA MATERIALI DINAMICA ---
+    elements.append(Paragraph("Riepilogo Fabbisogno per Componente", STILI['h2']))
+
+    if materiali:
+        data_materiali = [[
+            Paragraph('COMPONENTE', INTESTAZIONE_TABELLA),
+            Paragraph('MATERIALE / DETTAGLI', INTESTAZIONE_TABELLA),
+            Paragraph('QUANTITÀ TOTALE', INTESTAZIONE_TABELLA)
+        ]]
+        
+        for key, misure in sorted(materiali.items()):
+            nome_comp, colore, desc, cod_comp, cod_col = key
+            
+            if misure['unita_misura'] == 'SUPERFICIE':
+                quantita_str = (
+                    f"<b>{misure['tot_superficie_mq']:.4f}</b> m²<br/>"
+                    f"<i>({misure['tot_superficie_piedi_quadri']:.4f} ft²)</i>"
+                )
+            else:
+                quantita_str = f"<b>{misure['tot_quantita_unitaria']:.2f}</b> {misure['unita_misura_display']}"
+            
+            data_materiali.append([
+                Paragraph(nome_comp, STILI['Normal']),
+                dettagli_materiale(desc, colore, cod_comp, cod_col, STILI['Normal']),
+                Paragraph(quantita_str, STILI['Normal'])
+            ])
+            
+        elements.append(Table(data_materiali, colWidths=[4*cm, 9*cm, 4*cm], style=STILE_MATERIALI))
+    else:
+        elements.append(Paragraph("Nessun materiale calcolato per questo ordine.", STILI['Italic']))
+    
+    doc.build(elements)
+
+
+def genera_scheda_modello(modello, destinazione):
+    """Scheda tecnica: componenti del modello con le misure per ogni taglia."""
+    doc = documento_a4(destinazione, 2*cm)
+    elements = [Paragraph("Scheda Tecnica Modello", TITOLO)]
+
+    # --- INTESTAZIONE CON DETTAGLI MODELLO ---
+    info_header_data = [
+        [
+            Paragraph(f"<b>Modello:</b> {modello.nome}<br/>"
+                      f"<b>Articolo:</b> {modello.codice_articolo or '-'}<br/>"
+                      f"<b>Forma:</b> {modello.forma or '-'}", STILI['Normal']),
+            Paragraph(f"<b>Cliente:</b> {modello.cliente.nome}<br/>"
+                      f"<b>Tipo:</b> {modello.get_tipo_display()}", STILI['Normal']),
+            foto_modello(modello)
+        ]
+    ]
+    elements.append(Table(info_header_data, colWidths=[7*cm, 6*cm, 4*cm], style=STILE_INTESTAZIONE))
+    elements.append(Spacer(1, 0.8*cm))
+    
+    # --- SEZIONE COMPONENTI E MISURE ---
+    elements.append(Paragraph("Distinta Base e Misure per Taglia", STILI['h2']))
+    
+    tutte_le_taglie = Taglia.objects.order_by('numero').all()
+
+    for componente in modello.componenti.select_related('nome_componente', 'colore').prefetch_related('articoli'):
+        elements.append(Spacer(1, 0.5*cm))
+        
+        # Dettagli componente
+        colore_info = f"<b>Colore:</b> {componente.colore.nome if componente.colore else '-'}"
+        codici_info = f"<b>Cod. Art:</b> {componente.cod_componente or '-'} / <b>Cod. Col:</b> {componente.cod_colore or '-'}"
+        component_details_text = f"{componente.descrizione or '-'}<br/>{colore_info}<br/>{codici_info}"
+        
+        elements.append(Table([
+            [
+                Paragraph(f"{componente.nome_componente.nome}", COMPONENTE_TITOLO),
+                Paragraph(component_details_text, COMPONENTE_DETTAGLI)
+            ]
+        ], colWidths=[5*cm, 12*cm], style=STILE_TITOLO_COMPONENTE))
+        elements.append(Spacer(1, 0.2*cm))
+        
+        # Tabella Misure per il componente
+        articoli_map = {art.taglia_id: art for art in componente.articoli.all()}
+        
+        if componente.unita_misura == 'SUPERFICIE':
+            data_articoli = [['Taglia', 'Superficie (m²)', 'Superficie (ft²)']]
+            for taglia in tutte_le_taglie:
+                articolo = articoli_map.get(taglia.pk)
+                mq_str = f"{articolo.superficie_mq:.4f}" if articolo and articolo.superficie_mq is not None else "N/D"
+                pq_str = f"{articolo.superficie_piedi_quadri:.4f}" if articolo and articolo.superficie_piedi_quadri is not None else "N/D"
+                data_articoli.append([str(taglia), mq_str, pq_str])
+            col_widths = [2*cm, 3*cm, 3*cm]
+        else: # PEZZI, PAIA, METRI
+            data_articoli = [['Taglia', f"Quantità ({componente.get_unita_misura_display()})"]]
+            for taglia in tutte_le_taglie:
+                articolo = articoli_map.get(taglia.pk)
+                qta_str = f"{articolo.quantita_unitaria:.2f}" if articolo and articolo.quantita_unitaria is not None else "N/D"
+                data_articoli.append([str(taglia), qta_str])
+            col_widths = [2*cm, 4*cm]
+            
+        elements.append(Table(data_articoli, colWidths=col_widths, style=STILE_MISURE))
+
+    # --- SEZIONE NOTE FINALE ---
+    if modello.note:
+        elements.append(Spacer(1, 1*cm))
+        elements.append(Paragraph("Note sul Modello", STILI['h2']))
+        elements.append(Paragraph(modello.note.replace('\n', '<br/>'), STILI['BodyText']))
+        
+    doc.build(elements)
+
+
+def _quantita_bolla(misure):
+    if misure['unita_misura'] == 'SUPERFICIE':
+        return f"{misure['tot_superficie_mq']:.4f} m²\n{misure['tot_superficie_piedi_quadri']:.4f} ft²"
+    return f"{misure['tot_quantita_unitaria']:.2f} {misure['unita_misura_display']}"
+
+
+def elementi_bolle_ordine(ordine, bolle_distribuite, materiali_bolle):
+    """
+    Elementi PDF delle bolle di un ordine per DocumentoBolle: i dati della
+    bolla per la cornice della pagina e la tabella dei componenti.
+    - materiali_bolle: fabbisogno di ogni bolla, nello stesso ordine delle bolle
+    """
+    # Nome e descrizione dei materiali sono uguali in tutte le bolle dell'ordine:
+    # i paragrafi si compongono una volta, ogni bolla cambia solo le quantità
+    paragrafi = {}
+    note = Paragraph(ordine.note, BOLLA_VALORE) if ordine.note else None
+
+    elements = []
+    total_bolle = len(bolle_distribuite)
+    for i, (bolla, materiali_per_bolla) in enumerate(zip(bolle_distribuite, materiali_bolle), 1):
+        elements.append(DatiBolla(ordine, i, total_bolle, bolla, note))
+
+        componenti_data = [INTESTAZIONE_COMPONENTI_BOLLA]
+        for key, misure in materiali_per_bolla.items():
+            if key not in paragrafi:
+                nome_comp, colore, desc, cod_comp, cod_col = key
+                paragrafi[key] = (ParagrafoRipetuto(Paragraph(nome_comp, BOLLA_ETICHETTA)),
+                                  ParagrafoRipetuto(dettagli_materiale(desc, colore, cod_comp, cod_col, BOLLA_VALORE)))
+            componenti_data.append([*paragrafi[key], _quantita_bolla(misure)])
+        elements.append(Table(componenti_data, colWidths=[4*cm, 11*cm, 4*cm], repeatRows=1,
+                              style=STILE_COMPONENTI_BOLLA))
+
+        if i < total_bolle:
+            elements.append(PageBreak())
+
+    return elements
+
+
+def genera_bolle_lavoro(ordine, destinazione, max_totale, max_per_taglia=None, modalita=SEQUENZIALE):
+    """Bolle di lavoro di un ordine, suddiviso secondo i vincoli indicati."""
+    dettagli = ordine.dettagli.select_related('taglia').all()
+    bolle_distribuite = crea_distribuzione_bolle(dettagli, max_totale, max_per_taglia, modalita)
+
+    # Distinta base (congelata se l'ordine è confermato) caricata una volta:
+    # i materiali di tutte le bolle in un solo prodotto matriciale
+    materiali_bolle = distinta_base_ordine(ordine).fabbisogno_bolle(bolle_distribuite)
+
+    # Recupera tutte le taglie una sola volta
+    doc = DocumentoBolle(destinazione, Taglia.objects.order_by('numero'))
+    doc.build(elementi_bolle_ordine(ordine, bolle_distribuite, materiali_bolle))
+
+
+def prepara_ordini_bolle(ordini):
+    """Ordini pronti per le bolle: raggruppati per modello e con i dettagli già caricati."""
+    return (
+        ordini.select_related('modello', 'modello__cliente')
+        .prefetch_related(Prefetch('dettagli', queryset=DettaglioOrdine.objects.select_related('taglia')))
+        .order_by('modello__nome', 'modello_id', 'data_consegna', 'pk')
+    )
+
+
+def genera_bolle_ordini(ordini, destinazione, max_totale, max_per_taglia=None, modalita=SEQUENZIALE):
+    """
+    Bolle di lavoro di più ordini in un unico documento, nell'ordine ricevuto.
+    Restituisce il numero di bolle: se è zero il documento non viene scritto.
+    """
+    # Distinte base di tutti gli ordini: una per modello (o quella congelata dell'ordine)
+    distinte = distinte_base_ordini(ordini)
+
+    elements = []
+    numero_bolle = 0
+    for ordine in ordini:
+        bolle_distribuite = crea_distribuzione_bolle(ordine.dettagli.all(), max_totale, max_per_taglia, modalita)
+        if not bolle_distribuite:
+            continue
+        materiali_bolle = distinte[ordine.pk].fabbisogno_bolle(bolle_distribuite)
+        if elements:
+            elements.append(PageBreak())
+        elements.extend(elementi_bolle_ordine(ordine, bolle_distribuite, materiali_bolle))
+        numero_bolle += len(bolle_distribuite)
+
+    if numero_bolle:
+        DocumentoBolle(destinazione, Taglia.objects.order_by('numero')).build(elements)
+    return numero_bolle
+
+
+GENERATORI = {
+    'bolla_ordine': genera_bolla_ordine,
+    'scheda_materiali': genera_scheda_materiali,
+    'scheda_modello': genera_scheda_modello,
+    'bolle_lavoro': genera_bolle_lavoro,
+}
+
+
+# ==============================================================================
+# CACHE DEI PDF SU DISCO
+# ==============================================================================
+
+# Da incrementare quando cambia l'impaginazione: invalida tutti i PDF in cache
+VERSIONE_LAYOUT = 3
+
+
+def impronta_modello(modello):
+    """Tutto ciò da cui dipende un documento del modello (il cliente deve essere già caricato)."""
+    return {
+        'modello': [modello.pk, modello.updated_at, modello.bom_versione, modello.foto.name or None],
+        'cliente': [modello.cliente_id, modello.cliente.updated_at],
+        'taglie': list(Taglia.objects.order_by('numero').values_list('id', 'numero')),
+    }
+
+
+def impronta_ordine(ordine):
+    """Tutto ciò da cui dipende un documento dell'ordine (modello e cliente già caricati)."""
+    impronta = impronta_modello(ordine.modello)
+    impronta['ordine'] = [ordine.pk, ordine.updated_at, ordine.distinta_congelata_il]
+    impronta['dettagli'] = list(ordine.dettagli.order_by('taglia_id').values_list('taglia_id', 'quantita'))
+    return impronta
+
+
+def chiave_documento(tipo, impronta, parametri=None):
+    """Hash SHA-256 degli input del documento: a input uguali corrisponde lo stesso file."""
+    contenuto = json.dumps([VERSIONE_LAYOUT, tipo, impronta, parametri or {}], sort_keys=True, default=str)
+    return hashlib.sha256(contenuto.encode()).hexdigest()
+
+
+class CachePDF:
+    """
+    PDF generati, salvati sotto MEDIA_ROOT con il nome dato dalla chiave.
+    Un file non viene mai modificato: quando gli input cambiano cambia la
+    chiave, e i file non più usati escono per primi quando la cartella supera
+    la dimensione massima (l'ultimo accesso è la data di modifica del file).
+    """
+
+    def __init__(self, sottocartella='cache_pdf', dimensione_massima=200 * 1024 * 1024):
+        self.sottocartella = sottocartella
+        self.dimensione_massima = dimensione_massima
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cartella(self):
+        # Letta ogni volta: MEDIA_ROOT può cambiare (es. nei test)
+        return os.path.join(settings.MEDIA_ROOT, self.sottocartella)
+
+    def percorso(self, chiave):
+        return os.path.join(self.cartella, chiave[:2], f"{chiave}.pdf")
+
+    def contiene(self, chiave):
+        return os.path.exists(self.percorso(chiave))
+
+    def ottieni(self, chiave, genera):
+        """
+        Restituisce il PDF della chiave aperto in lettura; se manca lo crea
+        chiamando genera(file). Il file aperto resta leggibile anche se nel
+        frattempo un altro processo lo elimina dalla cache.
+        """
+        percorso = self.percorso(chiave)
+        try:
+            file = open(percorso, 'rb')
+        except FileNotFoundError:
+            pass
+        else:
+            os.utime(percorso)
+            with self._lock:
+                self.hits += 1
+            return file
+
+        with self._lock:
+            self.misses += 1
+        os.makedirs(os.path.dirname(percorso), exist_ok=True)
+        # Scrittura in un file temporaneo e rinomina: nessuno legge mai un PDF a metà
+        descrittore, temporaneo = tempfile.mkstemp(dir=os.path.dirname(percorso), suffix='.tmp')
+        try:
+            with os.fdopen(descrittore, 'wb') as destinazione:
+                genera(destinazione)
+            os.replace(temporaneo, percorso)
+        except BaseException:
+            os.unlink(temporaneo)
+            raise
+        file = open(percorso, 'rb')
+        self.riduci(conserva=percorso)
+        return file
+
+    def _file(self):
+        for cartella, _, nomi in os.walk(self.cartella):
+            for nome in nomi:
+                if nome.endswith('.pdf'):
+                    percorso = os.path.join(cartella, nome)
+                    try:
+                        stato = os.stat(percorso)
+                    except FileNotFoundError:
+                        continue
+                    yield stato.st_mtime, stato.st_size, percorso
+
+    def riduci(self, conserva=None):
+        """Elimina i PDF usati meno di recente finché la cache non torna sotto il 90% del limite."""
+        file = sorted(self._file())
+        totale = sum(dimensione for _, dimensione, _ in file)
+        if totale <= self.dimensione_massima:
+            return
+        obiettivo = self.dimensione_massima * 0.9
+        for _, dimensione, percorso in file:
+            if totale <= obiettivo:
+                break
+            if percorso == conserva:
+                continue
+            try:
+                os.remove(percorso)
+            except FileNotFoundError:
+                pass
+            totale -= dimensione
+
+    def statistiche(self):
+        file = list(self._file())
+        return {
+            'file': len(file),
+            'dimensione': sum(dimensione for _, dimensione, _ in file),
+            'dimensione_massima': self.dimensione_massima,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def svuota(self):
+        shutil.rmtree(self.cartella, ignore_errors=True)
+
+
+cache_pdf = CachePDF(dimensione_massima=getattr(settings, 'PDF_CACHE_DIMENSIONE_MB', 200) * 1024 * 1024)
+
+
+def chiave_pdf(tipo, oggetto, **parametri):
+    """Chiave di cache del documento 'tipo' per l'oggetto (Modello o Ordine) e i parametri."""
+    impronta = impronta_modello(oggetto) if isinstance(oggetto, Modello) else impronta_ordine(oggetto)
+    return chiave_documento(tipo, impronta, parametri)
+
+
+def documento_pdf(tipo, oggetto, chiave=None, **parametri):
+    """
+    PDF di un documento (vedi GENERATORI) aperto in lettura, preso dalla
+    cache se nessun input è cambiato dall'ultima generazione.
+    - oggetto: Modello per 'scheda_modello', Ordine per gli altri tipi
+    - chiave: chiave già calcolata con chiave_pdf(), per non ricalcolarla
+    - parametri: argomenti aggiuntivi del generatore (es. vincoli delle bolle)
+    """
+    chiave = chiave or chiave_pdf(tipo, oggetto, **parametri)
+    return cache_pdf.ottieni(chiave, lambda destinazione: GENERATORI[tipo](oggetto, destinazione, **parametri))
+
+
+def pdf_temporaneo():
+    """
+    File temporaneo per un PDF da inviare senza metterlo in cache: resta in
+    memoria finché è piccolo, oltre PDF_IN_MEMORIA_KB passa su disco.
+    """
+    return tempfile.SpooledTemporaryFile(max_size=getattr(settings, 'PDF_IN_MEMORIA_KB', 1024) * 1024)
@@ -0,0 +1,144 @@
+"""
+Esportazione in blocco dei documenti PDF in un archivio ZIP in streaming.
+
+I documenti vengono generati in parallelo da un pool di processi (che li
+salva nella cache dei PDF) e aggiunti all'archivio man mano che sono
+pronti: il client riceve i primi byte subito e il processo web tiene in
+memoria solo un blocco alla volta, mai l'archivio intero.
+"""
+import multiprocessing
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.conf import settings
+
+from .documenti import documento_pdf
+from .models import Modello, Ordine
+
+DIMENSIONE_BLOCCO = 64 * 1024
+
+TIPI_ORDINE = ('bolla_ordine', 'scheda_materiali')
+TIPI_MODELLO = ('scheda_modello',)
+
+
+class FlussoZip:
+    """
+    Destinazione non posizionabile per zipfile: accumula i byte scritti
+    finché il generatore della risposta non li preleva con svuota().
+    """
+
+    def __init__(self):
+        self._blocchi = []
+
+    def write(self, dati):
+        self._blocchi.append(bytes(dati))
+        return len(dati)
+
+    def flush(self):
+        pass
+
+    def svuota(self):
+        dati = b''.join(self._blocchi)
+        self._blocchi = []
+        return dati
+
+
+def _carica(tipo, pk):
+    if tipo in TIPI_MODELLO:
+        return Modello.objects.select_related('cliente').get(pk=pk)
+    return Ordine.objects.select_related('modello', 'modello__cliente').get(pk=pk)
+
+
+def prepara_documento(tipo, pk):
+    """
+    Genera (o trova in cache) un documento e ne restituisce il percorso.
+    Gira nei processi del pool: al processo web torna solo il percorso.
+    """
+    with documento_pdf(tipo, _carica(tipo, pk)) as pdf:
+        return pdf.name
+
+
+def apri_documento(tipo, pk, percorso):
+    """Apre il PDF preparato; se nel frattempo è uscito dalla cache lo rigenera."""
+    try:
+        return open(percorso, 'rb')
+    except FileNotFoundError:
+        return documento_pdf(tipo, _carica(tipo, pk))
+
+
+def documenti_da_esportare(ordini=(), modelli=(), tipi=TIPI_ORDINE + TIPI_MODELLO):
+    """Elenco (tipo, pk, nome nell'archivio) dei documenti richiesti."""
+    documenti = []
+    for tipo in tipi:
+        oggetti = modelli if tipo in TIPI_MODELLO else ordini
+        for pk in oggetti:
+            documenti.append((tipo, pk, f"{tipo}_{pk}.pdf"))
+    return documenti
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _pool_esportazione(processi):
+    # Un solo pool per processo web, creato alla prima esportazione. 'spawn'
+    # evita di duplicare con fork un server multi-thread e le sue connessioni;
+    # i nuovi processi devono solo configurare Django prima del primo lavoro.
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=processi, mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=django.setup)
+        return _pool
+
+
+def _documenti_pronti(documenti, processi):
+    """Restituisce (tipo, pk, nome, percorso, errore) nell'ordine in cui i documenti sono pronti."""
+    if not processi:
+        for tipo, pk, nome in documenti:
+            try:
+                yield tipo, pk, nome, prepara_documento(tipo, pk), None
+            except Exception as errore:
+                yield tipo, pk, nome, None, errore
+        return
+
+    pool = _pool_esportazione(processi)
+    futuri = {pool.submit(prepara_documento, tipo, pk): (tipo, pk, nome) for tipo, pk, nome in documenti}
+    try:
+        for futuro in as_completed(futuri):
+            tipo, pk, nome = futuri[futuro]
+            try:
+                yield tipo, pk, nome, futuro.result(), None
+            except Exception as errore:
+                yield tipo, pk, nome, None, errore
+    finally:
+        # Download interrotto: i documenti non ancora avviati non servono più
+        for futuro in futuri:
+            futuro.cancel()
+
+
+def zip_documenti(documenti, processi=None):
+    """
+    Generatore dei byte di un archivio ZIP con i documenti indicati.
+    I PDF sono già compressi, quindi vengono archiviati senza ricomprimerli.
+    """
+    if processi is None:
+        processi = getattr(settings, 'ESPORTAZIONE_PROCESSI', 2)
+    flusso = FlussoZip()
+    errori = []
+    with zipfile.ZipFile(flusso, 'w', compression=zipfile.ZIP_STORED) as archivio:
+        for tipo, pk, nome, percorso, errore in _documenti_pronti(documenti, processi):
+            if errore is not None:
+                errori.append(f"{nome}: {errore}")
+                continue
+            with apri_documento(tipo, pk, percorso) as pdf, archivio.open(nome, 'w', force_zip64=True) as voce:
+                while blocco := pdf.read(DIMENSIONE_BLOCCO):
+                    voce.write(blocco)
+                    if dati := flusso.svuota():
+                        yield dati
+        if errori:
+            archivio.writestr('ERRORI.txt', "\n".join(errori))
+    # Intestazioni locali rimaste e indice centrale dell'archivio
+    yield flusso.svuota()
@@ -31,6 +31,11 @@ class OrdineFilter(django_filters.FilterSet):
         queryset=Cliente.objects.all(),
         label='Cliente'
     )
+    # Il nome del modello nelle opzioni include il cliente
+    modello = django_filters.ModelChoiceFilter(
+        queryset=Modello.objects.select_related('cliente'),
+        label='Modello'
+    )
 
     class Meta:
         model = Ordine
@@ -1,5 +1,11 @@
 from django import forms
-from django.forms import inlineformset_factory
+from django.conf import settings
+from django.db import transaction
+from django.forms import BaseInlineFormSet, inlineformset_factory
+from .bolle import MODALITA_CHOICES, SEQUENZIALE
+from .documenti import prepara_ordini_bolle
+from .importazione import ESTENSIONI, openpyxl
+from .materiali import incrementa_versione_bom
 from .models import (
     Cliente, Modello, Componente, Colore, Ordine, DettaglioOrdine,
     TipoComponente, Taglia, Articolo, StrutturaModello
@@ -45,6 +51,88 @@ class ModelloForm(forms.ModelForm):
             'note': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
         }
 
+class IntervalloTaglieForm(forms.Form):
+    """Intervallo di taglie per cui creare subito la griglia degli Articoli (ancora vuoti)."""
+    taglia_da = forms.ModelChoiceField(
+        queryset=Taglia.objects.all(), required=False, label="Griglia misure: dalla taglia",
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    taglia_a = forms.ModelChoiceField(
+        queryset=Taglia.objects.all(), required=False, label="alla taglia",
+        help_text="Facoltativo: crea le righe delle misure di ogni componente per queste taglie.",
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        taglia_da, taglia_a = cleaned_data.get('taglia_da'), cleaned_data.get('taglia_a')
+        if bool(taglia_da) != bool(taglia_a):
+            self.add_error('taglia_a', "Indica sia la prima che l'ultima taglia.")
+        elif taglia_da and taglia_da.numero > taglia_a.numero:
+            self.add_error('taglia_a', "L'ultima taglia deve essere maggiore della prima.")
+        return cleaned_data
+
+    def taglie_griglia(self):
+        taglia_da, taglia_a = self.cleaned_data.get('taglia_da'), self.cleaned_data.get('taglia_a')
+        if not taglia_da or not taglia_a:
+            return []
+        return list(Taglia.objects.filter(numero__gte=taglia_da.numero, numero__lte=taglia_a.numero))
+
+
+class ModelloCreateForm(IntervalloTaglieForm, ModelloForm):
+    pass
+
+
+class ModelliInBloccoForm(IntervalloTaglieForm):
+    """
+    Creazione di una collezione di modelli: una riga per modello nel formato
+    "nome; codice articolo; forma" (codice e forma facoltativi).
+    """
+    cliente = forms.ModelChoiceField(queryset=Cliente.objects.all(), widget=forms.Select(attrs={'class': 'form-select'}))
+    struttura = forms.ModelChoiceField(queryset=StrutturaModello.objects.all(),
+                                       widget=forms.Select(attrs={'class': 'form-select'}))
+    tipo = forms.ChoiceField(choices=Modello.TIPO_SCARPA_CHOICES, initial='CASUAL',
+                             widget=forms.Select(attrs={'class': 'form-select'}))
+    righe = forms.CharField(
+        label="Modelli", help_text="Uno per riga: nome; codice articolo; forma",
+        widget=forms.Textarea(attrs={'class': 'form-control', 'rows': 12})
+    )
+
+    field_order = ['cliente', 'struttura', 'tipo', 'righe', 'taglia_da', 'taglia_a']
+
+    def clean_righe(self):
+        massimo = getattr(settings, 'MODELLI_IN_BLOCCO_MAX', 500)
+        modelli, errori, nomi = [], [], set()
+        for numero, riga in enumerate(self.cleaned_data['righe'].splitlines(), start=1):
+            if not riga.strip():
+                continue
+            nome, codice_articolo, forma = ([parte.strip() for parte in riga.split(';')] + ['', ''])[:3]
+            if not nome or riga.count(';') > 2:
+                errori.append(f"Riga {numero}: formato non valido.")
+            elif nome in nomi:
+                errori.append(f"Riga {numero}: '{nome}' è ripetuto.")
+            else:
+                nomi.add(nome)
+                modelli.append({'nome': nome, 'codice_articolo': codice_articolo or None, 'forma': forma or None})
+        if errori:
+            raise forms.ValidationError(errori)
+        if not modelli:
+            raise forms.ValidationError("Inserisci almeno un modello.")
+        if len(modelli) > massimo:
+            raise forms.ValidationError(f"Si possono creare al massimo {massimo} modelli alla volta.")
+        return modelli
+
+    def clean(self):
+        cleaned_data = super().clean()
+        cliente, modelli = cleaned_data.get('cliente'), cleaned_data.get('righe')
+        if cliente and modelli:
+            esistenti = Modello.objects.filter(cliente=cliente, nome__in=[m['nome'] for m in modelli])
+            nomi = sorted(esistenti.values_list('nome', flat=True))
+            if nomi:
+                self.add_error('righe', f"Il cliente ha già questi modelli: {', '.join(nomi)}.")
+        return cleaned_data
+
+
 class TipoComponenteForm(forms.ModelForm):
     class Meta:
         model = TipoComponente
@@ -117,10 +205,28 @@ class ArticoloForm(forms.ModelForm):
             'quantita_unitaria': forms.NumberInput(attrs={'class': 'form-control form-control-sm text-end', 'placeholder': '1.00', 'step': '0.01'}),
         }
 
+class SceltePrecaricateFormSet(BaseInlineFormSet):
+    """
+    Legge una sola volta le opzioni dei campi a scelta (taglie, tipi,
+    colori) e le condivide tra le righe, invece di una query per campo
+    a ogni riga del formset.
+    """
+
+    def _construct_form(self, i, **kwargs):
+        form = super()._construct_form(i, **kwargs)
+        if not hasattr(self, '_scelte'):
+            # Il campo nascosto con la chiave primaria non mostra opzioni
+            self._scelte = {nome: list(campo.choices) for nome, campo in form.fields.items()
+                            if isinstance(campo, forms.ModelChoiceField) and not campo.widget.is_hidden}
+        for nome, scelte in self._scelte.items():
+            form.fields[nome].choices = scelte
+        return form
+
 ArticoloFormSet = inlineformset_factory(
     Componente,
     Articolo,
     form=ArticoloForm,
+    formset=SceltePrecaricateFormSet,
     fields=('taglia', 'superficie_mq', 'superficie_piedi_quadri', 'quantita_unitaria'),
     extra=1,
     can_delete=True
@@ -128,6 +234,85 @@ ArticoloFormSet = inlineformset_factory(
 
 
 
+class MatriceMisureForm(forms.Form):
+    """
+    Tutte le misure di un modello in una griglia componenti x taglie: una
+    cella per Articolo, con la superficie in m² per i componenti a
+    superficie e la quantità per gli altri. Al salvataggio vengono scritte
+    solo le celle cambiate, con un inserimento e un aggiornamento in blocco.
+    """
+    CAMPI_ARTICOLO = ['superficie_mq', 'superficie_piedi_quadri', 'quantita_unitaria']
+
+    def __init__(self, *args, modello, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.modello = modello
+        self.componenti = list(modello.componenti.select_related('nome_componente', 'colore'))
+        self.taglie = list(Taglia.objects.all())
+        self.articoli = {
+            (articolo.componente_id, articolo.taglia_id): articolo
+            for articolo in Articolo.objects.filter(componente__modello=modello)
+        }
+        for componente in self.componenti:
+            superficie = componente.unita_misura == 'SUPERFICIE'
+            for taglia in self.taglie:
+                articolo = self.articoli.get((componente.pk, taglia.pk))
+                valore = getattr(articolo, self._campo(componente), None)
+                self.fields[self._nome(componente, taglia)] = forms.DecimalField(
+                    required=False, min_value=0, max_digits=10, decimal_places=4 if superficie else 2,
+                    initial=valore, label=f"{componente.nome_componente.nome} T. {taglia}",
+                    widget=forms.NumberInput(attrs={
+                        'class': 'form-control form-control-sm text-end',
+                        'step': '0.0001' if superficie else '0.01',
+                    })
+                )
+
+    @staticmethod
+    def _nome(componente, taglia):
+        return f"misura_{componente.pk}_{taglia.pk}"
+
+    @staticmethod
+    def _campo(componente):
+        return 'superficie_mq' if componente.unita_misura == 'SUPERFICIE' else 'quantita_unitaria'
+
+    def righe(self):
+        """(componente, celle) per il template, nell'ordine delle colonne delle taglie."""
+        return [(componente, [self[self._nome(componente, taglia)] for taglia in self.taglie])
+                for componente in self.componenti]
+
+    def save(self):
+        """Scrive le celle cambiate e restituisce il numero di articoli creati e aggiornati."""
+        cambiate = set(self.changed_data)
+        nuovi, modificati = [], []
+        for componente in self.componenti:
+            campo = self._campo(componente)
+            for taglia in self.taglie:
+                nome = self._nome(componente, taglia)
+                if nome not in cambiate:
+                    continue
+                valore = self.cleaned_data[nome]
+                articolo = self.articoli.get((componente.pk, taglia.pk))
+                if articolo is None:
+                    if valore is None:
+                        continue
+                    articolo = Articolo(componente=componente, taglia=taglia)
+                    nuovi.append(articolo)
+                else:
+                    modificati.append(articolo)
+                setattr(articolo, campo, valore)
+                if campo == 'superficie_mq':
+                    # I ft² seguono sempre i m² inseriti nella griglia
+                    articolo.superficie_piedi_quadri = None
+                    articolo.completa_superfici()
+
+        if nuovi or modificati:
+            with transaction.atomic():
+                Articolo.objects.bulk_create(nuovi, batch_size=1000)
+                Articolo.objects.bulk_update(modificati, self.CAMPI_ARTICOLO, batch_size=1000)
+                # Nessun segnale per riga: la distinta base cambia versione una volta sola
+                incrementa_versione_bom(self.modello.pk)
+        return len(nuovi), len(modificati)
+
+
 # --- Form e Formset per Ordini ---
 
 class OrdineMainForm(forms.ModelForm):
@@ -143,6 +328,11 @@ class OrdineMainForm(forms.ModelForm):
             'note': forms.Textarea(attrs={'rows': 3, 'class': 'form-control'}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Il nome del modello nelle opzioni include il cliente
+        self.fields['modello'].queryset = Modello.objects.select_related('cliente')
+
 class DettaglioOrdineForm(forms.ModelForm):
     class Meta:
         model = DettaglioOrdine
@@ -201,6 +391,7 @@ ComponentePerOrdineFormSet = inlineformset_factory(
     Modello,
     Componente,
     form=ComponenteForm,
+    formset=SceltePrecaricateFormSet,
     # AGGIUNGI 'unita_misura' a questa lista
     fields=('nome_componente', 'unita_misura', 'colore', 'note'),
     extra=1,
@@ -220,4 +411,138 @@ class BollaSplitForm(forms.Form):
         required=False,
         widget=forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'Es. 2'}),
         help_text="Lascia vuoto per non impostare un limite per taglia."
-    )
\ No newline at end of file
+    )
+    modalita = forms.ChoiceField(
+        label="Modalità di suddivisione",
+        choices=MODALITA_CHOICES,
+        initial=SEQUENZIALE,
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+
+class BolleMultipleForm(BollaSplitForm):
+    """Selezione degli ordini e vincoli di suddivisione per le bolle di più ordini insieme."""
+    stato = forms.ChoiceField(
+        label="Stato ordini",
+        choices=[c for c in Ordine.STATO_ORDINE_CHOICES if c[0] not in ('BOZZA', 'ANNULLATO')],
+        initial='CONFERMATO',
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    cliente = forms.ModelChoiceField(
+        label="Cliente",
+        queryset=Cliente.objects.all(),
+        required=False,
+        empty_label="Tutti i clienti",
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    consegna_dal = forms.DateField(
+        label="Consegna dal",
+        required=False,
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'})
+    )
+    consegna_al = forms.DateField(
+        label="Consegna al",
+        required=False,
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'})
+    )
+
+    field_order = ['stato', 'cliente', 'consegna_dal', 'consegna_al', 'max_totale', 'max_per_taglia', 'modalita']
+
+    def clean(self):
+        cleaned_data = super().clean()
+        dal, al = cleaned_data.get('consegna_dal'), cleaned_data.get('consegna_al')
+        if dal and al and dal > al:
+            self.add_error('consegna_al', "La data finale non può precedere quella iniziale.")
+        return cleaned_data
+
+    def ordini_selezionati(self):
+        """Ordini che rispettano i criteri, raggruppati per modello e con i dettagli già caricati."""
+        ordini = Ordine.objects.filter(stato=self.cleaned_data['stato'])
+        if self.cleaned_data.get('cliente'):
+            ordini = ordini.filter(modello__cliente=self.cleaned_data['cliente'])
+        if self.cleaned_data.get('consegna_dal'):
+            ordini = ordini.filter(data_consegna__gte=self.cleaned_data['consegna_dal'])
+        if self.cleaned_data.get('consegna_al'):
+            ordini = ordini.filter(data_consegna__lte=self.cleaned_data['consegna_al'])
+        return prepara_ordini_bolle(ordini)
+
+
+class EsportaDocumentiForm(forms.Form):
+    """Scelta dei documenti da esportare in un unico archivio ZIP."""
+    DOCUMENTI_CHOICES = [
+        ('bolla_ordine', "Bolle d'ordine"),
+        ('scheda_materiali', 'Schede materiali degli ordini'),
+        ('scheda_modello', 'Schede tecniche dei modelli'),
+    ]
+    documenti = forms.MultipleChoiceField(
+        label="Documenti",
+        choices=DOCUMENTI_CHOICES,
+        widget=forms.CheckboxSelectMultiple
+    )
+    cliente = forms.ModelChoiceField(
+        label="Cliente",
+        queryset=Cliente.objects.all(),
+        required=False,
+        empty_label="Tutti i clienti",
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    stato = forms.ChoiceField(
+        label="Stato ordini",
+        choices=[('', 'Tutti gli stati')] + Ordine.STATO_ORDINE_CHOICES,
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-select'}),
+        help_text="Le schede dei modelli includono tutto il catalogo del cliente, indipendentemente dagli ordini."
+    )
+    ordini = forms.CharField(required=False, widget=forms.HiddenInput)
+
+    def clean_ordini(self):
+        valore = self.cleaned_data['ordini']
+        try:
+            return [int(pk) for pk in valore.split(',') if pk.strip()]
+        except ValueError:
+            raise forms.ValidationError("Elenco ordini non valido.")
+
+    def clean(self):
+        cleaned_data = super().clean()
+        documenti = cleaned_data.get('documenti') or []
+        if 'scheda_modello' in documenti and not cleaned_data.get('cliente') and not cleaned_data.get('ordini'):
+            self.add_error('cliente', "Per le schede dei modelli scegli un cliente.")
+        return cleaned_data
+
+    def ordini_selezionati(self):
+        ordini = Ordine.objects.all()
+        if self.cleaned_data.get('ordini'):
+            ordini = ordini.filter(pk__in=self.cleaned_data['ordini'])
+        if self.cleaned_data.get('cliente'):
+            ordini = ordini.filter(modello__cliente=self.cleaned_data['cliente'])
+        if self.cleaned_data.get('stato'):
+            ordini = ordini.filter(stato=self.cleaned_data['stato'])
+        return ordini.order_by('pk')
+
+    def modelli_selezionati(self):
+        if self.cleaned_data.get('ordini'):
+            modelli = Modello.objects.filter(ordini__pk__in=self.cleaned_data['ordini']).distinct()
+        else:
+            modelli = Modello.objects.all()
+        if self.cleaned_data.get('cliente'):
+            modelli = modelli.filter(cliente=self.cleaned_data['cliente'])
+        return modelli.order_by('pk')
+
+
+class ImportaOrdiniForm(forms.Form):
+    """Foglio delle taglie (CSV o Excel) con un ordine per riga."""
+    file = forms.FileField(
+        label="File degli ordini",
+        help_text="Colonne: cliente, modello, data_consegna, stato, note (facoltative le ultime tre) "
+                  "e una colonna per taglia con le paia.",
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': ','.join(ESTENSIONI)})
+    )
+
+    def clean_file(self):
+        file = self.cleaned_data['file']
+        nome = file.name.lower()
+        if not nome.endswith(ESTENSIONI):
+            raise forms.ValidationError(f"Formato non supportato: usa un file {' o '.join(ESTENSIONI)}.")
+        if nome.endswith('.xlsx') and openpyxl is None:
+            raise forms.ValidationError("I file Excel non si possono importare su questo server: salva il file in CSV.")
+        return file
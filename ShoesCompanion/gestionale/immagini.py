@@ -0,0 +1,106 @@
+"""
+Versioni ridotte delle foto dei modelli.
+
+Le foto caricate (spesso scatti del telefono da diversi MB) restano
+intatte; accanto a ciascuna si salvano dei JPEG di dimensione limitata,
+usati da PDF e pagine al posto dell'originale:
+- pdf: per i documenti stampati (la foto occupa pochi centimetri)
+- dettaglio: per le pagine di dettaglio
+- miniatura: per gli elenchi
+"""
+import hashlib
+import logging
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Lato massimo (px) di ogni versione, dalla più grande alla più piccola
+DERIVATI = {
+    'pdf': 800,
+    'dettaglio': 600,
+    'miniatura': 160,
+}
+QUALITA_JPEG = 85
+CARTELLA_DERIVATI = 'modelli/derivati'
+
+
+def nome_derivato(nome_foto, formato):
+    """
+    Nome nello storage della versione 'formato' della foto (sempre JPEG).
+    L'impronta del nome completo, estensione compresa, distingue foto come
+    scarpa.png e scarpa.jpg, che altrimenti avrebbero la stessa versione ridotta.
+    """
+    radice = os.path.splitext(os.path.basename(nome_foto))[0]
+    impronta = hashlib.sha256(nome_foto.encode()).hexdigest()[:12]
+    return f"{CARTELLA_DERIVATI}/{formato}/{radice}-{impronta}.jpg"
+
+
+def _apri_rgb(foto):
+    with foto.storage.open(foto.name, 'rb') as file:
+        immagine = Image.open(file)
+        # Le foto del telefono sono spesso ruotate solo nei metadati EXIF
+        immagine = ImageOps.exif_transpose(immagine)
+        if immagine.mode in ('RGBA', 'LA', 'P'):
+            immagine = immagine.convert('RGBA')
+            sfondo = Image.new('RGB', immagine.size, 'white')
+            sfondo.paste(immagine, mask=immagine.getchannel('A'))
+            return sfondo
+        return immagine.convert('RGB')
+
+
+def genera_derivati(foto, forza=False):
+    """
+    Crea le versioni ridotte mancanti della foto (tutte, con forza=True).
+    Restituisce i nomi dei file creati; una foto illeggibile viene solo
+    segnalata nel log e resta in uso l'originale.
+    """
+    if not foto:
+        return []
+    storage = foto.storage
+    da_creare = [formato for formato in DERIVATI
+                 if forza or not storage.exists(nome_derivato(foto.name, formato))]
+    if not da_creare:
+        return []
+    try:
+        immagine = _apri_rgb(foto)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as errore:
+        logger.warning("Impossibile ridurre la foto %s: %s", foto.name, errore)
+        return []
+
+    creati = []
+    for formato in da_creare:
+        # Si riduce dalla versione precedente, più piccola dell'originale
+        immagine.thumbnail((DERIVATI[formato], DERIVATI[formato]), Image.LANCZOS)
+        buffer = BytesIO()
+        immagine.save(buffer, 'JPEG', quality=QUALITA_JPEG, optimize=True, progressive=True)
+        nome = nome_derivato(foto.name, formato)
+        storage.delete(nome)
+        creati.append(storage.save(nome, ContentFile(buffer.getvalue())))
+    return creati
+
+
+def elimina_derivati(foto, nome_foto=None):
+    """Elimina le versioni ridotte della foto, o di una sua foto precedente (nome_foto)."""
+    for formato in DERIVATI:
+        foto.storage.delete(nome_derivato(nome_foto or foto.name, formato))
+
+
+def _derivato_esistente(foto, formato):
+    nome = nome_derivato(foto.name, formato)
+    return nome if foto.storage.exists(nome) else None
+
+
+def percorso_foto(foto, formato):
+    """Percorso su disco della versione ridotta, o dell'originale se manca."""
+    nome = _derivato_esistente(foto, formato)
+    return foto.storage.path(nome) if nome else foto.path
+
+
+def url_foto(foto, formato):
+    """URL della versione ridotta, o dell'originale se manca."""
+    nome = _derivato_esistente(foto, formato)
+    return foto.storage.url(nome) if nome else foto.url
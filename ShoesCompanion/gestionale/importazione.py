@@ -0,0 +1,292 @@
+"""
+Importazione degli ordini dai fogli delle taglie inviati dai clienti.
+
+Il file (CSV o XLSX) ha una riga per ordine: le colonne 'cliente' e
+'modello', quelle facoltative 'data_consegna', 'stato' e 'note', e una
+colonna per ogni taglia (es. "38", "38,5" o "38½") con le paia.
+
+Il file viene letto riga per riga, senza caricarlo tutto in memoria.
+Clienti, modelli e taglie vengono risolti su dizionari caricati una sola
+volta all'inizio, e tutto il file viene validato prima di scrivere: se
+anche una sola riga ha errori non viene creato nulla e si restituiscono
+gli errori con il numero di riga. Gli ordini validi vengono poi scritti a
+blocchi con inserimenti in blocco, in un'unica transazione.
+"""
+import csv
+import datetime
+import io
+import os
+import re
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+
+from .materiali import aggiorna_riepilogo_materiali, congela_distinte_base
+from .models import Cliente, DettaglioOrdine, Modello, Ordine, Taglia
+
+try:
+    import openpyxl
+except ImportError:  # openpyxl è nei requisiti; senza, si importano solo i CSV
+    openpyxl = None
+
+ESTENSIONI = ('.csv', '.xlsx')
+COLONNE_OBBLIGATORIE = ('cliente', 'modello')
+COLONNE_FACOLTATIVE = ('data_consegna', 'stato', 'note')
+FORMATI_DATA = ('%Y-%m-%d', '%d/%m/%Y', '%d/%m/%y', '%d-%m-%Y')
+
+_TAGLIA = re.compile(r'^(?:t\.?\s*)?(\d+)(?:[.,](\d+)|\s*(½))?$', re.IGNORECASE)
+
+
+class ErroreFile(Exception):
+    """Il file non si può leggere (formato, codifica o intestazione)."""
+
+
+@dataclass
+class EsitoImportazione:
+    ordini: int = 0
+    dettagli: int = 0
+    righe_lette: int = 0
+    # (numero di riga, messaggio); solo i primi IMPORTAZIONE_MAX_ERRORI
+    errori: list = field(default_factory=list)
+    errori_totali: int = 0
+
+    def aggiungi_errore(self, riga, messaggio):
+        self.errori_totali += 1
+        if len(self.errori) < getattr(settings, 'IMPORTAZIONE_MAX_ERRORI', 200):
+            self.errori.append((riga, messaggio))
+
+
+def _chiave(testo):
+    return ' '.join(str(testo).split()).casefold()
+
+
+def _vuota(valore):
+    return valore is None or (isinstance(valore, str) and not valore.strip())
+
+
+def numero_taglia(intestazione):
+    """Numero della taglia di un'intestazione di colonna ("38", "38,5", "38½", "T. 38"), o None."""
+    corrispondenza = _TAGLIA.match(str(intestazione).strip())
+    if not corrispondenza:
+        return None
+    intero, decimali, mezzo = corrispondenza.groups()
+    return Decimal(intero) + (Decimal('0.5') if mezzo else Decimal(f"0.{decimali}") if decimali else 0)
+
+
+# --- Lettura in streaming ---
+
+def _righe_csv(file):
+    testo = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    try:
+        campione = testo.read(4096)
+        testo.seek(0)
+        try:
+            dialetto = csv.Sniffer().sniff(campione, delimiters=';,\t')
+        except csv.Error:
+            dialetto = csv.excel
+        yield from csv.reader(testo, dialetto)
+    except UnicodeDecodeError:
+        raise ErroreFile("Il file non è in UTF-8: salvalo come \"CSV UTF-8\".")
+    finally:
+        # Il file resta di chi l'ha aperto
+        testo.detach()
+
+
+def _righe_xlsx(file):
+    if openpyxl is None:
+        raise ErroreFile("Per importare file Excel serve il pacchetto openpyxl; in alternativa salva il file in CSV.")
+    try:
+        cartella = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    except Exception as e:
+        raise ErroreFile(f"File Excel non leggibile: {e}")
+    try:
+        yield from cartella.worksheets[0].iter_rows(values_only=True)
+    finally:
+        cartella.close()
+
+
+def leggi_righe(file, nome_file):
+    """Le righe del file (liste di valori), lette una alla volta."""
+    estensione = os.path.splitext(nome_file)[1].lower()
+    if estensione == '.csv':
+        return _righe_csv(file)
+    if estensione == '.xlsx':
+        return _righe_xlsx(file)
+    raise ErroreFile(f"Formato non supportato: usa un file {' o '.join(ESTENSIONI)}.")
+
+
+# --- Validazione ---
+
+class _Anagrafiche:
+    """Clienti, modelli, taglie e stati caricati una volta sola, per risolvere le righe senza query."""
+
+    def __init__(self):
+        self.clienti = {}
+        for pk, nome in Cliente.objects.values_list('pk', 'nome'):
+            # Due clienti con lo stesso nome: il nome non basta a sceglierne uno
+            self.clienti[_chiave(nome)] = None if _chiave(nome) in self.clienti else pk
+        self.modelli = {(cliente_id, _chiave(nome)): pk
+                        for pk, cliente_id, nome in Modello.objects.values_list('pk', 'cliente_id', 'nome')}
+        self.taglie = dict(Taglia.objects.values_list('numero', 'pk'))
+        self.stati = {}
+        for codice, etichetta in Ordine.STATO_ORDINE_CHOICES:
+            self.stati[_chiave(codice)] = self.stati[_chiave(etichetta)] = codice
+
+
+def _colonne(intestazione, anagrafiche):
+    """Indici delle colonne fisse e delle taglie; ErroreFile se l'intestazione non va."""
+    fisse, taglie, errori = {}, {}, []
+    for indice, valore in enumerate(intestazione):
+        if _vuota(valore):
+            continue
+        nome = _chiave(valore).replace(' ', '_')
+        numero = numero_taglia(valore)
+        if nome in COLONNE_OBBLIGATORIE + COLONNE_FACOLTATIVE:
+            fisse[nome] = indice
+        elif numero is None:
+            errori.append(f"colonna '{valore}' sconosciuta")
+        elif numero not in anagrafiche.taglie:
+            errori.append(f"la taglia '{valore}' non esiste")
+        elif anagrafiche.taglie[numero] in taglie.values():
+            errori.append(f"la taglia '{valore}' è ripetuta")
+        else:
+            taglie[indice] = anagrafiche.taglie[numero]
+    errori += [f"manca la colonna '{nome}'" for nome in COLONNE_OBBLIGATORIE if nome not in fisse]
+    if not taglie:
+        errori.append("nessuna colonna di taglia")
+    if errori:
+        raise ErroreFile("Intestazione non valida: " + "; ".join(errori) + ".")
+    return fisse, taglie
+
+
+def _data(valore):
+    if isinstance(valore, datetime.datetime):
+        return valore.date()
+    if isinstance(valore, datetime.date):
+        return valore
+    for formato in FORMATI_DATA:
+        try:
+            return datetime.datetime.strptime(str(valore).strip(), formato).date()
+        except ValueError:
+            pass
+    raise ValueError(f"data di consegna '{valore}' non valida")
+
+
+def _paia(valore):
+    if _vuota(valore):
+        return 0
+    try:
+        numero = Decimal(str(valore).strip().replace(',', '.'))
+    except ArithmeticError:
+        numero = None
+    if numero is None or not numero.is_finite() or numero < 0 or numero != numero.to_integral_value():
+        raise ValueError(f"quantità '{valore}' non valida")
+    return int(numero)
+
+
+def _ordine_da_riga(riga, fisse, taglie, anagrafiche):
+    """(modello_id, data_consegna, stato, note, [(taglia_id, paia)]) di una riga; ValueError con gli errori."""
+    def cella(nome):
+        indice = fisse.get(nome)
+        return riga[indice] if indice is not None and indice < len(riga) else None
+
+    errori = []
+    nome_cliente, nome_modello = cella('cliente'), cella('modello')
+    modello_id = None
+    cliente_id = anagrafiche.clienti.get(_chiave(nome_cliente or ''), False)
+    if _vuota(nome_cliente) or cliente_id is False:
+        errori.append(f"cliente '{nome_cliente or ''}' non trovato")
+    elif cliente_id is None:
+        errori.append(f"più clienti si chiamano '{nome_cliente}'")
+    else:
+        modello_id = anagrafiche.modelli.get((cliente_id, _chiave(nome_modello or '')))
+        if modello_id is None:
+            errori.append(f"il cliente non ha il modello '{nome_modello or ''}'")
+
+    data_consegna = None
+    if not _vuota(cella('data_consegna')):
+        try:
+            data_consegna = _data(cella('data_consegna'))
+        except ValueError as e:
+            errori.append(str(e))
+
+    stato = 'BOZZA'
+    if not _vuota(cella('stato')):
+        stato = anagrafiche.stati.get(_chiave(cella('stato')))
+        if stato is None:
+            errori.append(f"stato '{cella('stato')}' non valido")
+
+    dettagli = []
+    for indice, taglia_id in taglie.items():
+        try:
+            paia = _paia(riga[indice] if indice < len(riga) else None)
+        except ValueError as e:
+            errori.append(str(e))
+            continue
+        if paia:
+            dettagli.append((taglia_id, paia))
+    if not dettagli and not errori:
+        errori.append("nessuna quantità indicata")
+
+    if errori:
+        raise ValueError("; ".join(errori))
+    note = cella('note')
+    return modello_id, data_consegna, stato, str(note).strip() if not _vuota(note) else None, dettagli
+
+
+# --- Scrittura ---
+
+def _scrivi_blocco(blocco, utente, esito):
+    ordini = Ordine.objects.bulk_create([
+        Ordine(modello_id=modello_id, data_consegna=data_consegna, stato=stato, note=note, created_by=utente)
+        for modello_id, data_consegna, stato, note, _ in blocco
+    ])
+    dettagli = DettaglioOrdine.objects.bulk_create([
+        DettaglioOrdine(ordine_id=ordine.pk, taglia_id=taglia_id, quantita=paia)
+        for ordine, (*_, righe) in zip(ordini, blocco) for taglia_id, paia in righe
+    ], batch_size=1000)
+    # Con bulk_create i segnali non partono: distinte congelate e riepiloghi si scrivono qui
+    congelati = [ordine.pk for ordine in ordini if ordine.stato in Ordine.STATI_CONGELATI]
+    if congelati:
+        congela_distinte_base(Ordine.objects.filter(pk__in=congelati))
+    aggiorna_riepilogo_materiali(Ordine.objects.filter(pk__in=[ordine.pk for ordine in ordini]))
+    esito.ordini += len(ordini)
+    esito.dettagli += len(dettagli)
+
+
+def importa_ordini(file, nome_file, utente=None):
+    """
+    Valida tutto il file e, se non ci sono errori, crea ordini e dettagli.
+    Restituisce un EsitoImportazione; con degli errori non scrive nulla.
+    Solleva ErroreFile se il file non si può leggere.
+    """
+    dimensione_blocco = getattr(settings, 'IMPORTAZIONE_BLOCCO', 500)
+    anagrafiche = _Anagrafiche()
+    esito = EsitoImportazione()
+    righe = leggi_righe(file, nome_file)
+
+    intestazione = next(righe, None)
+    if intestazione is None:
+        raise ErroreFile("Il file è vuoto.")
+    fisse, taglie = _colonne(intestazione, anagrafiche)
+
+    ordini = []
+    for numero, riga in enumerate(righe, start=2):
+        if all(_vuota(valore) for valore in riga):
+            continue
+        esito.righe_lette += 1
+        try:
+            ordini.append(_ordine_da_riga(riga, fisse, taglie, anagrafiche))
+        except ValueError as e:
+            esito.aggiungi_errore(numero, str(e))
+    if esito.errori_totali:
+        return esito
+    if not ordini:
+        raise ErroreFile("Il file non contiene ordini.")
+
+    with transaction.atomic():
+        for inizio in range(0, len(ordini), dimensione_blocco):
+            _scrivi_blocco(ordini[inizio:inizio + dimensione_blocco], utente, esito)
+    return esito
@@ -0,0 +1,138 @@
+"""
+Coda locale dei documenti pesanti, salvata nel database (LavoroDocumento).
+
+Le viste accodano il lavoro e rispondono subito con la pagina di stato;
+il comando 'esegui_lavori' preleva i lavori in coda e li genera in un pool
+di processi, senza broker esterni.
+"""
+import logging
+import shutil
+import tempfile
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.files import File
+from django.db import connections
+from django.utils import timezone
+
+from .bolle import SEQUENZIALE
+from .documenti import documento_pdf, genera_bolle_ordini, prepara_ordini_bolle
+from .esportazione import zip_documenti
+from .models import LavoroDocumento, Ordine
+
+logger = logging.getLogger(__name__)
+
+
+class ErroreLavoro(Exception):
+    """Errore con un messaggio da mostrare così com'è a chi ha richiesto il documento."""
+
+
+def soglia_bolle():
+    """Oltre questo numero (stimato) di bolle il PDF viene generato in background."""
+    return getattr(settings, 'LAVORI_SOGLIA_BOLLE', 200)
+
+
+def soglia_documenti():
+    """Oltre questo numero di documenti l'archivio ZIP viene generato in background."""
+    return getattr(settings, 'LAVORI_SOGLIA_DOCUMENTI', 50)
+
+
+def accoda(tipo, parametri, nome_file, utente=None):
+    """Crea un lavoro in coda e lo restituisce."""
+    return LavoroDocumento.objects.create(
+        tipo=tipo, parametri=parametri, nome_file=nome_file,
+        created_by=utente if utente and utente.is_authenticated else None,
+    )
+
+
+def _genera(lavoro, destinazione):
+    parametri = dict(lavoro.parametri)
+    if lavoro.tipo == 'bolle_ordini':
+        ordini = list(prepara_ordini_bolle(Ordine.objects.filter(pk__in=parametri.pop('ordini'))))
+        if not genera_bolle_ordini(ordini, destinazione, **parametri):
+            raise ErroreLavoro("Gli ordini selezionati non hanno paia da produrre.")
+    elif lavoro.tipo == 'bolle_lavoro':
+        ordine = Ordine.objects.select_related('modello', 'modello__cliente').get(pk=parametri.pop('ordine'))
+        # Le bolle passano dalla cache dei PDF: si copia il file già pronto
+        with documento_pdf('bolle_lavoro', ordine, **parametri) as pdf:
+            shutil.copyfileobj(pdf, destinazione)
+    elif lavoro.tipo == 'esportazione':
+        # Il lavoro gira già in un processo del pool: i documenti si generano qui, uno dopo l'altro
+        for blocco in zip_documenti([tuple(documento) for documento in parametri['documenti']], processi=0):
+            destinazione.write(blocco)
+    else:
+        raise ErroreLavoro(f"Tipo di documento sconosciuto: {lavoro.tipo}.")
+
+
+def esegui_lavoro(lavoro_id):
+    """
+    Genera il documento di un lavoro già preso in carico (stato IN_CORSO) e
+    ne salva l'esito. Gira nei processi del pool, ma si può chiamare anche
+    direttamente. Restituisce lo stato finale.
+    """
+    lavoro = LavoroDocumento.objects.get(pk=lavoro_id)
+    try:
+        with tempfile.TemporaryFile() as destinazione:
+            _genera(lavoro, destinazione)
+            destinazione.seek(0)
+            lavoro.file.save(lavoro.nome_file, File(destinazione), save=False)
+        lavoro.stato = 'COMPLETATO'
+        lavoro.errore = None
+    except Exception as errore:
+        # All'utente solo un messaggio breve; i dettagli (traceback, SQL) vanno nel log
+        logger.exception("Lavoro #%s (%s) non riuscito", lavoro.pk, lavoro.tipo)
+        lavoro.stato = 'ERRORE'
+        if isinstance(errore, ErroreLavoro):
+            lavoro.errore = str(errore)
+        elif isinstance(errore, ObjectDoesNotExist):
+            lavoro.errore = "Il documento si riferisce a dati che non esistono più."
+        else:
+            lavoro.errore = "Errore imprevisto durante la generazione del documento."
+    lavoro.completato_il = timezone.now()
+    lavoro.save(update_fields=['stato', 'file', 'errore', 'completato_il'])
+    return lavoro.stato
+
+
+def prendi_lavori(quanti):
+    """
+    Prende in carico fino a 'quanti' lavori in coda, dal più vecchio.
+    L'UPDATE condizionato garantisce che un lavoro vada a un solo worker
+    anche con più comandi 'esegui_lavori' attivi.
+    """
+    presi = []
+    candidati = LavoroDocumento.objects.filter(stato='IN_CODA').order_by('created_at', 'pk')
+    for lavoro_id in candidati.values_list('pk', flat=True)[:quanti]:
+        if LavoroDocumento.objects.filter(pk=lavoro_id, stato='IN_CODA').update(stato='IN_CORSO', iniziato_il=timezone.now()):
+            presi.append(lavoro_id)
+    return presi
+
+
+def recupera_lavori_interrotti(minuti):
+    """Rimette in coda i lavori IN_CORSO da troppo tempo (es. worker terminato a metà)."""
+    limite = timezone.now() - timedelta(minutes=minuti)
+    return LavoroDocumento.objects.filter(stato='IN_CORSO', iniziato_il__lt=limite).update(stato='IN_CODA', iniziato_il=None)
+
+
+def elimina_lavori_vecchi(giorni):
+    """Elimina lavori conclusi (e relativi file) più vecchi di 'giorni' giorni."""
+    limite = timezone.now() - timedelta(days=giorni)
+    vecchi = LavoroDocumento.objects.filter(stato__in=['COMPLETATO', 'ERRORE'], completato_il__lt=limite)
+    eliminati = 0
+    for lavoro in vecchi.iterator():
+        if lavoro.file:
+            lavoro.file.delete(save=False)
+        lavoro.delete()
+        eliminati += 1
+    return eliminati
+
+
+def inizializza_processo():
+    """Initializer del pool: ogni processo apre le proprie connessioni al database."""
+    django.setup()
+    connections.close_all()
+
+
+def parametri_bolle(max_totale, max_per_taglia=None, modalita=SEQUENZIALE):
+    return {'max_totale': max_totale, 'max_per_taglia': max_per_taglia, 'modalita': modalita}
@@ -0,0 +1,307 @@
+"""
+Impaginazione comune dei documenti PDF.
+
+Stili di paragrafo e stili delle tabelle vengono creati una sola volta per
+processo, all'import del modulo, e condivisi da tutti i documenti: in
+ReportLab sono oggetti che i flowable leggono senza mai modificarli.
+
+Le bolle di lavoro hanno un modello di pagina proprio (DocumentoBolle): la
+cornice fissa (titolo, etichette, griglia della numerazione, riquadri di
+note e timbro) viene disegnata una volta per documento in un form PDF e
+richiamata su ogni pagina; su ogni pagina si scrivono solo i dati della
+bolla. Nel flusso del documento resta soltanto la tabella dei componenti, i cui
+paragrafi (uguali in tutte le bolle di un ordine) sono ParagrafoRipetuto.
+"""
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER, TA_RIGHT
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import cm
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import (BaseDocTemplate, Flowable, Frame, Image, PageTemplate, Paragraph,
+                                SimpleDocTemplate, TableStyle)
+
+from .immagini import percorso_foto
+
+# ==============================================================================
+# STILI CONDIVISI
+# ==============================================================================
+
+STILI = getSampleStyleSheet()
+
+TITOLO = ParagraphStyle(name='Titolo', fontSize=15, alignment=TA_CENTER, spaceBottom=50, fontName='Helvetica-Bold')
+ETICHETTA = ParagraphStyle(name='Etichetta', fontSize=8, fontName='Helvetica')
+VALORE = ParagraphStyle(name='Valore', fontSize=10, fontName='Helvetica-Bold')
+SEZIONE = ParagraphStyle(name='Sezione', fontSize=10, fontName='Helvetica-Bold', spaceBefore=8, spaceAfter=4)
+COMPONENTE_ETICHETTA = ParagraphStyle(name='ComponenteEtichetta', fontSize=9, fontName='Helvetica-Bold')
+COMPONENTE_VALORE = ParagraphStyle(name='ComponenteValore', fontSize=9, fontName='Helvetica', leading=11)
+TOTALE = ParagraphStyle(name='Totale', alignment=TA_RIGHT, fontName='Helvetica-Bold')
+INTESTAZIONE_TABELLA = ParagraphStyle(name='IntestazioneTabella', fontName='Helvetica-Bold', fontSize=9,
+                                      textColor=colors.whitesmoke)
+COMPONENTE_TITOLO = ParagraphStyle(name='ComponenteTitolo', fontName='Helvetica-Bold', fontSize=10,
+                                   spaceBefore=8, spaceAfter=4)
+COMPONENTE_DETTAGLI = ParagraphStyle(name='ComponenteDettagli', fontName='Helvetica', fontSize=8, leading=10)
+
+# Bolle di lavoro: caratteri più piccoli per stare in una pagina
+BOLLA_ETICHETTA = ParagraphStyle(name='BollaEtichetta', fontSize=8, fontName='Helvetica-Bold')
+BOLLA_VALORE = ParagraphStyle(name='BollaValore', fontSize=8, fontName='Helvetica', leading=10)
+
+STILE_INTESTAZIONE = TableStyle([('VALIGN', (0, 0), (-1, -1), 'TOP')])
+
+STILE_NUMERAZIONE = TableStyle([
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+])
+
+STILE_COMPONENTI = TableStyle([
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
+    ('TOPPADDING', (0, 0), (-1, -1), 4),
+])
+
+STILE_NOTE = TableStyle([('BOX', (0, 0), (-1, -1), 1, colors.black), ('VALIGN', (0, 0), (-1, -1), 'TOP')])
+
+STILE_MATERIALI = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.darkgrey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+    ('TOPPADDING', (0, 0), (-1, -1), 6),
+    ('ALIGN', (2, 1), (2, -1), 'RIGHT'),
+])
+
+STILE_TITOLO_COMPONENTE = TableStyle([('VALIGN', (0, 0), (-1, -1), 'MIDDLE')])
+
+STILE_MISURE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.darkgrey),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTSIZE', (0, 0), (-1, -1), 8),
+])
+
+# Nelle bolle le quantità sono testo semplice: niente Paragraph da comporre per ogni bolla
+STILE_COMPONENTI_BOLLA = TableStyle([
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+    ('FONT', (0, 0), (-1, 0), 'Helvetica', 7),
+    ('FONT', (2, 1), (2, -1), 'Helvetica', 8, 10),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
+    ('TOPPADDING', (0, 0), (-1, -1), 4),
+])
+INTESTAZIONE_COMPONENTI_BOLLA = ['COMPONENTE', 'MATERIALE / CODICI', 'QUANTITÀ NECESSARIA']
+
+
+def documento_a4(destinazione, margine):
+    """Documento A4 a flusso libero con lo stesso margine sui quattro lati."""
+    return SimpleDocTemplate(destinazione, pagesize=A4, topMargin=margine, bottomMargin=margine,
+                             leftMargin=margine, rightMargin=margine)
+
+
+def foto_modello(modello):
+    """Foto del modello per le intestazioni (versione ridotta per i PDF)."""
+    if modello.foto:
+        return Image(percorso_foto(modello.foto, 'pdf'), width=4*cm, height=4*cm)
+    return Paragraph("Nessuna Foto", STILI['Italic'])
+
+
+def dettagli_materiale(descrizione, colore, cod_componente, cod_colore, stile):
+    """Descrizione di un materiale con colore e codici, come nelle distinte."""
+    colore_info = f"<br/><b>Colore:</b> {colore.nome if colore else '-'}"
+    codici_info = f"<br/><b>Cod. Art:</b> {cod_componente or '-'} / <b>Cod. Col:</b> {cod_colore or '-'}"
+    return Paragraph(f"{descrizione or '-'}{colore_info}{codici_info}", stile)
+
+
+class ParagrafoRipetuto(Flowable):
+    """
+    Paragrafo che compare identico in molte tabelle dello stesso documento
+    (es. la descrizione di un materiale in tutte le bolle di un ordine).
+    La suddivisione in righe, la parte più costosa, viene calcolata una
+    sola volta per larghezza invece che a ogni impaginazione della tabella.
+    """
+
+    def __init__(self, paragrafo):
+        super().__init__()
+        self.paragrafo = paragrafo
+        self._larghezza = None
+        self._dimensioni = None
+
+    def wrap(self, larghezza, altezza):
+        if larghezza != self._larghezza:
+            self._dimensioni = self.paragrafo.wrap(larghezza, altezza)
+            self._larghezza = larghezza
+        return self._dimensioni
+
+    def draw(self):
+        self.paragrafo.drawOn(self.canv, 0, 0)
+
+
+# ==============================================================================
+# MODELLO DI PAGINA DELLE BOLLE DI LAVORO
+# ==============================================================================
+
+MARGINE_BOLLA = 1*cm
+LARGHEZZA_BOLLA = A4[0] - 2 * MARGINE_BOLLA
+_SINISTRA = MARGINE_BOLLA
+_DESTRA = A4[0] - MARGINE_BOLLA
+_COLONNE = (_SINISTRA, _SINISTRA + 6.5*cm, _SINISTRA + 13*cm)
+
+# Quote dal bordo superiore dell'area utile
+_RIGHE_INTESTAZIONE = (1.7*cm, 2.65*cm, 3.6*cm)  # etichette; il valore va 0.4 cm più in basso
+_LINEE_INTESTAZIONE = (1.35*cm, 2.3*cm, 3.25*cm)
+_NUMERAZIONE = (4.95*cm, 5.45*cm, 6.05*cm)  # bordo superiore, separatore, bordo inferiore
+_INIZIO_FLUSSO = 6.45*cm
+
+# Riquadri in fondo alla pagina (quote dal bordo inferiore della pagina)
+_TIMBRO = (MARGINE_BOLLA, MARGINE_BOLLA + 2.5*cm)
+_NOTE = (MARGINE_BOLLA + 3*cm, MARGINE_BOLLA + 5.6*cm)
+_FINE_FLUSSO = _NOTE[1] + 0.4*cm
+
+
+def _y(quota):
+    return A4[1] - MARGINE_BOLLA - quota
+
+
+def _adatta(testo, font, dimensione, larghezza):
+    """Accorcia il testo perché stia nella larghezza indicata."""
+    testo = str(testo)
+    if stringWidth(testo, font, dimensione) <= larghezza:
+        return testo
+    while testo and stringWidth(testo + '…', font, dimensione) > larghezza:
+        testo = testo[:-1]
+    return testo + '…'
+
+
+def disegna_cornice_bolla(canvas, taglie):
+    """Parte fissa della pagina di una bolla: uguale per tutte le bolle del documento."""
+    canvas.saveState()
+    canvas.setFont('Helvetica-Bold', 14)
+    canvas.drawCentredString(_SINISTRA + LARGHEZZA_BOLLA / 2, _y(0.55*cm), 'BOLLA DI LAVORAZIONE')
+
+    canvas.setLineWidth(0.5)
+    for quota in _LINEE_INTESTAZIONE:
+        canvas.line(_SINISTRA, _y(quota), _DESTRA, _y(quota))
+    canvas.line(_SINISTRA, _y(4.2*cm), _COLONNE[2], _y(4.2*cm))
+
+    canvas.setFont('Helvetica', 7)
+    etichette = (('ARTICOLO', 'DATA ORDINE', 'DATA CONSEGNA'), ('CLIENTE', '', 'PAIA'), ('MODELLO', 'FORMA', ''))
+    for quota, riga in zip(_RIGHE_INTESTAZIONE, etichette):
+        for x, etichetta in zip(_COLONNE, riga):
+            canvas.drawString(x, _y(quota), etichetta)
+
+    # Numerazione: tutte le taglie, anche quelle assenti nella bolla
+    canvas.setFont('Helvetica-Bold', 9)
+    canvas.drawString(_SINISTRA, _y(4.75*cm), 'NUMERAZIONE')
+    canvas.setLineWidth(1)
+    alto, centro, basso = (_y(q) for q in _NUMERAZIONE)
+    colonna = LARGHEZZA_BOLLA / max(len(taglie), 1)
+    canvas.rect(_SINISTRA, basso, LARGHEZZA_BOLLA, alto - basso)
+    canvas.line(_SINISTRA, centro, _DESTRA, centro)
+    canvas.setFont('Helvetica', 7)
+    for i, taglia in enumerate(taglie):
+        x = _SINISTRA + i * colonna
+        if i:
+            canvas.line(x, alto, x, basso)
+        canvas.drawCentredString(x + colonna / 2, centro + 0.17*cm, _adatta(taglia, 'Helvetica', 7, colonna))
+
+    canvas.setFont('Helvetica-Bold', 9)
+    canvas.rect(_SINISTRA, _NOTE[0], LARGHEZZA_BOLLA, _NOTE[1] - _NOTE[0])
+    canvas.drawString(_SINISTRA + 6, _NOTE[1] - 0.45*cm, 'NOTE')
+    for x, etichetta in ((_SINISTRA, 'TIMBRO'), (_SINISTRA + LARGHEZZA_BOLLA / 2, 'CARTELLINO')):
+        canvas.rect(x, _TIMBRO[0], LARGHEZZA_BOLLA / 2, _TIMBRO[1] - _TIMBRO[0])
+        canvas.drawString(x + 6, _TIMBRO[1] - 0.45*cm, etichetta)
+    canvas.restoreState()
+
+
+class DatiBolla(Flowable):
+    """
+    Segnaposto invisibile all'inizio di ogni bolla: porta al modello di
+    pagina i dati variabili della bolla (intestazione, numerazione, note).
+    """
+
+    def __init__(self, ordine, numero, totale, quantita, note):
+        super().__init__()
+        self.ordine = ordine
+        self.numero = numero
+        self.totale = totale
+        self.quantita = quantita
+        self.note = note
+
+    def wrap(self, larghezza, altezza):
+        return 0, 0
+
+    def draw(self):
+        pass
+
+
+def disegna_dati_bolla(canvas, dati, taglie):
+    ordine = dati.ordine
+    modello = ordine.modello
+    canvas.saveState()
+    canvas.setFont('Helvetica-Bold', 9)
+    canvas.drawString(_SINISTRA, _y(1.15*cm), f'ORDINE N. {ordine.id}')
+    canvas.drawRightString(_DESTRA, _y(1.15*cm), f'BOLLA N. {dati.numero}/{dati.totale}')
+
+    valori = (
+        (modello.codice_articolo or '-', ordine.data_ordine.strftime('%d/%m/%Y'),
+         ordine.data_consegna.strftime('%d/%m/%Y') if ordine.data_consegna else '-'),
+        (modello.cliente.nome, None, sum(dati.quantita.values())),
+        (modello.nome, modello.forma or '-', None),
+    )
+    for quota, riga in zip(_RIGHE_INTESTAZIONE, valori):
+        for x, valore in zip(_COLONNE, riga):
+            if valore is not None:
+                canvas.drawString(x, _y(quota + 0.4*cm), _adatta(valore, 'Helvetica-Bold', 9, 6.3*cm))
+
+    colonna = LARGHEZZA_BOLLA / max(len(taglie), 1)
+    for i, taglia in enumerate(taglie):
+        if taglia in dati.quantita:
+            canvas.drawCentredString(_SINISTRA + (i + 0.5) * colonna, _y(_NUMERAZIONE[2] - 0.2*cm),
+                                     str(dati.quantita[taglia]))
+
+    if dati.note is not None:
+        larghezza, altezza = dati.note.wrapOn(canvas, LARGHEZZA_BOLLA - 12, _NOTE[1] - _NOTE[0])
+        dati.note.drawOn(canvas, _SINISTRA + 6, _NOTE[1] - 0.65*cm - altezza)
+    canvas.restoreState()
+
+
+class DocumentoBolle(BaseDocTemplate):
+    """
+    Documento delle bolle di lavoro: ogni bolla inizia con DatiBolla ed è
+    seguita dalla sua tabella dei componenti. Se la tabella non sta in una
+    pagina continua nella successiva, con la stessa intestazione.
+    """
+
+    def __init__(self, destinazione, taglie):
+        super().__init__(destinazione, pagesize=A4, leftMargin=MARGINE_BOLLA, rightMargin=MARGINE_BOLLA,
+                         topMargin=MARGINE_BOLLA, bottomMargin=MARGINE_BOLLA)
+        self.taglie = list(taglie)
+        self.bolla = None
+        self._cornice_pronta = False
+        area = Frame(_SINISTRA, _FINE_FLUSSO, LARGHEZZA_BOLLA, _y(_INIZIO_FLUSSO) - _FINE_FLUSSO,
+                     leftPadding=0, rightPadding=0, topPadding=0, bottomPadding=0)
+        self.addPageTemplates([PageTemplate(id='bolla', frames=[area], onPage=self._cornice,
+                                            onPageEnd=self._dati_bolla)])
+
+    def afterFlowable(self, flowable):
+        if isinstance(flowable, DatiBolla):
+            self.bolla = flowable
+
+    def _cornice(self, canvas, doc):
+        # La cornice finisce nel PDF una volta sola; le pagine la richiamano
+        if not self._cornice_pronta:
+            canvas.beginForm('CorniceBolla')
+            disegna_cornice_bolla(canvas, self.taglie)
+            canvas.endForm()
+            self._cornice_pronta = True
+        canvas.doForm('CorniceBolla')
+
+    def _dati_bolla(self, canvas, doc):
+        if self.bolla is not None:
+            disegna_dati_bolla(canvas, self.bolla, self.taglie)
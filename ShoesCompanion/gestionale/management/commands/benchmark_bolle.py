@@ -0,0 +1,46 @@
+import random
+
+from django.core.management.base import BaseCommand
+
+from gestionale.benchmark import misura
+from gestionale.bolle import BILANCIATA, SEQUENZIALE, distribuisci_bolle, numero_minimo_bolle
+
+
+class Command(BaseCommand):
+    help = ("Misura la suddivisione in bolle (modalità sequenziale e bilanciata) "
+            "su ordini sintetici di grandi dimensioni. Non usa il database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paia', type=int, nargs='+', default=[10000, 100000],
+                            help="Paia totali degli ordini da provare")
+        parser.add_argument('--taglie', type=int, default=30)
+        parser.add_argument('--max-totale', type=int, default=10)
+        parser.add_argument('--max-per-taglia', type=int, default=None)
+        parser.add_argument('--ripetizioni', type=int, default=3)
+        parser.add_argument('--seme', type=int, default=0)
+
+    def handle(self, *args, **options):
+        generatore = random.Random(options['seme'])
+        max_totale, max_per_taglia = options['max_totale'], options['max_per_taglia']
+        self.stdout.write(f"{options['taglie']} taglie, max {max_totale} paia per bolla, "
+                          f"max per taglia {max_per_taglia or '-'}\n")
+        self._riga("Caso", "ms", "bolle", "picco KB")
+
+        for paia in options['paia']:
+            # Distribuzione a campana delle paia sulle taglie, come in un ordine reale
+            pesi = [generatore.random() + 1 - abs(t - options['taglie'] / 2) / options['taglie']
+                    for t in range(options['taglie'])]
+            quantita = [int(paia * p / sum(pesi)) for p in pesi]
+            quantita[options['taglie'] // 2] += paia - sum(quantita)
+            coppie = list(enumerate(quantita))
+
+            for modalita in (SEQUENZIALE, BILANCIATA):
+                esito = misura(lambda: distribuisci_bolle(coppie, max_totale, max_per_taglia, modalita),
+                               options['ripetizioni'])
+                self._riga(f"{paia} paia - {modalita.lower()}", f"{esito['tempo_ms']:.1f}",
+                           str(len(esito['risultato'])), f"{esito['picco_kb']:.0f}")
+            minimo = numero_minimo_bolle(quantita, max_totale, max_per_taglia)
+            self.stdout.write(f"  minimo teorico: {minimo} bolle")
+
+    def _riga(self, *colonne):
+        self.stdout.write(f"{colonne[0]:<36}{colonne[1]:>10}{colonne[2]:>8}{colonne[3]:>12}")
@@ -0,0 +1,73 @@
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+
+from gestionale.benchmark import esegui_in_rollback, genera_dati_sintetici, misura
+from gestionale.bolle import BILANCIATA, SEQUENZIALE, numero_minimo_bolle
+from gestionale.documenti import (genera_bolla_ordine, genera_bolle_lavoro, genera_bolle_ordini,
+                                  genera_scheda_materiali, genera_scheda_modello, prepara_ordini_bolle)
+from gestionale.models import Modello, Ordine
+
+
+def pdf_in_memoria(generatore, *args, **kwargs):
+    """Genera un documento in memoria e ne restituisce i byte (senza passare dalla cache dei PDF)."""
+    destinazione = BytesIO()
+    generatore(*args, destinazione, **kwargs)
+    return destinazione.getvalue()
+
+
+class Command(BaseCommand):
+    help = ("Misura tempo, picco di memoria, query e dimensione dei PDF (bolla d'ordine, "
+            "scheda materiali, scheda modello, bolle di lavoro) su dati sintetici con molti "
+            "componenti e taglie. I dati vengono creati in una transazione annullata alla fine.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--componenti', type=int, default=25)
+        parser.add_argument('--taglie', type=int, default=34)
+        parser.add_argument('--ordini', type=int, default=3, help="Ordini usati per le bolle di più ordini")
+        parser.add_argument('--paia', type=int, default=30, help="Paia medie per taglia in ogni ordine")
+        parser.add_argument('--max-totale', type=int, default=10, help="Paia massime per bolla")
+        parser.add_argument('--max-per-taglia', type=int, default=None)
+        parser.add_argument('--ripetizioni', type=int, default=3)
+        parser.add_argument('--senza-memoria', action='store_true',
+                            help="Non misura il picco di memoria (l'esecuzione tracciata è molto più lenta)")
+
+    def handle(self, *args, **options):
+        esegui_in_rollback(lambda: self._esegui(options))
+
+    def _esegui(self, options):
+        dati = genera_dati_sintetici(
+            n_modelli=1, n_componenti=options['componenti'], n_taglie=options['taglie'],
+            n_ordini=options['ordini'], paia_per_taglia=options['paia'],
+        )
+        # Oggetti caricati come nelle viste
+        modello = Modello.objects.select_related('cliente').get(pk=dati['modelli'][0].pk)
+        ordine = Ordine.objects.select_related('modello', 'modello__cliente').get(pk=dati['ordini'][0].pk)
+        ordini = list(prepara_ordini_bolle(Ordine.objects.filter(pk__in=[o.pk for o in dati['ordini']])))
+        limiti = {'max_totale': options['max_totale'], 'max_per_taglia': options['max_per_taglia']}
+        quantita = [d.quantita for d in ordine.dettagli.all()]
+
+        self.stdout.write(f"{options['componenti']} componenti, {options['taglie']} taglie, "
+                          f"{ordine.quantita_totale} paia per ordine, max {options['max_totale']} paia per bolla "
+                          f"({numero_minimo_bolle(quantita, **limiti)} bolle)\n")
+        self._riga("Documento", "ms", "query", "picco KB", "PDF KB")
+
+        casi = [
+            ("Bolla d'ordine", lambda: pdf_in_memoria(genera_bolla_ordine, ordine)),
+            ("Scheda materiali", lambda: pdf_in_memoria(genera_scheda_materiali, ordine)),
+            ("Scheda modello", lambda: pdf_in_memoria(genera_scheda_modello, modello)),
+            ("Bolle di lavoro - sequenziale",
+             lambda: pdf_in_memoria(genera_bolle_lavoro, ordine, modalita=SEQUENZIALE, **limiti)),
+            ("Bolle di lavoro - bilanciata",
+             lambda: pdf_in_memoria(genera_bolle_lavoro, ordine, modalita=BILANCIATA, **limiti)),
+            (f"Bolle di {len(ordini)} ordini - sequenziale",
+             lambda: pdf_in_memoria(genera_bolle_ordini, ordini, **limiti)),
+        ]
+        for nome, funzione in casi:
+            esito = misura(funzione, options['ripetizioni'], memoria=not options['senza_memoria'])
+            picco = '-' if esito['picco_kb'] is None else f"{esito['picco_kb']:.0f}"
+            self._riga(nome, f"{esito['tempo_ms']:.1f}", f"{esito['query']:.0f}", picco,
+                       f"{len(esito['risultato']) / 1024:.0f}")
+
+    def _riga(self, *colonne):
+        self.stdout.write(f"{colonne[0]:<36}{colonne[1]:>10}{colonne[2]:>8}{colonne[3]:>12}{colonne[4]:>10}")
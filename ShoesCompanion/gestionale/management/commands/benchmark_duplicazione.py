@@ -0,0 +1,65 @@
+from itertools import count
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from gestionale.benchmark import esegui_in_rollback, genera_dati_sintetici, misura
+from gestionale.models import Articolo, Componente, Modello
+
+
+def duplica_riga_per_riga(modello, new_name):
+    """Duplicazione con una create() per componente e per articolo, come faceva Modello.duplicate."""
+    with transaction.atomic():
+        new_modello = Modello.objects.create(cliente=modello.cliente, nome=new_name, tipo=modello.tipo,
+                                             note=modello.note, created_by=modello.created_by)
+        for componente_originale in modello.componenti.all():
+            new_componente = Componente.objects.create(
+                modello=new_modello,
+                nome_componente=componente_originale.nome_componente,
+                unita_misura=componente_originale.unita_misura,
+                colore=componente_originale.colore,
+                note=componente_originale.note,
+            )
+            for articolo_originale in componente_originale.articoli.all():
+                Articolo.objects.create(
+                    componente=new_componente,
+                    taglia=articolo_originale.taglia,
+                    superficie_mq=articolo_originale.superficie_mq,
+                    superficie_piedi_quadri=articolo_originale.superficie_piedi_quadri,
+                    quantita_unitaria=articolo_originale.quantita_unitaria,
+                )
+    return new_modello
+
+
+class Command(BaseCommand):
+    help = ("Confronta Modello.duplicate (inserimenti in blocco) con la copia riga per riga "
+            "su un modello sintetico. I dati vengono creati in una transazione annullata alla fine.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--componenti', type=int, default=15)
+        parser.add_argument('--taglie', type=int, default=30)
+        parser.add_argument('--ripetizioni', type=int, default=3)
+
+    def handle(self, *args, **options):
+        esegui_in_rollback(lambda: self._esegui(options))
+
+    def _esegui(self, options):
+        dati = genera_dati_sintetici(n_modelli=1, n_componenti=options['componenti'],
+                                     n_taglie=options['taglie'], n_ordini=0)
+        modello = Modello.objects.select_related('cliente').get(pk=dati['modelli'][0].pk)
+        # Ogni copia deve avere un nome diverso (nome unico per cliente)
+        progressivo = count()
+
+        self.stdout.write(f"{options['componenti']} componenti, {options['taglie']} taglie "
+                          f"({options['componenti'] * options['taglie']} articoli)\n")
+        self._riga("Caso", "ms", "query", "picco KB")
+        casi = [
+            ("Riga per riga", lambda: duplica_riga_per_riga(modello, f"Copia {next(progressivo)}")),
+            ("Modello.duplicate (in blocco)", lambda: modello.duplicate(f"Copia {next(progressivo)}")),
+        ]
+        for nome, funzione in casi:
+            esito = misura(funzione, options['ripetizioni'])
+            self._riga(nome, f"{esito['tempo_ms']:.1f}", f"{esito['query']:.0f}", f"{esito['picco_kb']:.0f}")
+
+    def _riga(self, *colonne):
+        self.stdout.write(f"{colonne[0]:<36}{colonne[1]:>10}{colonne[2]:>8}{colonne[3]:>12}")
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+
+from gestionale.benchmark import esegui_in_rollback, genera_dati_sintetici, misura
+from gestionale.materiali import aggrega_materiali_sql, calcola_materiali_ordini
+from gestionale.models import Ordine
+
+
+class Command(BaseCommand):
+    help = ("Confronta il calcolo dei materiali in Python (get_materiali_necessari), "
+            "il motore a query costanti e l'aggregazione SQL su dati sintetici. "
+            "I dati vengono creati in una transazione annullata alla fine.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ordini', type=int, default=200)
+        parser.add_argument('--modelli', type=int, default=10)
+        parser.add_argument('--componenti', type=int, default=15)
+        parser.add_argument('--taglie', type=int, default=30)
+        parser.add_argument('--paia', type=int, default=50, help="Paia medie per taglia in ogni ordine")
+        parser.add_argument('--ripetizioni', type=int, default=3)
+
+    def handle(self, *args, **options):
+        esegui_in_rollback(lambda: self._esegui(options))
+
+    def _esegui(self, options):
+        dati = genera_dati_sintetici(
+            n_modelli=options['modelli'], n_componenti=options['componenti'], n_taglie=options['taglie'],
+            n_ordini=options['ordini'], paia_per_taglia=options['paia'],
+        )
+        ordini = Ordine.objects.filter(pk__in=[o.pk for o in dati['ordini']])
+        ordine_grande = dati['ordini'][0]
+        ripetizioni = options['ripetizioni']
+
+        self.stdout.write(f"{len(dati['ordini'])} ordini, {options['componenti']} componenti, {options['taglie']} taglie\n")
+        self._riga("Caso", "ms", "query", "picco KB")
+
+        casi = [
+            ("Tutti gli ordini - Python per ordine",
+             lambda: [o.get_materiali_necessari() for o in ordini]),
+            ("Tutti gli ordini - motore bulk",
+             lambda: calcola_materiali_ordini(ordini)),
+            ("Tutti gli ordini - aggregazione SQL",
+             lambda: aggrega_materiali_sql(ordini)),
+            ("Ordine singolo - Python",
+             lambda: ordine_grande.get_materiali_necessari()),
+            ("Ordine singolo - aggregazione SQL",
+             lambda: aggrega_materiali_sql(Ordine.objects.filter(pk=ordine_grande.pk))),
+        ]
+        for nome, funzione in casi:
+            esito = misura(funzione, ripetizioni)
+            self._riga(nome, f"{esito['tempo_ms']:.1f}", f"{esito['query']:.0f}", f"{esito['picco_kb']:.0f}")
+
+    def _riga(self, *colonne):
+        self.stdout.write(f"{colonne[0]:<42}{colonne[1]:>10}{colonne[2]:>8}{colonne[3]:>12}")
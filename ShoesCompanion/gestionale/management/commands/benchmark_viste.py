@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+
+from gestionale.benchmark import catalogo_viste, esegui_in_rollback, indirizzo_url, misura_url, url_da_misurare
+
+
+class Command(BaseCommand):
+    help = ("Misura tempo e query di ogni URL con nome (PDF compresi) su un catalogo sintetico "
+            "e segnala quelli oltre il limite di tempo. I dati vengono creati in una transazione "
+            "annullata alla fine.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modelli', type=int, default=25)
+        parser.add_argument('--componenti', type=int, default=12)
+        parser.add_argument('--taglie', type=int, default=15)
+        parser.add_argument('--ordini', type=int, default=60)
+        parser.add_argument('--limite-ms', type=int, default=1000, help="Tempo massimo di una pagina")
+        parser.add_argument('--limite-ms-pdf', type=int, default=5000, help="Tempo massimo di un PDF")
+
+    def handle(self, *args, **options):
+        # Il client di test chiama l'host 'testserver'
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            esegui_in_rollback(lambda: self._esegui(options))
+
+    def _esegui(self, options):
+        utente = User.objects.create_superuser('benchmark_viste')
+        catalogo = catalogo_viste('BENCH', utente, n_modelli=options['modelli'], n_componenti=options['componenti'],
+                                  n_taglie=options['taglie'], n_ordini=options['ordini'])
+        client = Client()
+        client.force_login(utente)
+
+        self.stdout.write(f"{options['modelli']} modelli, {options['componenti']} componenti, "
+                          f"{options['taglie']} taglie, {options['ordini']} ordini\n")
+        self._riga("URL", "ms", "query", "")
+        lenti = 0
+        try:
+            for pattern in url_da_misurare():
+                queries, millisecondi, response = misura_url(client, indirizzo_url(pattern, catalogo, utente))
+                pdf = response.get('Content-Type') == 'application/pdf'
+                limite = options['limite_ms_pdf'] if pdf else options['limite_ms']
+                nota = f"oltre {limite} ms" if millisecondi > limite else ""
+                if response.status_code >= 400:
+                    nota = f"risposta {response.status_code}"
+                lenti += bool(nota)
+                self._riga(pattern.name, f"{millisecondi:.1f}", str(len(queries)), nota)
+        finally:
+            # Il file del lavoro di prova non è annullato con la transazione
+            catalogo['lavoro'].file.delete(save=False)
+
+        stile = self.style.ERROR if lenti else self.style.SUCCESS
+        self.stdout.write(stile(f"\nURL oltre il limite o in errore: {lenti}"))
+
+    def _riga(self, *colonne):
+        self.stdout.write(f"{colonne[0]:<36}{colonne[1]:>10}{colonne[2]:>8}  {colonne[3]}")
@@ -0,0 +1,78 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from gestionale.lavori import (elimina_lavori_vecchi, esegui_lavoro, inizializza_processo,
+                               prendi_lavori, recupera_lavori_interrotti)
+
+
+class Command(BaseCommand):
+    help = ("Esegue i lavori in background (PDF pesanti) accodati dalle viste, "
+            "in un pool di processi. Resta in ascolto finché non viene interrotto.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processi', type=int, default=os.cpu_count() or 1,
+                            help="Processi del pool (0 = esegue i lavori nel processo del comando)")
+        parser.add_argument('--intervallo', type=float, default=2.0,
+                            help="Secondi tra un controllo della coda e il successivo")
+        parser.add_argument('--una-volta', action='store_true',
+                            help="Esegue i lavori in coda ed esce")
+        parser.add_argument('--recupera-dopo', type=int, default=30,
+                            help="Minuti dopo i quali un lavoro IN_CORSO viene rimesso in coda")
+        parser.add_argument('--conserva-giorni', type=int, default=7,
+                            help="Giorni di conservazione dei lavori conclusi e dei loro file")
+
+    def handle(self, *args, **options):
+        recuperati = recupera_lavori_interrotti(options['recupera_dopo'])
+        eliminati = elimina_lavori_vecchi(options['conserva_giorni'])
+        if recuperati or eliminati:
+            self.stdout.write(f"Lavori rimessi in coda: {recuperati}, eliminati: {eliminati}")
+
+        if options['processi'] == 0:
+            self._esegui_in_linea(options)
+        else:
+            self._esegui_nel_pool(options)
+
+    def _esegui_in_linea(self, options):
+        while True:
+            presi = prendi_lavori(1)
+            for lavoro_id in presi:
+                self._esito(lavoro_id, esegui_lavoro(lavoro_id))
+            if not presi:
+                if options['una_volta']:
+                    return
+                time.sleep(options['intervallo'])
+
+    def _esegui_nel_pool(self, options):
+        processi = options['processi']
+        # Le connessioni aperte non vanno ereditate dai processi figli
+        connections.close_all()
+        in_corso = {}
+        with ProcessPoolExecutor(max_workers=processi, initializer=inizializza_processo) as pool:
+            try:
+                while True:
+                    # Solo tanti lavori quanti sono i processi liberi: gli altri restano
+                    # in coda, disponibili per altri worker
+                    for lavoro_id in prendi_lavori(processi - len(in_corso)):
+                        in_corso[pool.submit(esegui_lavoro, lavoro_id)] = lavoro_id
+                    if not in_corso:
+                        if options['una_volta']:
+                            return
+                        time.sleep(options['intervallo'])
+                        continue
+                    completati, _ = wait(in_corso, timeout=options['intervallo'], return_when=FIRST_COMPLETED)
+                    for futuro in completati:
+                        lavoro_id = in_corso.pop(futuro)
+                        try:
+                            self._esito(lavoro_id, futuro.result())
+                        except Exception as errore:  # processo terminato in modo anomalo
+                            self.stderr.write(f"Lavoro #{lavoro_id}: {errore}")
+            except KeyboardInterrupt:
+                self.stdout.write("Interrotto: i lavori in corso vengono completati prima di uscire.")
+
+    def _esito(self, lavoro_id, stato):
+        stile = self.style.SUCCESS if stato == 'COMPLETATO' else self.style.ERROR
+        self.stdout.write(stile(f"Lavoro #{lavoro_id}: {stato}"))
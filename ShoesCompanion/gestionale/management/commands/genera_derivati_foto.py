@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from gestionale.immagini import genera_derivati
+from gestionale.models import Modello
+
+
+class Command(BaseCommand):
+    help = ("Crea le versioni ridotte (PDF, dettaglio, miniatura) delle foto dei modelli "
+            "caricate prima che venissero generate automaticamente.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--forza', action='store_true',
+                            help="Rigenera anche le versioni già presenti (es. dopo un cambio di dimensioni)")
+
+    def handle(self, *args, **options):
+        modelli = Modello.objects.exclude(foto='').exclude(foto__isnull=True).only('pk', 'foto')
+        elaborati = creati = 0
+        for modello in modelli.iterator():
+            creati += len(genera_derivati(modello.foto, forza=options['forza']))
+            elaborati += 1
+        self.stdout.write(self.style.SUCCESS(f"Foto esaminate: {elaborati}, versioni ridotte create: {creati}"))
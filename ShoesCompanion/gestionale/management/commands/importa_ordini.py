@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from gestionale.importazione import ErroreFile, importa_ordini
+
+
+class Command(BaseCommand):
+    help = ("Importa gli ordini da un foglio delle taglie (CSV o XLSX, un ordine per riga). "
+            "Se una riga ha errori non viene importato nulla.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('file')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['file'], 'rb') as file:
+                esito = importa_ordini(file, options['file'])
+        except (OSError, ErroreFile) as e:
+            raise CommandError(str(e))
+        if esito.errori_totali:
+            for riga, messaggio in esito.errori:
+                self.stderr.write(f"Riga {riga}: {messaggio}")
+            raise CommandError(f"{esito.errori_totali} righe con errori su {esito.righe_lette}: nessun ordine importato.")
+        self.stdout.write(f"Importati {esito.ordini} ordini ({esito.dettagli} righe per taglia).")
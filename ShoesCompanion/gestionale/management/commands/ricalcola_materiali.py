@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from gestionale.materiali import aggiorna_riepilogo_materiali, verifica_riepilogo_materiali
+from gestionale.models import Ordine
+
+
+class Command(BaseCommand):
+    help = ("Ricostruisce il riepilogo materiali (MaterialeOrdine) degli ordini, "
+            "oppure con --verifica lo confronta con un ricalcolo completo.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('ordini', nargs='*', type=int, help="Id degli ordini (default: tutti)")
+        parser.add_argument('--verifica', action='store_true',
+                            help="Non modifica nulla: segnala gli ordini con riepilogo non allineato")
+        parser.add_argument('--blocco', type=int, default=500, help="Ordini elaborati per ogni blocco")
+
+    def handle(self, *args, **options):
+        ordini = Ordine.objects.order_by('pk')
+        if options['ordini']:
+            ordini = ordini.filter(pk__in=options['ordini'])
+        ids = list(ordini.values_list('pk', flat=True))
+        blocco = options['blocco']
+
+        if options['verifica']:
+            non_allineati = []
+            for i in range(0, len(ids), blocco):
+                non_allineati += verifica_riepilogo_materiali(Ordine.objects.filter(pk__in=ids[i:i + blocco]))
+            if non_allineati:
+                raise CommandError(f"Riepilogo non allineato per {len(non_allineati)} ordini: {non_allineati}")
+            self.stdout.write(self.style.SUCCESS(f"Riepilogo allineato per {len(ids)} ordini."))
+            return
+
+        righe = 0
+        for i in range(0, len(ids), blocco):
+            righe += aggiorna_riepilogo_materiali(Ordine.objects.filter(pk__in=ids[i:i + blocco]))
+        self.stdout.write(self.style.SUCCESS(f"Riepilogo ricostruito: {len(ids)} ordini, {righe} righe."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from gestionale.ricerca import ricostruisci
+
+
+class Command(BaseCommand):
+    help = ("Ricrea l'indice della ricerca globale (clienti, modelli, componenti). "
+            "Da lanciare dopo importazioni o scritture in blocco che non passano dai segnali.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            ricostruisci()
+        self.stdout.write(self.style.SUCCESS("Indice di ricerca ricostruito."))
@@ -0,0 +1,774 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from decimal import Decimal
+from itertools import groupby
+from operator import attrgetter
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import Case, DecimalField, F, Q, Sum, Value, When
+from django.db.models.functions import Round
+
+from .models import (Articolo, Colore, Componente, ConsumoOrdine, DettaglioOrdine, MaterialeOrdine,
+                     Modello, Ordine, Taglia)
+
+try:
+    import numpy as np
+except ImportError:  # NumPy è nei requisiti; senza, il prodotto matriciale viene fatto in Python
+    np = None
+
+
+# ==============================================================================
+# CALCOLO MATERIALI SU PIÙ ORDINI
+# ==============================================================================
+
+def chiave_materiale(componente):
+    """Chiave con cui vengono raggruppati i materiali (identica a get_materiali_necessari)."""
+    return (
+        componente.nome_componente.nome,
+        componente.colore,
+        componente.descrizione,
+        componente.cod_componente,
+        componente.cod_colore
+    )
+
+
+def nuove_misure(componente):
+    """Crea la voce vuota di un materiale, con le stesse chiavi di get_materiali_necessari."""
+    return {
+        'unita_misura': componente.unita_misura,
+        'unita_misura_display': componente.get_unita_misura_display(),
+        'tot_quantita_unitaria': Decimal('0.0'),
+        'tot_superficie_mq': Decimal('0.0'),
+        'tot_superficie_piedi_quadri': Decimal('0.0')
+    }
+
+
+def somma_materiali(destinazione, materiali):
+    """Somma un dizionario di materiali dentro un altro (es. il totale di più ordini)."""
+    for key, misure in materiali.items():
+        master_entry = destinazione.get(key)
+        if master_entry is None:
+            destinazione[key] = dict(misure)
+            continue
+        master_entry['tot_quantita_unitaria'] += misure['tot_quantita_unitaria']
+        master_entry['tot_superficie_mq'] += misure['tot_superficie_mq']
+        master_entry['tot_superficie_piedi_quadri'] += misure['tot_superficie_piedi_quadri']
+    return destinazione
+
+
+def calcola_materiali_ordini(ordini):
+    """
+    Calcola i materiali necessari per un intero queryset di ordini con un
+    numero costante di query (dettagli, componenti, articoli), invece di
+    chiamare get_materiali_necessari() su ogni ordine.
+
+    Restituisce una tupla (per_ordine, totali):
+    - per_ordine: {ordine_id: materiali} con lo stesso formato di get_materiali_necessari()
+    - totali: la somma dei materiali di tutti gli ordini, stesso formato
+    """
+    modelli_ids = ordini.values('modello_id')
+
+    dettagli = (
+        DettaglioOrdine.objects
+        .filter(ordine__in=ordini.values('pk'))
+        .order_by('ordine_id', 'taglia__numero')
+        .values_list('ordine_id', 'ordine__modello_id', 'taglia_id', 'quantita')
+    )
+
+    # Componenti raggruppati per modello, nello stesso ordine usato da get_materiali_necessari
+    componenti_per_modello = {}
+    for componente in Componente.objects.filter(modello__in=modelli_ids).select_related('nome_componente', 'colore'):
+        componenti_per_modello.setdefault(componente.modello_id, []).append(componente)
+
+    # Le misure vengono lette come tuple: non serve istanziare un Articolo per riga
+    articoli_map = {
+        (componente_id, taglia_id): (superficie_mq, superficie_piedi_quadri, quantita_unitaria)
+        for componente_id, taglia_id, superficie_mq, superficie_piedi_quadri, quantita_unitaria
+        in Articolo.objects.filter(componente__modello__in=modelli_ids).values_list(
+            'componente_id', 'taglia_id', 'superficie_mq', 'superficie_piedi_quadri', 'quantita_unitaria'
+        )
+    }
+
+    per_ordine = {}
+    totali = {}
+    for ordine_id, modello_id, taglia_id, quantita_per_taglia in dettagli:
+        materiali = per_ordine.setdefault(ordine_id, {})
+        if not quantita_per_taglia:
+            continue
+
+        for componente in componenti_per_modello.get(modello_id, ()):
+            misure_articolo = articoli_map.get((componente.id, taglia_id))
+            if not misure_articolo:
+                continue
+            superficie_mq, superficie_piedi_quadri, quantita_unitaria = misure_articolo
+
+            key = chiave_materiale(componente)
+            misure = materiali.get(key)
+            if misure is None:
+                misure = materiali[key] = nuove_misure(componente)
+
+            if componente.unita_misura == 'SUPERFICIE':
+                if superficie_mq is not None:
+                    misure['tot_superficie_mq'] += superficie_mq * quantita_per_taglia
+                if superficie_piedi_quadri is not None:
+                    misure['tot_superficie_piedi_quadri'] += superficie_piedi_quadri * quantita_per_taglia
+            else:  # PEZZI, PAIA, METRI
+                if quantita_unitaria is not None:
+                    misure['tot_quantita_unitaria'] += quantita_unitaria * quantita_per_taglia
+
+    for materiali in per_ordine.values():
+        somma_materiali(totali, materiali)
+
+    return per_ordine, totali
+
+
+# ==============================================================================
+# AGGREGAZIONE MATERIALI NEL DATABASE
+# ==============================================================================
+
+# Campi del gruppo "materiale" letti attraverso il join DettaglioOrdine -> Articolo -> Componente.
+# Hanno gli stessi nomi dei campi di MaterialeOrdine, così le righe hanno lo stesso formato.
+_CAMPI_CHIAVE_SQL = {
+    'tipo_componente_id': F('taglia__articoli__componente__nome_componente_id'),
+    'nome_componente': F('taglia__articoli__componente__nome_componente__nome'),
+    'colore_id': F('taglia__articoli__componente__colore_id'),
+    'descrizione': F('taglia__articoli__componente__descrizione'),
+    'cod_componente': F('taglia__articoli__componente__cod_componente'),
+    'cod_colore': F('taglia__articoli__componente__cod_colore'),
+    'unita_misura': F('taglia__articoli__componente__unita_misura'),
+}
+
+CAMPI_TOTALI = ('tot_quantita_unitaria', 'tot_superficie_mq', 'tot_superficie_piedi_quadri')
+
+QUATTRO_DECIMALI = Decimal('0.0001')
+DUE_DECIMALI = Decimal('0.01')
+_DECIMALI_TOTALI = {
+    'tot_quantita_unitaria': DUE_DECIMALI,
+    'tot_superficie_mq': QUATTRO_DECIMALI,
+    'tot_superficie_piedi_quadri': QUATTRO_DECIMALI,
+}
+
+
+def _quantizza(valore, decimali):
+    """Riporta una somma calcolata dal database alla precisione dei campi di Articolo."""
+    if valore is None:
+        return Decimal('0.0')
+    return Decimal(valore).quantize(decimali)
+
+
+def righe_materiali_sql(ordini, per_ordine=False):
+    """
+    Esegue l'aggregazione nel database e restituisce le righe grezze:
+    un dizionario per (ordine,) materiale con i campi di MaterialeOrdine.
+    """
+    superficie = Q(taglia__articoli__componente__unita_misura='SUPERFICIE')
+
+    def somma(campo, decimali, filtro):
+        # Ogni misura viene arrotondata ai decimali del campo prima di moltiplicarla,
+        # come avviene quando Django la legge in Python (SQLite può conservare più cifre).
+        return Sum(
+            F('quantita') * Round(F(f'taglia__articoli__{campo}'), decimali), filter=filtro,
+            output_field=DecimalField(max_digits=20, decimal_places=decimali)
+        )
+
+    campi_gruppo = dict(_CAMPI_CHIAVE_SQL)
+    if per_ordine:
+        campi_gruppo['ordine_pk'] = F('ordine_id')
+
+    righe = (
+        DettaglioOrdine.objects
+        .filter(
+            ordine__in=ordini.values('pk'),
+            quantita__gt=0,
+            taglia__articoli__componente__modello=F('ordine__modello'),
+        )
+        .values(**campi_gruppo)
+        .annotate(
+            tot_superficie_mq=somma('superficie_mq', 4, superficie),
+            tot_superficie_piedi_quadri=somma('superficie_piedi_quadri', 4, superficie),
+            tot_quantita_unitaria=somma('quantita_unitaria', 2, ~superficie),
+        )
+        .order_by()
+    )
+
+    risultato = []
+    for riga in righe:
+        if per_ordine:
+            riga['ordine_id'] = riga.pop('ordine_pk')
+        for campo, decimali in _DECIMALI_TOTALI.items():
+            riga[campo] = _quantizza(riga[campo], decimali)
+        risultato.append(riga)
+    return risultato
+
+
+def componi_materiali(righe, per_ordine=False):
+    """
+    Trasforma righe con i campi di MaterialeOrdine nel formato di
+    get_materiali_necessari(). Carica i colori con una sola query.
+    """
+    colori = Colore.objects.in_bulk({r['colore_id'] for r in righe} - {None})
+    unita_display = dict(Componente.UNITA_DI_MISURA_CHOICES)
+
+    risultato = {}
+    for riga in righe:
+        materiali = risultato.setdefault(riga['ordine_id'], {}) if per_ordine else risultato
+        key = (riga['nome_componente'], colori.get(riga['colore_id']), riga['descrizione'],
+               riga['cod_componente'], riga['cod_colore'])
+        misure = materiali.get(key)
+        if misure is None:
+            misure = materiali[key] = {
+                'unita_misura': riga['unita_misura'],
+                'unita_misura_display': unita_display.get(riga['unita_misura'], riga['unita_misura']),
+                'tot_quantita_unitaria': Decimal('0.0'),
+                'tot_superficie_mq': Decimal('0.0'),
+                'tot_superficie_piedi_quadri': Decimal('0.0')
+            }
+        for campo in CAMPI_TOTALI:
+            misure[campo] += riga[campo] or 0
+    return risultato
+
+
+def aggrega_materiali_sql(ordini, per_ordine=False):
+    """
+    Come calcola_materiali_ordini(), ma tutta la matematica viene fatta dal
+    database: DettaglioOrdine viene unito ad Articolo sulla coppia
+    (componente del modello dell'ordine, taglia) e le quantità vengono
+    calcolate con SUM(quantita * misura) GROUP BY chiave del materiale.
+    In Python arrivano solo le righe finali (più una query per i colori).
+
+    - Se per_ordine è False restituisce il totale: {chiave: misure}
+    - Se per_ordine è True restituisce {ordine_id: {chiave: misure}}
+    """
+    return componi_materiali(righe_materiali_sql(ordini, per_ordine), per_ordine)
+
+
+def materiali_ordine_sql(ordine):
+    """Materiali necessari per un singolo ordine, calcolati nel database."""
+    return aggrega_materiali_sql(Ordine.objects.filter(pk=ordine.pk))
+
+
+# ==============================================================================
+# DISTINTA BASE COME MATRICE (COMPONENTI x TAGLIE)
+# ==============================================================================
+
+# Le misure vengono convertite in interi (decimi di millesimo per le superfici,
+# centesimi per le quantità): il prodotto matriciale resta esatto e il
+# risultato torna Decimal con gli stessi arrotondamenti del calcolo classico.
+SCALA_SUPERFICIE = 4
+SCALA_QUANTITA = 2
+
+
+def _scala(valore, decimali):
+    if valore is None:
+        return 0
+    return int(Decimal(valore).quantize(Decimal(1).scaleb(-decimali)).scaleb(decimali))
+
+
+def _prodotto(matrice, colonne):
+    """Prodotto matrice (righe x taglie) per matrice (taglie x colonne), su interi."""
+    if np is not None:
+        return (np.array(matrice, dtype=np.int64) @ np.array(colonne, dtype=np.int64)).tolist()
+    return [
+        [sum(m * q for m, q in zip(riga, colonna)) for colonna in zip(*colonne)]
+        for riga in matrice
+    ]
+
+
+class MatriceBOM:
+    """
+    Distinta base di un modello vista come matrice componenti x taglie, con i
+    valori presi dagli Articoli. Un ordine (o una bolla) è un vettore di
+    quantità per taglia: il fabbisogno è il prodotto matrice-vettore, e più
+    bolle insieme sono un unico prodotto matrice-matrice.
+    """
+
+    def __init__(self, componenti, articoli):
+        """
+        - componenti: Componenti del modello (con nome_componente e colore già caricati)
+        - articoli: tuple (componente_id, taglia_id, superficie_mq, superficie_piedi_quadri, quantita_unitaria)
+        """
+        self.componenti = list(componenti)
+        righe = {componente.id: i for i, componente in enumerate(self.componenti)}
+        articoli = [a for a in articoli if a[0] in righe]
+
+        self.taglie_ids = sorted({a[1] for a in articoli})
+        self.colonne = {taglia_id: j for j, taglia_id in enumerate(self.taglie_ids)}
+
+        n_righe, n_colonne = len(self.componenti), len(self.taglie_ids)
+        self.presenza = [[0] * n_colonne for _ in range(n_righe)]
+        self.mq = [[0] * n_colonne for _ in range(n_righe)]
+        self.piedi_quadri = [[0] * n_colonne for _ in range(n_righe)]
+        self.quantita = [[0] * n_colonne for _ in range(n_righe)]
+
+        for componente_id, taglia_id, superficie_mq, superficie_piedi_quadri, quantita_unitaria in articoli:
+            i, j = righe[componente_id], self.colonne[taglia_id]
+            self.presenza[i][j] = 1
+            # Come in get_materiali_necessari, conta solo la misura adatta all'unità del componente
+            if self.componenti[i].unita_misura == 'SUPERFICIE':
+                self.mq[i][j] = _scala(superficie_mq, SCALA_SUPERFICIE)
+                self.piedi_quadri[i][j] = _scala(superficie_piedi_quadri, SCALA_SUPERFICIE)
+            else:
+                self.quantita[i][j] = _scala(quantita_unitaria, SCALA_QUANTITA)
+
+    @classmethod
+    def per_modello(cls, modello):
+        """Costruisce la matrice di un modello con due query (componenti e articoli)."""
+        modello_id = getattr(modello, 'pk', modello)
+        componenti = Componente.objects.filter(modello_id=modello_id).select_related('nome_componente', 'colore')
+        articoli = Articolo.objects.filter(componente__modello_id=modello_id).values_list(
+            'componente_id', 'taglia_id', 'superficie_mq', 'superficie_piedi_quadri', 'quantita_unitaria'
+        )
+        return cls(componenti, articoli)
+
+    @staticmethod
+    def _coppie(quantita_per_taglia):
+        """Coppie (taglia_id, quantita) da un dizionario o da coppie con taglie o id, nell'ordine dato."""
+        if hasattr(quantita_per_taglia, 'items'):
+            quantita_per_taglia = quantita_per_taglia.items()
+        return [(taglia_ref.id if isinstance(taglia_ref, Taglia) else taglia_ref, quantita)
+                for taglia_ref, quantita in quantita_per_taglia]
+
+    def vettore(self, quantita_per_taglia):
+        """
+        Converte le quantità in un vettore allineato alle colonne della matrice.
+        Accetta un dizionario {taglia o taglia_id: quantita} o coppie (taglia, quantita).
+        """
+        vettore = [0] * len(self.taglie_ids)
+        for taglia_id, quantita in self._coppie(quantita_per_taglia):
+            j = self.colonne.get(taglia_id)
+            if j is not None and quantita:
+                vettore[j] += quantita
+        return vettore
+
+    def fabbisogno(self, quantita_per_taglia):
+        """Materiali necessari per un vettore di quantità, nel formato di get_materiali_necessari()."""
+        return self.fabbisogno_bolle([quantita_per_taglia])[0]
+
+    def fabbisogno_bolle(self, bolle):
+        """
+        Materiali necessari per ogni bolla, con un solo prodotto matrice-matrice.
+        Restituisce una lista di dizionari, nello stesso ordine delle bolle.
+        """
+        if not bolle:
+            return []
+        bolle = [self._coppie(bolla) for bolla in bolle]
+        colonne = [self.vettore(bolla) for bolla in bolle]
+        if not self.taglie_ids:
+            return [{} for _ in bolle]
+        quantita = [list(riga) for riga in zip(*colonne)]  # taglie x bolle
+
+        presenza = _prodotto(self.presenza, quantita)
+        mq = _prodotto(self.mq, quantita)
+        piedi_quadri = _prodotto(self.piedi_quadri, quantita)
+        quantita_unitaria = _prodotto(self.quantita, quantita)
+
+        risultati = []
+        for b, bolla in enumerate(bolle):
+            materiali = {}
+            for i in self._ordine_componenti(bolla):
+                if not presenza[i][b]:
+                    continue
+                componente = self.componenti[i]
+                key = chiave_materiale(componente)
+                misure = materiali.get(key)
+                if misure is None:
+                    misure = materiali[key] = nuove_misure(componente)
+                if componente.unita_misura == 'SUPERFICIE':
+                    misure['tot_superficie_mq'] += Decimal(mq[i][b]).scaleb(-SCALA_SUPERFICIE)
+                    misure['tot_superficie_piedi_quadri'] += Decimal(piedi_quadri[i][b]).scaleb(-SCALA_SUPERFICIE)
+                else:
+                    misure['tot_quantita_unitaria'] += Decimal(quantita_unitaria[i][b]).scaleb(-SCALA_QUANTITA)
+            risultati.append(materiali)
+        return risultati
+
+    def _ordine_componenti(self, bolla):
+        """
+        Indici dei componenti nell'ordine in cui get_materiali_necessari() li
+        incontra: per taglia della bolla (nell'ordine dato), poi per componente.
+        Così i materiali escono nello stesso ordine, anche nei PDF.
+        """
+        prima_taglia = {}
+        for posizione, (taglia_id, quantita) in enumerate(bolla):
+            j = self.colonne.get(taglia_id)
+            if j is None or not quantita:
+                continue
+            for i in range(len(self.componenti)):
+                if self.presenza[i][j]:
+                    prima_taglia.setdefault(i, posizione)
+        return sorted(prima_taglia, key=lambda i: (prima_taglia[i], i))
+
+
+# ==============================================================================
+# CACHE DELLE DISTINTE BASE
+# ==============================================================================
+
+class CacheBOM:
+    """
+    Cache LRU delle MatriceBOM, per processo, con chiave (modello_id, bom_versione).
+
+    La versione è salvata sul Modello e viene incrementata dai segnali a ogni
+    modifica di Componenti o Articoli: ogni lettura controlla la versione
+    corrente con una query leggera, quindi un worker non serve mai una
+    distinta base modificata da un altro processo.
+    """
+
+    def __init__(self, dimensione_massima=128):
+        self.dimensione_massima = dimensione_massima
+        self._voci = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, modello):
+        """Restituisce la MatriceBOM aggiornata del modello (istanza o id)."""
+        modello_id = getattr(modello, 'pk', modello)
+        versione = Modello.objects.filter(pk=modello_id).values_list('bom_versione', flat=True).first()
+        chiave = (modello_id, versione)
+
+        with self._lock:
+            bom = self._voci.get(chiave)
+            if bom is not None:
+                self._voci.move_to_end(chiave)
+                self.hits += 1
+                return bom
+            self.misses += 1
+
+        bom = MatriceBOM.per_modello(modello_id)
+
+        with self._lock:
+            # Le versioni precedenti dello stesso modello non serviranno più
+            for vecchia in [k for k in self._voci if k[0] == modello_id]:
+                del self._voci[vecchia]
+            self._voci[chiave] = bom
+            while len(self._voci) > self.dimensione_massima:
+                self._voci.popitem(last=False)
+        return bom
+
+    def statistiche(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'voci': len(self._voci),
+                    'dimensione_massima': self.dimensione_massima}
+
+    def svuota(self):
+        with self._lock:
+            self._voci.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+cache_bom = CacheBOM(getattr(settings, 'BOM_CACHE_DIMENSIONE', 128))
+
+
+# ==============================================================================
+# DISTINTA BASE CONGELATA ALLA CONFERMA (ConsumoOrdine)
+# ==============================================================================
+
+def _righe_consumo(dettagli):
+    """Righe di ConsumoOrdine per dei dettagli, risolte sulla distinta base attuale del modello."""
+    righe = (
+        dettagli
+        .filter(quantita__gt=0, taglia__articoli__componente__modello=F('ordine__modello'))
+        .values(
+            'ordine_id', 'taglia_id', 'quantita',
+            componente_originale_id=F('taglia__articoli__componente_id'),
+            tipo_componente_id=F('taglia__articoli__componente__nome_componente_id'),
+            colore_id=F('taglia__articoli__componente__colore_id'),
+            descrizione=F('taglia__articoli__componente__descrizione'),
+            cod_componente=F('taglia__articoli__componente__cod_componente'),
+            cod_colore=F('taglia__articoli__componente__cod_colore'),
+            unita_misura=F('taglia__articoli__componente__unita_misura'),
+            superficie_mq=F('taglia__articoli__superficie_mq'),
+            superficie_piedi_quadri=F('taglia__articoli__superficie_piedi_quadri'),
+            quantita_unitaria=F('taglia__articoli__quantita_unitaria'),
+        )
+        .order_by()
+    )
+    return [ConsumoOrdine(**riga) for riga in righe]
+
+
+def congela_distinta_base(ordine):
+    """
+    Scrive in ConsumoOrdine i consumi per componente e taglia dell'ordine,
+    risolti sulla distinta base attuale, con una sola INSERT in blocco.
+    """
+    with transaction.atomic():
+        ConsumoOrdine.objects.filter(ordine=ordine).delete()
+        ConsumoOrdine.objects.bulk_create(_righe_consumo(DettaglioOrdine.objects.filter(ordine=ordine)))
+        ordine.distinta_congelata_il = timezone.now()
+        Ordine.objects.filter(pk=ordine.pk).update(distinta_congelata_il=ordine.distinta_congelata_il)
+
+
+def congela_distinte_base(ordini):
+    """
+    Come congela_distinta_base() per un queryset di ordini ancora senza
+    distinta congelata (es. appena importati): una INSERT in blocco e un
+    UPDATE per tutti gli ordini.
+    """
+    with transaction.atomic():
+        ConsumoOrdine.objects.bulk_create(
+            _righe_consumo(DettaglioOrdine.objects.filter(ordine__in=ordini.values('pk'))), batch_size=1000
+        )
+        ordini.update(distinta_congelata_il=timezone.now())
+
+
+def scongela_distinta_base(ordine):
+    """Elimina la distinta congelata: l'ordine torna a seguire il modello."""
+    with transaction.atomic():
+        ConsumoOrdine.objects.filter(ordine=ordine).delete()
+        ordine.distinta_congelata_il = None
+        Ordine.objects.filter(pk=ordine.pk).update(distinta_congelata_il=None)
+
+
+def allinea_consumi(ordine_id):
+    """
+    Riporta nella distinta congelata le quantità attuali dei dettagli dell'ordine.
+    I consumi restano quelli congelati; solo una taglia aggiunta dopo la
+    conferma viene risolta sulla distinta base attuale.
+    """
+    quantita = dict(DettaglioOrdine.objects.filter(ordine_id=ordine_id).values_list('taglia_id', 'quantita'))
+    consumi = ConsumoOrdine.objects.filter(ordine_id=ordine_id)
+    taglie_congelate = set(consumi.values_list('taglia_id', flat=True).distinct())
+    if taglie_congelate:
+        consumi.update(quantita=Case(
+            *[When(taglia_id=taglia_id, then=Value(quantita.get(taglia_id, 0))) for taglia_id in taglie_congelate],
+            default=Value(0)
+        ))
+    taglie_nuove = set(quantita) - taglie_congelate
+    if taglie_nuove:
+        ConsumoOrdine.objects.bulk_create(
+            _righe_consumo(DettaglioOrdine.objects.filter(ordine_id=ordine_id, taglia_id__in=taglie_nuove))
+        )
+
+
+def righe_materiali_congelati(ordini, per_ordine=False):
+    """Come righe_materiali_sql(), ma legge solo la distinta congelata (ConsumoOrdine)."""
+    superficie = Q(unita_misura='SUPERFICIE')
+
+    def somma(campo, decimali, filtro):
+        return Sum(
+            F('quantita') * Round(F(campo), decimali), filter=filtro,
+            output_field=DecimalField(max_digits=20, decimal_places=decimali)
+        )
+
+    campi_gruppo = ['tipo_componente_id', 'colore_id', 'descrizione', 'cod_componente', 'cod_colore', 'unita_misura']
+    if per_ordine:
+        campi_gruppo.insert(0, 'ordine_id')
+    righe = (
+        ConsumoOrdine.objects
+        .filter(ordine__in=ordini.values('pk'), quantita__gt=0)
+        .values(*campi_gruppo)
+        .annotate(
+            nome_componente=F('tipo_componente__nome'),
+            tot_superficie_mq=somma('superficie_mq', 4, superficie),
+            tot_superficie_piedi_quadri=somma('superficie_piedi_quadri', 4, superficie),
+            tot_quantita_unitaria=somma('quantita_unitaria', 2, ~superficie),
+        )
+        .order_by()
+    )
+    righe = list(righe)
+    for riga in righe:
+        for campo, decimali in _DECIMALI_TOTALI.items():
+            riga[campo] = _quantizza(riga[campo], decimali)
+    return righe
+
+
+def righe_materiali(ordini, per_ordine=False):
+    """
+    Righe dei materiali di un queryset di ordini: dalla distinta congelata per
+    gli ordini confermati, dalla distinta base attuale per gli altri.
+    """
+    return (
+        righe_materiali_sql(ordini.filter(distinta_congelata_il__isnull=True), per_ordine)
+        + righe_materiali_congelati(ordini.filter(distinta_congelata_il__isnull=False), per_ordine)
+    )
+
+
+def _matrice_da_consumi(consumi, modello_id):
+    """Ricostruisce una MatriceBOM dalle righe congelate di un ordine."""
+    componenti = {}
+    articoli = []
+    for consumo in consumi:
+        if consumo.componente_originale_id not in componenti:
+            # Componente non salvato, ricostruito dalla distinta congelata
+            componenti[consumo.componente_originale_id] = Componente(
+                id=consumo.componente_originale_id, modello_id=modello_id,
+                nome_componente=consumo.tipo_componente, colore=consumo.colore,
+                descrizione=consumo.descrizione, cod_componente=consumo.cod_componente,
+                cod_colore=consumo.cod_colore, unita_misura=consumo.unita_misura,
+            )
+        articoli.append((consumo.componente_originale_id, consumo.taglia_id, consumo.superficie_mq,
+                         consumo.superficie_piedi_quadri, consumo.quantita_unitaria))
+    return MatriceBOM(componenti.values(), articoli)
+
+
+def _consumi_ordinati(**filtri):
+    return (
+        ConsumoOrdine.objects.filter(**filtri)
+        .select_related('tipo_componente', 'colore')
+        .order_by('ordine_id', 'tipo_componente__nome', 'componente_originale_id')
+    )
+
+
+def distinta_base_ordine(ordine):
+    """
+    MatriceBOM da usare per un ordine: quella congelata se l'ordine è
+    confermato, altrimenti quella attuale del modello (dalla cache).
+    """
+    if not ordine.distinta_congelata_il:
+        return cache_bom.get(ordine.modello_id)
+    return _matrice_da_consumi(_consumi_ordinati(ordine=ordine), ordine.modello_id)
+
+
+def distinte_base_ordini(ordini):
+    """
+    Come distinta_base_ordine() ma per molti ordini insieme: restituisce
+    {ordine_id: MatriceBOM}. Le distinte congelate arrivano da un'unica query,
+    quelle attuali sono caricate una volta per modello e condivise tra gli
+    ordini dello stesso modello.
+    """
+    ordini = list(ordini)
+    distinte = {}
+    congelati = {o.pk: o for o in ordini if o.distinta_congelata_il}
+    if congelati:
+        for ordine_id, consumi in groupby(_consumi_ordinati(ordine_id__in=congelati), key=attrgetter('ordine_id')):
+            distinte[ordine_id] = _matrice_da_consumi(consumi, congelati[ordine_id].modello_id)
+    for ordine in ordini:
+        if ordine.pk not in distinte:
+            if ordine.pk in congelati:
+                # Congelato senza righe (es. ordine senza dettagli): distinta vuota
+                distinte[ordine.pk] = MatriceBOM([], [])
+            else:
+                distinte[ordine.pk] = cache_bom.get(ordine.modello_id)
+    return distinte
+
+
+# ==============================================================================
+# RIEPILOGO MATERIALI MATERIALIZZATO (MaterialeOrdine)
+# ==============================================================================
+
+_CAMPI_RIEPILOGO = ('ordine_id',) + tuple(_CAMPI_CHIAVE_SQL) + CAMPI_TOTALI
+
+
+def aggiorna_riepilogo_materiali(ordini):
+    """
+    Ricalcola le righe di MaterialeOrdine per un queryset di ordini: due
+    aggregazioni SQL (distinta attuale e congelata), una DELETE e una INSERT
+    in blocco, indipendentemente dal numero di ordini.
+    """
+    righe = righe_materiali(ordini, per_ordine=True)
+    with transaction.atomic():
+        MaterialeOrdine.objects.filter(ordine__in=ordini.values('pk')).delete()
+        MaterialeOrdine.objects.bulk_create(
+            [MaterialeOrdine(**{campo: riga[campo] for campo in _CAMPI_RIEPILOGO if campo != 'nome_componente'})
+             for riga in righe],
+            batch_size=500
+        )
+    return len(righe)
+
+
+# Modelli con la distinta base cambiata nella transazione in corso, per thread
+_in_attesa = threading.local()
+
+
+def _riallinea_riepiloghi():
+    """Riallinea in una volta sola il riepilogo materiali degli ordini dei modelli in attesa."""
+    modelli_ids = getattr(_in_attesa, 'modelli', None)
+    _in_attesa.modelli = set()
+    if modelli_ids:
+        # Gli ordini con la distinta congelata non seguono le modifiche al modello
+        aggiorna_riepilogo_materiali(
+            Ordine.objects.filter(modello_id__in=modelli_ids, distinta_congelata_il__isnull=True)
+        )
+
+
+def incrementa_versione_bom(modello_id):
+    """
+    Segna come cambiata la distinta base di un modello (vale per tutti i processi)
+    e riallinea il riepilogo materiali dei suoi ordini al commit.
+
+    La versione cambia subito, così la cache non serve la distinta vecchia
+    nemmeno dentro la transazione. Il riepilogo invece viene ricalcolato una
+    volta per transazione: salvare un formset di 30 articoli lo ricostruisce
+    una volta, non 30. Fuori da una transazione on_commit esegue subito.
+    """
+    if modello_id:
+        Modello.objects.filter(pk=modello_id).update(bom_versione=F('bom_versione') + 1)
+        if not hasattr(_in_attesa, 'modelli'):
+            _in_attesa.modelli = set()
+        _in_attesa.modelli.add(modello_id)
+        # Una callback per chiamata (se un savepoint annullato ne scarta una,
+        # resta quella delle altre), ma il primo che parte svuota l'insieme e
+        # le successive non fanno nulla
+        transaction.on_commit(_riallinea_riepiloghi)
+
+
+_manuale = threading.local()
+
+
+@contextmanager
+def riallineamento_manuale():
+    """
+    Nel blocco i segnali dei dettagli ordine non ricalcolano distinta congelata
+    e riepilogo: chi lo usa li riallinea da sé, una volta sola, alla fine.
+    """
+    precedente = riallineamento_manuale_attivo()
+    _manuale.attivo = True
+    try:
+        yield
+    finally:
+        _manuale.attivo = precedente
+
+
+def riallineamento_manuale_attivo():
+    return getattr(_manuale, 'attivo', False)
+
+
+def _righe_riepilogo(ordini):
+    return list(
+        MaterialeOrdine.objects
+        .filter(ordine__in=ordini)
+        .annotate(nome_componente=F('tipo_componente__nome'))
+        .values(*_CAMPI_RIEPILOGO)
+    )
+
+
+def riepilogo_materiali(ordine):
+    """Materiali di un ordine letti dal riepilogo, nel formato di get_materiali_necessari()."""
+    return componi_materiali(_righe_riepilogo([ordine.pk]))
+
+
+def totale_riepilogo_materiali(ordini):
+    """Somma dei materiali di più ordini, calcolata dal database sul riepilogo."""
+    righe = (
+        MaterialeOrdine.objects
+        .filter(ordine__in=ordini.values('pk'))
+        .values('tipo_componente_id', 'colore_id', 'descrizione', 'cod_componente', 'cod_colore', 'unita_misura')
+        .annotate(
+            nome_componente=F('tipo_componente__nome'),
+            tot_quantita_unitaria=Sum('tot_quantita_unitaria'),
+            tot_superficie_mq=Sum('tot_superficie_mq'),
+            tot_superficie_piedi_quadri=Sum('tot_superficie_piedi_quadri'),
+        )
+        .order_by()
+    )
+    righe = list(righe)
+    for riga in righe:
+        for campo, decimali in _DECIMALI_TOTALI.items():
+            riga[campo] = _quantizza(riga[campo], decimali)
+    return componi_materiali(righe)
+
+
+def verifica_riepilogo_materiali(ordini):
+    """
+    Confronta il riepilogo salvato con un ricalcolo completo.
+    Restituisce gli id degli ordini il cui riepilogo non è allineato.
+    """
+    attesi = componi_materiali(righe_materiali(ordini, per_ordine=True), per_ordine=True)
+    salvati = componi_materiali(_righe_riepilogo(ordini.values('pk')), per_ordine=True)
+    return sorted(
+        ordine_id for ordine_id in set(attesi) | set(salvati)
+        if attesi.get(ordine_id, {}) != salvati.get(ordine_id, {})
+    )
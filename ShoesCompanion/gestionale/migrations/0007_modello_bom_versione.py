@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestionale', '0006_modello_codice_articolo_modello_forma_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='modello',
+            name='bom_versione',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:12
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import DecimalField, F, Q, Sum
+from django.db.models.functions import Round
+
+
+def riempi_riepilogo(apps, schema_editor):
+    """
+    Riempie il riepilogo degli ordini già presenti con la stessa aggregazione
+    di materiali.righe_materiali_sql(), sui modelli storici (a questo punto
+    non esistono ancora distinte congelate).
+    """
+    DettaglioOrdine = apps.get_model('gestionale', 'DettaglioOrdine')
+    MaterialeOrdine = apps.get_model('gestionale', 'MaterialeOrdine')
+    superficie = Q(taglia__articoli__componente__unita_misura='SUPERFICIE')
+
+    def somma(campo, decimali, filtro):
+        return Sum(
+            F('quantita') * Round(F(f'taglia__articoli__{campo}'), decimali), filter=filtro,
+            output_field=DecimalField(max_digits=20, decimal_places=decimali)
+        )
+
+    righe = (
+        DettaglioOrdine.objects
+        .filter(quantita__gt=0, taglia__articoli__componente__modello=F('ordine__modello'))
+        .values(
+            'ordine_id',
+            tipo_componente_id=F('taglia__articoli__componente__nome_componente_id'),
+            colore_id=F('taglia__articoli__componente__colore_id'),
+            descrizione=F('taglia__articoli__componente__descrizione'),
+            cod_componente=F('taglia__articoli__componente__cod_componente'),
+            cod_colore=F('taglia__articoli__componente__cod_colore'),
+            unita_misura=F('taglia__articoli__componente__unita_misura'),
+        )
+        .annotate(
+            tot_superficie_mq=somma('superficie_mq', 4, superficie),
+            tot_superficie_piedi_quadri=somma('superficie_piedi_quadri', 4, superficie),
+            tot_quantita_unitaria=somma('quantita_unitaria', 2, ~superficie),
+        )
+        .order_by()
+    )
+    righe = list(righe)
+
+    decimali = {'tot_quantita_unitaria': Decimal('0.01'),
+                'tot_superficie_mq': Decimal('0.0001'), 'tot_superficie_piedi_quadri': Decimal('0.0001')}
+    for riga in righe:
+        for campo, precisione in decimali.items():
+            riga[campo] = Decimal(riga[campo] or 0).quantize(precisione)
+    MaterialeOrdine.objects.bulk_create(
+        [MaterialeOrdine(**riga) for riga in righe],
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestionale', '0007_modello_bom_versione'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaterialeOrdine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('descrizione', models.CharField(blank=True, max_length=255, null=True)),
+                ('cod_componente', models.CharField(blank=True, max_length=50, null=True)),
+                ('cod_colore', models.CharField(blank=True, max_length=50, null=True)),
+                ('unita_misura', models.CharField(choices=[('SUPERFICIE', 'Superficie (mq/ft²)'), ('PEZZI', 'Pezzi'), ('PAIA', 'Paia'), ('METRI', 'Metri')], max_length=10)),
+                ('tot_quantita_unitaria', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('tot_superficie_mq', models.DecimalField(decimal_places=4, default=0, max_digits=20)),
+                ('tot_superficie_piedi_quadri', models.DecimalField(decimal_places=4, default=0, max_digits=20)),
+                ('colore', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='gestionale.colore')),
+                ('ordine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='materiali', to='gestionale.ordine')),
+                ('tipo_componente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='gestionale.tipocomponente')),
+            ],
+            options={
+                'verbose_name': 'Materiale Ordine (Riepilogo)',
+                'verbose_name_plural': 'Materiali Ordine (Riepilogo)',
+            },
+        ),
+        migrations.RunPython(riempi_riepilogo, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def congela_ordini_confermati(apps, schema_editor):
+    # Usa i modelli attuali come la conferma di un ordine: le migrazioni successive
+    # non cambiano le colonne di Ordine, DettaglioOrdine, Articolo e ConsumoOrdine.
+    from gestionale.materiali import congela_distinte_base
+    from gestionale.models import Ordine
+
+    congela_distinte_base(Ordine.objects.filter(stato__in=Ordine.STATI_CONGELATI, distinta_congelata_il__isnull=True))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestionale', '0008_materialeordine'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ordine',
+            name='distinta_congelata_il',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='ConsumoOrdine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantita', models.IntegerField(default=0)),
+                ('componente_originale_id', models.BigIntegerField(help_text='Id del Componente al momento della conferma')),
+                ('descrizione', models.CharField(blank=True, max_length=255, null=True)),
+                ('cod_componente', models.CharField(blank=True, max_length=50, null=True)),
+                ('cod_colore', models.CharField(blank=True, max_length=50, null=True)),
+                ('unita_misura', models.CharField(choices=[('SUPERFICIE', 'Superficie (mq/ft²)'), ('PEZZI', 'Pezzi'), ('PAIA', 'Paia'), ('METRI', 'Metri')], max_length=10)),
+                ('superficie_mq', models.DecimalField(blank=True, decimal_places=4, max_digits=10, null=True)),
+                ('superficie_piedi_quadri', models.DecimalField(blank=True, decimal_places=4, max_digits=10, null=True)),
+                ('quantita_unitaria', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('colore', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='gestionale.colore')),
+                ('ordine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consumi', to='gestionale.ordine')),
+                ('taglia', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='gestionale.taglia')),
+                ('tipo_componente', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='gestionale.tipocomponente')),
+            ],
+            options={
+                'verbose_name': 'Consumo Ordine (Distinta Congelata)',
+                'verbose_name_plural': 'Consumi Ordine (Distinte Congelate)',
+                'indexes': [models.Index(fields=['ordine', 'taglia'], name='gestionale__ordine__3af90b_idx')],
+            },
+        ),
+        migrations.RunPython(congela_ordini_confermati, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestionale', '0009_consumoordine'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LavoroDocumento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=30)),
+                ('parametri', models.JSONField(default=dict)),
+                ('stato', models.CharField(choices=[('IN_CODA', 'In coda'), ('IN_CORSO', 'In corso'), ('COMPLETATO', 'Completato'), ('ERRORE', 'Errore')], db_index=True, default='IN_CODA', max_length=20)),
+                ('nome_file', models.CharField(max_length=200)),
+                ('file', models.FileField(blank=True, null=True, upload_to='lavori/')),
+                ('errore', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('iniziato_il', models.DateTimeField(blank=True, null=True)),
+                ('completato_il', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='lavori_creati', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Lavoro in Background',
+                'verbose_name_plural': 'Lavori in Background',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
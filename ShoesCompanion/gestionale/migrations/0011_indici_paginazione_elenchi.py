@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestionale', '0010_lavorodocumento'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cliente',
+            index=models.Index(fields=['nome', 'id'], name='gestionale__nome_cfa9e9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='modello',
+            index=models.Index(fields=['nome', 'id'], name='gestionale__nome_cef562_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ordine',
+            index=models.Index(fields=['data_ordine', 'id'], name='gestionale__data_or_2202a7_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+# Indice full-text (FTS5) per la ricerca globale, vedi gestionale/ricerca.py.
+# Il rowid di ogni riga è pk * 4 + tipo (1 cliente, 2 modello, 3 componente).
+CREA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS gestionale_ricerca USING fts5(
+    titolo, testo, tokenize = 'unicode61 remove_diacritics 2'
+)
+"""
+RIEMPI = [
+    "INSERT INTO gestionale_ricerca (rowid, titolo, testo) "
+    "SELECT id * 4 + 1, nome, COALESCE(\"partita_IVA\", '') FROM gestionale_cliente",
+    "INSERT INTO gestionale_ricerca (rowid, titolo, testo) "
+    "SELECT id * 4 + 2, nome, COALESCE(codice_articolo, '') || ' ' || COALESCE(forma, '') FROM gestionale_modello",
+    "INSERT INTO gestionale_ricerca (rowid, titolo, testo) "
+    "SELECT id * 4 + 3, COALESCE(cod_componente, '') || ' ' || COALESCE(cod_colore, ''), COALESCE(descrizione, '') "
+    "FROM gestionale_componente",
+]
+
+
+def crea_indice(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREA)
+    for sql in RIEMPI:
+        schema_editor.execute(sql)
+
+
+def elimina_indice(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS gestionale_ricerca")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestionale', '0011_indici_paginazione_elenchi'),
+    ]
+
+    operations = [
+        migrations.RunPython(crea_indice, elimina_indice),
+    ]
@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.core.validators import MinValueValidator
 from django.utils import timezone
@@ -23,6 +24,8 @@ class Cliente(models.Model):
     class Meta:
         verbose_name_plural = "Clienti"
         ordering = ['nome']
+        # Indice sull'ordinamento dell'elenco: la paginazione per chiave parte da qui
+        indexes = [models.Index(fields=['nome', 'id'])]
 
     def __str__(self):
         return self.nome
@@ -82,6 +85,28 @@ class TipoComponente(models.Model):
         return reverse('tipocomponente_detail', kwargs={'pk': self.pk})
 
 # --- MODELLI PRINCIPALI ---
+def _aggregato_correlato(queryset, campo, aggregato):
+    """Subquery con l'aggregato delle righe di 'queryset' che puntano (con 'campo') alla riga esterna."""
+    righe = queryset.filter(**{campo: models.OuterRef('pk')}).order_by().values(campo)
+    return models.Subquery(righe.annotate(valore=aggregato).values('valore'))
+
+
+class ModelloQuerySet(models.QuerySet):
+    def con_statistiche(self):
+        """
+        Aggiunge 'num_componenti', 'num_ordini', 'totale_paia' e
+        'ultimo_ordine' calcolati nella stessa query dei modelli. Ogni valore
+        è una subquery a parte: con delle JOIN componenti e ordini si
+        moltiplicherebbero tra loro.
+        """
+        return self.annotate(
+            num_componenti=Coalesce(_aggregato_correlato(Componente.objects, 'modello', models.Count('pk')), 0),
+            num_ordini=Coalesce(_aggregato_correlato(Ordine.objects, 'modello', models.Count('pk')), 0),
+            totale_paia=Coalesce(_aggregato_correlato(DettaglioOrdine.objects, 'ordine__modello', models.Sum('quantita')), 0),
+            ultimo_ordine=_aggregato_correlato(Ordine.objects, 'modello', models.Max('data_ordine')),
+        )
+
+
 class Modello(models.Model):
     TIPO_SCARPA_CHOICES = [
         ('CASUAL', 'Casual'), ('ELEGANTE', 'Elegante'), ('SPORTIVA', 'Sportiva'),
@@ -97,11 +122,16 @@ class Modello(models.Model):
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='modelli_creati')
     codice_articolo = models.CharField(max_length=100, blank=True, null=True, verbose_name="Articolo (Codice)")
     forma = models.CharField(max_length=100, blank=True, null=True)
+    # Incrementato a ogni modifica di Componenti/Articoli: invalida la cache della distinta base
+    bom_versione = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = ModelloQuerySet.as_manager()
 
     class Meta:
         verbose_name_plural = "Modelli"
         ordering = ['nome']
         unique_together = ['cliente', 'nome']
+        indexes = [models.Index(fields=['nome', 'id'])]
 
     def __str__(self):
         return f"{self.nome} ({self.get_tipo_display()}) - {self.cliente}"
@@ -110,30 +140,52 @@ class Modello(models.Model):
         return reverse('modello_detail', kwargs={'pk': self.pk})
 
     def duplicate(self, new_name=None, created_by=None):
-        """Duplica il modello, i suoi componenti e le loro misure specifiche (Articoli)."""
-        new_modello = Modello.objects.create(
-            cliente=self.cliente,
-            nome=new_name or f"{self.nome} (Copia)",
-            tipo=self.tipo,
-            note=self.note,
-            created_by=created_by or self.created_by
-        )
-        for componente_originale in self.componenti.all():
-            new_componente = Componente.objects.create(
-                modello=new_modello,
-                nome_componente=componente_originale.nome_componente,
-                unita_misura=componente_originale.unita_misura, # AGGIUNTO
-                colore=componente_originale.colore,
-                note=componente_originale.note
+        """
+        Duplica il modello, i suoi componenti e le loro misure specifiche (Articoli).
+        Componenti e articoli vengono copiati con un inserimento in blocco per
+        tabella: le query non crescono con il numero di componenti e taglie.
+        """
+        # Evita l'import circolare: ricerca.py importa i modelli
+        from .ricerca import indicizza_modelli
+
+        with transaction.atomic():
+            new_modello = Modello.objects.create(
+                cliente=self.cliente,
+                nome=new_name or f"{self.nome} (Copia)",
+                tipo=self.tipo,
+                note=self.note,
+                codice_articolo=self.codice_articolo,
+                forma=self.forma,
+                created_by=created_by or self.created_by,
+                # bulk_create non invia i segnali che incrementano la versione
+                bom_versione=1,
             )
-            for articolo_originale in componente_originale.articoli.all():
-                Articolo.objects.create(
-                    componente=new_componente,
-                    taglia=articolo_originale.taglia,
-                    superficie_mq=articolo_originale.superficie_mq,
-                    superficie_piedi_quadri=articolo_originale.superficie_piedi_quadri,
-                    quantita_unitaria=articolo_originale.quantita_unitaria # AGGIUNTO
+            originali = list(self.componenti.order_by('pk'))
+            nuovi = Componente.objects.bulk_create([
+                Componente(
+                    modello=new_modello,
+                    nome_componente_id=componente.nome_componente_id,
+                    unita_misura=componente.unita_misura,
+                    colore_id=componente.colore_id,
+                    note=componente.note,
+                    descrizione=componente.descrizione,
+                    cod_componente=componente.cod_componente,
+                    cod_colore=componente.cod_colore,
+                )
+                for componente in originali
+            ])
+            copia_di = {originale.pk: nuovo.pk for originale, nuovo in zip(originali, nuovi)}
+            Articolo.objects.bulk_create([
+                Articolo(
+                    componente_id=copia_di[articolo.componente_id],
+                    taglia_id=articolo.taglia_id,
+                    superficie_mq=articolo.superficie_mq,
+                    superficie_piedi_quadri=articolo.superficie_piedi_quadri,
+                    quantita_unitaria=articolo.quantita_unitaria,
                 )
+                for articolo in Articolo.objects.filter(componente__modello=self)
+            ], batch_size=1000)
+            indicizza_modelli([new_modello])
         return new_modello
 
 class Componente(models.Model):
@@ -204,13 +256,28 @@ class Articolo(models.Model):
             qta_str = f"{self.quantita_unitaria:.2f}" if self.quantita_unitaria is not None else "N/A"
             return f"{self.componente} per taglia {self.taglia} ({qta_str} {self.componente.get_unita_misura_display()})"
 
-    def save(self, *args, **kwargs):
+    def completa_superfici(self):
+        """Ricava la superficie mancante (m² o ft²) dall'altra; usato anche dai salvataggi in blocco."""
         if self.superficie_mq is not None and self.superficie_piedi_quadri is None:
             self.superficie_piedi_quadri = self.superficie_mq * SQ_METER_TO_SQ_FOOT
         elif self.superficie_piedi_quadri is not None and self.superficie_mq is None:
             self.superficie_mq = self.superficie_piedi_quadri * SQ_FOOT_TO_SQ_METER
+
+    def save(self, *args, **kwargs):
+        self.completa_superfici()
         super().save(*args, **kwargs)
 
+class OrdineQuerySet(models.QuerySet):
+    def con_totale_paia(self):
+        """
+        Aggiunge 'totale_paia': le paia dell'ordine sommate dal database
+        (ordinabile). È una subquery e non una JOIN con GROUP BY, così un
+        elenco ordinato per data legge dall'indice solo le righe della pagina.
+        """
+        return self.annotate(totale_paia=Coalesce(
+            _aggregato_correlato(DettaglioOrdine.objects, 'ordine', models.Sum('quantita')), 0))
+
+
 class Ordine(models.Model):
     STATO_ORDINE_CHOICES = [
         ('BOZZA', 'Bozza'), ('CONFERMATO', 'Confermato'),
@@ -224,10 +291,18 @@ class Ordine(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='ordini_creati')
+    # Valorizzato quando la distinta base viene congelata in ConsumoOrdine (alla conferma)
+    distinta_congelata_il = models.DateTimeField(blank=True, null=True, editable=False)
+
+    # Stati in cui i consumi dell'ordine non seguono più le modifiche al modello
+    STATI_CONGELATI = ('CONFERMATO', 'IN_PRODUZIONE', 'COMPLETATO')
+
+    objects = OrdineQuerySet.as_manager()
 
     class Meta:
         verbose_name_plural = "Ordini"
         ordering = ['-data_ordine']
+        indexes = [models.Index(fields=['data_ordine', 'id'])]
 
     def __str__(self):
         return f"Ordine #{self.id} - {self.modello.nome}"
@@ -235,8 +310,36 @@ class Ordine(models.Model):
     def get_absolute_url(self):
         return reverse('ordine_detail', kwargs={'pk': self.pk})
 
+    def salva_dettagli(self, quantita_per_taglia):
+        """
+        Scrive le righe per taglia dell'ordine da {taglia_id: quantità}: un
+        solo upsert sul vincolo (ordine, taglia) e una sola DELETE per le
+        taglie tolte, qualunque sia il numero di taglie. Le quantità a zero
+        contano come taglie tolte.
+        """
+        from .materiali import aggiorna_riepilogo_materiali, allinea_consumi, riallineamento_manuale
+
+        quantita_per_taglia = {taglia_id: quantita for taglia_id, quantita in quantita_per_taglia.items()
+                               if quantita and quantita > 0}
+        with transaction.atomic():
+            DettaglioOrdine.objects.bulk_create(
+                [DettaglioOrdine(ordine=self, taglia_id=taglia_id, quantita=quantita)
+                 for taglia_id, quantita in quantita_per_taglia.items()],
+                update_conflicts=True, unique_fields=['ordine', 'taglia'], update_fields=['quantita'],
+            )
+            # Un segnale per ogni riga tolta ricalcolerebbe il riepilogo una volta per taglia
+            with riallineamento_manuale():
+                self.dettagli.exclude(taglia_id__in=list(quantita_per_taglia)).delete()
+            # I dati derivati si riallineano qui, una volta sola
+            if self.distinta_congelata_il:
+                allinea_consumi(self.pk)
+            aggiorna_riepilogo_materiali(Ordine.objects.filter(pk=self.pk))
+
     @property
     def quantita_totale(self):
+        # Negli elenchi il totale arriva già annotato: nessuna query per riga
+        if hasattr(self, 'totale_paia'):
+            return self.totale_paia
         return sum(d.quantita for d in self.dettagli.all() if d.quantita)
 
     # METODO COMPLETAMENTE RISCRITTO
@@ -312,6 +415,61 @@ class DettaglioOrdine(models.Model):
     def __str__(self):
         return f"{self.quantita}x Taglia {self.taglia} per Ordine #{self.ordine.id}"
     
+class MaterialeOrdine(models.Model):
+    """
+    Riepilogo materializzato dei materiali di un ordine: una riga per materiale,
+    con gli stessi totali di get_materiali_necessari(). Viene aggiornato dai
+    segnali quando cambiano i dettagli dell'ordine o la distinta base del modello.
+    """
+    ordine = models.ForeignKey(Ordine, on_delete=models.CASCADE, related_name='materiali')
+    tipo_componente = models.ForeignKey(TipoComponente, on_delete=models.CASCADE, related_name='+')
+    colore = models.ForeignKey(Colore, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    descrizione = models.CharField(max_length=255, blank=True, null=True)
+    cod_componente = models.CharField(max_length=50, blank=True, null=True)
+    cod_colore = models.CharField(max_length=50, blank=True, null=True)
+    unita_misura = models.CharField(max_length=10, choices=Componente.UNITA_DI_MISURA_CHOICES)
+    tot_quantita_unitaria = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    tot_superficie_mq = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+    tot_superficie_piedi_quadri = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+
+    class Meta:
+        verbose_name = "Materiale Ordine (Riepilogo)"
+        verbose_name_plural = "Materiali Ordine (Riepilogo)"
+
+    def __str__(self):
+        return f"{self.tipo_componente} per Ordine #{self.ordine_id}"
+
+
+class ConsumoOrdine(models.Model):
+    """
+    Distinta base congelata alla conferma dell'ordine: una riga per
+    componente e taglia con il consumo per paio e le paia di quella taglia.
+    I report degli ordini confermati leggono solo questa tabella, quindi non
+    cambiano se il modello viene modificato in seguito.
+    """
+    ordine = models.ForeignKey(Ordine, on_delete=models.CASCADE, related_name='consumi')
+    taglia = models.ForeignKey(Taglia, on_delete=models.CASCADE, related_name='+')
+    quantita = models.IntegerField(default=0)
+    componente_originale_id = models.BigIntegerField(help_text="Id del Componente al momento della conferma")
+    tipo_componente = models.ForeignKey(TipoComponente, on_delete=models.PROTECT, related_name='+')
+    colore = models.ForeignKey(Colore, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    descrizione = models.CharField(max_length=255, blank=True, null=True)
+    cod_componente = models.CharField(max_length=50, blank=True, null=True)
+    cod_colore = models.CharField(max_length=50, blank=True, null=True)
+    unita_misura = models.CharField(max_length=10, choices=Componente.UNITA_DI_MISURA_CHOICES)
+    superficie_mq = models.DecimalField(max_digits=10, decimal_places=4, blank=True, null=True)
+    superficie_piedi_quadri = models.DecimalField(max_digits=10, decimal_places=4, blank=True, null=True)
+    quantita_unitaria = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Consumo Ordine (Distinta Congelata)"
+        verbose_name_plural = "Consumi Ordine (Distinte Congelate)"
+        indexes = [models.Index(fields=['ordine', 'taglia'])]
+
+    def __str__(self):
+        return f"{self.tipo_componente} taglia {self.taglia} per Ordine #{self.ordine_id}"
+
+
 class StrutturaModello(models.Model):
     nome = models.CharField(max_length=100, unique=True, help_text="Es. Décolleté Base, Stivale Texano, Sandalo Gioiello")
     tipi_componente = models.ManyToManyField(TipoComponente, help_text="Seleziona i componenti base per questo tipo di struttura.")
@@ -322,4 +480,59 @@ class StrutturaModello(models.Model):
         ordering = ['nome']
 
     def __str__(self):
-        return self.nome
\ No newline at end of file
+        return self.nome
+
+    def crea_componenti(self, modelli, taglie=()):
+        """
+        Crea i componenti di base della struttura per tutti i modelli con un
+        solo inserimento e, se ci sono delle taglie, la griglia degli Articoli
+        (ancora senza misure) con un secondo inserimento.
+        """
+        from .ricerca import indicizza_modelli
+
+        tipi = list(self.tipi_componente.all())
+        with transaction.atomic():
+            componenti = Componente.objects.bulk_create([
+                Componente(modello=modello, nome_componente=tipo) for modello in modelli for tipo in tipi
+            ])
+            Articolo.objects.bulk_create([
+                Articolo(componente=componente, taglia=taglia) for componente in componenti for taglia in taglie
+            ], batch_size=1000)
+            # I segnali non partono con bulk_create: l'indice di ricerca si aggiorna qui
+            indicizza_modelli(modelli)
+        return componenti
+
+class LavoroDocumento(models.Model):
+    """
+    Documento pesante (es. centinaia di bolle) generato in background dal
+    comando 'esegui_lavori' invece che dentro la richiesta web.
+    """
+    STATO_CHOICES = [
+        ('IN_CODA', 'In coda'), ('IN_CORSO', 'In corso'),
+        ('COMPLETATO', 'Completato'), ('ERRORE', 'Errore')
+    ]
+    tipo = models.CharField(max_length=30)
+    parametri = models.JSONField(default=dict)
+    stato = models.CharField(max_length=20, choices=STATO_CHOICES, default='IN_CODA', db_index=True)
+    nome_file = models.CharField(max_length=200)
+    file = models.FileField(upload_to='lavori/', blank=True, null=True)
+    errore = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    iniziato_il = models.DateTimeField(blank=True, null=True)
+    completato_il = models.DateTimeField(blank=True, null=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='lavori_creati')
+
+    class Meta:
+        verbose_name = "Lavoro in Background"
+        verbose_name_plural = "Lavori in Background"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Lavoro #{self.pk} - {self.nome_file} ({self.get_stato_display()})"
+
+    def get_absolute_url(self):
+        return reverse('lavoro_detail', kwargs={'pk': self.pk})
+
+    @property
+    def in_attesa(self):
+        return self.stato in ('IN_CODA', 'IN_CORSO')
@@ -0,0 +1,234 @@
+"""
+Paginazione per chiave (keyset) degli elenchi lunghi.
+
+Con la paginazione a numeri di pagina il database conta tutte le righe e,
+per la pagina N, scorre e scarta le righe di tutte quelle precedenti
+(OFFSET): in fondo a un elenco lungo ogni pagina costa sempre di più.
+Qui ogni pagina riparte dall'ultima riga della precedente con un filtro
+sui campi di ordinamento ("dopo questi valori"), più la chiave primaria
+per rendere l'ordine univoco: la pagina N costa quanto la prima.
+
+Si integra con django-tables2: la tabella viene prima filtrata e
+ordinata come sempre (django-filter e il parametro 'sort'), poi paginata
+con PaginatoreKeyset al posto del Paginator di Django. Gli ordinamenti
+che non si prestano (annotazioni come 'totale_paia', campi che ammettono
+NULL) restano paginati a numeri di pagina.
+"""
+import base64
+import binascii
+import datetime
+import json
+import operator
+from decimal import Decimal
+from functools import reduce
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import F, Q
+from django_tables2 import RequestConfig
+from django_tables2.rows import BoundRows
+
+PARAMETRO_CURSORE = 'cursore'
+TEMPLATE_KEYSET = 'gestionale/tabella_keyset.html'
+
+
+def _campo(modello, nome):
+    if nome == 'pk':
+        return modello._meta.pk
+    return modello._meta.get_field(nome)
+
+
+def _risolvi(modello, percorso):
+    """
+    Campi concreti con cui il database ordina per 'percorso': una relazione
+    si ordina con l'ordinamento del modello collegato, come fa Django.
+    Restituisce una lista di (percorso, discendente, campo) o None se il
+    percorso non si presta alla paginazione per chiave.
+    """
+    parti = percorso.split('__')
+    corrente = modello
+    for indice, parte in enumerate(parti):
+        try:
+            campo = _campo(corrente, parte)
+        except FieldDoesNotExist:
+            return None
+        # NULL non si confronta con < e >; le relazioni inverse moltiplicano le righe
+        if getattr(campo, 'null', True) or (campo.is_relation and not campo.many_to_one):
+            return None
+        if campo.is_relation:
+            corrente = campo.related_model
+        elif indice < len(parti) - 1:
+            return None
+
+    if not campo.is_relation:
+        return [(percorso, False, campo)]
+    chiavi = []
+    for voce in corrente._meta.ordering or ['pk']:
+        sotto = _risolvi(corrente, voce.lstrip('-'))
+        if sotto is None:
+            return None
+        chiavi += [(f"{percorso}__{nome}", discendente != voce.startswith('-'), campo)
+                   for nome, discendente, campo in sotto]
+    return chiavi
+
+
+def chiavi_ordinamento(queryset):
+    """
+    Campi su cui paginare per chiave il queryset, nell'ordine in cui è
+    ordinato, con la chiave primaria in fondo; None se non è possibile.
+    """
+    ordinamento = queryset.query.order_by or queryset.model._meta.ordering
+    chiavi = []
+    for voce in ordinamento:
+        if not isinstance(voce, str):
+            return None
+        risolte = _risolvi(queryset.model, voce.lstrip('-'))
+        if risolte is None:
+            return None
+        chiavi += [(percorso, discendente != voce.startswith('-'), campo)
+                   for percorso, discendente, campo in risolte]
+    pk = queryset.model._meta.pk
+    if not any(campo == pk and '__' not in percorso for percorso, _, campo in chiavi):
+        chiavi.append(('pk', chiavi[0][1] if chiavi else False, pk))
+    return chiavi
+
+
+def _firma(chiavi):
+    return [('-' if discendente else '') + percorso for percorso, discendente, _ in chiavi]
+
+
+def _valore_json(valore):
+    # Non DjangoJSONEncoder: tronca i microsecondi e il confronto salterebbe delle righe
+    if isinstance(valore, (datetime.date, datetime.time)):
+        return valore.isoformat()
+    if isinstance(valore, Decimal):
+        return str(valore)
+    return valore
+
+
+def codifica_cursore(chiavi, valori, indietro=False):
+    dati = {'o': _firma(chiavi), 'v': [_valore_json(v) for v in valori], 'i': indietro}
+    testo = json.dumps(dati, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(testo).decode().rstrip('=')
+
+
+def decodifica_cursore(chiavi, cursore):
+    """
+    Restituisce (valori, indietro), o (None, False) se il cursore manca,
+    è illeggibile o è di un altro ordinamento (es. dopo un cambio di colonna).
+    """
+    if not cursore:
+        return None, False
+    try:
+        testo = base64.urlsafe_b64decode(cursore + '=' * (-len(cursore) % 4))
+        dati = json.loads(testo)
+        if dati['o'] != _firma(chiavi) or len(dati['v']) != len(chiavi):
+            return None, False
+        valori = [campo.to_python(valore) for (_, _, campo), valore in zip(chiavi, dati['v'])]
+        return valori, bool(dati.get('i'))
+    except (binascii.Error, ValueError, TypeError, KeyError, ValidationError):
+        return None, False
+
+
+def filtro_dopo(chiavi, valori, indietro=False):
+    """
+    Righe che vengono dopo (o prima, con indietro=True) quei valori
+    nell'ordinamento: (a > x) OR (a = x AND b > y) OR ...
+    """
+    alternative = []
+    uguali = Q()
+    for (percorso, discendente, _), valore in zip(chiavi, valori):
+        confronto = 'lt' if discendente != indietro else 'gt'
+        alternative.append(uguali & Q(**{f"{percorso}__{confronto}": valore}))
+        uguali &= Q(**{percorso: valore})
+    # Condizione ridondante sul primo campo: il database parte dal punto
+    # giusto dell'indice invece di scorrerlo dall'inizio
+    percorso, discendente, _ = chiavi[0]
+    limite = Q(**{f"{percorso}__{'lte' if discendente != indietro else 'gte'}": valori[0]})
+    return limite & reduce(operator.or_, alternative)
+
+
+class PaginaKeyset:
+    """Pagina con la stessa interfaccia usata dai template di Page, senza numero né totale."""
+
+    def __init__(self, object_list, precedente, successivo):
+        self.object_list = object_list
+        self._precedente = precedente
+        self._successivo = successivo
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_previous(self):
+        return self._precedente is not None
+
+    def has_next(self):
+        return self._successivo is not None
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def previous_page_number(self):
+        return self._precedente
+
+    def next_page_number(self):
+        return self._successivo
+
+
+class PaginatoreKeyset:
+    """
+    Paginatore per Table.paginate() di django-tables2: la "pagina" richiesta
+    è un cursore, e i numeri di pagina di PaginaKeyset sono i cursori della
+    pagina precedente e successiva. Non conta mai le righe.
+    """
+
+    def __init__(self, righe, per_pagina, chiavi):
+        self.righe = righe
+        self.per_pagina = per_pagina
+        self.chiavi = chiavi
+
+    def page(self, cursore):
+        valori, indietro = decodifica_cursore(self.chiavi, cursore)
+        alias = [f"chiave_keyset_{i}" for i in range(len(self.chiavi))]
+        queryset = self.righe.data.data.annotate(
+            **{nome: F(percorso) for nome, (percorso, _, _) in zip(alias, self.chiavi)})
+        if valori is not None:
+            queryset = queryset.filter(filtro_dopo(self.chiavi, valori, indietro))
+        queryset = queryset.order_by(*[('-' if discendente != indietro else '') + percorso
+                                       for percorso, discendente, _ in self.chiavi])
+
+        # Una riga in più dice se c'è un'altra pagina in quella direzione
+        record = list(queryset[:self.per_pagina + 1])
+        altre = len(record) > self.per_pagina
+        record = record[:self.per_pagina]
+        if indietro:
+            record.reverse()
+
+        def cursore_di(riga, verso_indietro):
+            return codifica_cursore(self.chiavi, [getattr(riga, nome) for nome in alias], verso_indietro)
+
+        precedente = successivo = None
+        if record and (altre if indietro else valori is not None):
+            precedente = cursore_di(record[0], True)
+        if record and (altre or indietro):
+            successivo = cursore_di(record[-1], False)
+        return PaginaKeyset(BoundRows(record, table=self.righe.table), precedente, successivo)
+
+
+def pagina_tabella(table, request, per_pagina):
+    """
+    Ordina la tabella secondo la richiesta e la pagina per chiave se
+    l'ordinamento lo permette, altrimenti a numeri di pagina.
+    """
+    RequestConfig(request, paginate=False).configure(table)
+    chiavi = chiavi_ordinamento(table.data.data)
+    if chiavi is None:
+        RequestConfig(request, paginate={'per_page': per_pagina}).configure(table)
+        return table
+    table.template_name = TEMPLATE_KEYSET
+    table.page_field = PARAMETRO_CURSORE
+    table.paginate(PaginatoreKeyset, per_page=per_pagina,
+                   page=request.GET.get(table.prefixed_page_field), chiavi=chiavi)
+    return table
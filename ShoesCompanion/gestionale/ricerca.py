@@ -0,0 +1,149 @@
+"""
+Ricerca globale su clienti, modelli e codici/descrizioni dei componenti.
+
+I testi da cercare stanno in una tabella virtuale FTS5 di SQLite
+(gestionale_ricerca, creata da una migrazione): una ricerca è una lettura
+dell'indice ordinata per pertinenza (bm25), non una scansione con LIKE
+di ogni tabella. L'indice viene aggiornato dai segnali a ogni
+salvataggio ed eliminazione; le scritture in blocco (bulk_create,
+update) non inviano segnali, e dopo di esse va lanciato il comando
+'ricostruisci_indice_ricerca'.
+
+Ogni riga dell'indice ha come rowid la chiave primaria dell'oggetto
+moltiplicata per il numero di tipi più il codice del tipo: aggiornare o
+togliere un oggetto è una ricerca per rowid, senza colonne di appoggio.
+"""
+import re
+from dataclasses import dataclass
+
+from django.db import connection
+
+from .models import Cliente, Componente, Modello
+
+TABELLA = 'gestionale_ricerca'
+
+CLIENTE, MODELLO, COMPONENTE = 1, 2, 3
+TIPI = 4  # Moltiplicatore del rowid: i codici dei tipi devono restare sotto
+MODELLI_INDICIZZATI = {Cliente: CLIENTE, Modello: MODELLO, Componente: COMPONENTE}
+
+# Peso delle colonne nel punteggio: il nome (o il codice) conta più del resto
+PESO_TITOLO, PESO_TESTO = 10.0, 3.0
+
+# Titolo e testo indicizzati per ogni tipo, come espressioni SQL sulla tabella
+# dell'oggetto: servono sia alla ricostruzione che all'aggiornamento di una riga
+SQL_TESTI = {
+    CLIENTE: ("gestionale_cliente", "nome", "COALESCE(\"partita_IVA\", '')"),
+    MODELLO: ("gestionale_modello", "nome",
+              "COALESCE(codice_articolo, '') || ' ' || COALESCE(forma, '')"),
+    COMPONENTE: ("gestionale_componente",
+                 "COALESCE(cod_componente, '') || ' ' || COALESCE(cod_colore, '')",
+                 "COALESCE(descrizione, '')"),
+}
+
+
+def _rowid(tipo, pk):
+    return pk * TIPI + tipo
+
+
+def _inserisci_sql(tipo):
+    tabella, titolo, testo = SQL_TESTI[tipo]
+    return (f"INSERT INTO {TABELLA} (rowid, titolo, testo) "
+            f"SELECT id * {TIPI} + {tipo}, {titolo}, {testo} FROM {tabella}")
+
+
+def indicizza(oggetto):
+    """Aggiorna la riga dell'indice di un cliente, modello o componente."""
+    tipo = MODELLI_INDICIZZATI[type(oggetto)]
+    rowid = _rowid(tipo, oggetto.pk)
+    with connection.cursor() as cursore:
+        cursore.execute(f"DELETE FROM {TABELLA} WHERE rowid = %s", [rowid])
+        cursore.execute(_inserisci_sql(tipo) + " WHERE id = %s", [oggetto.pk])
+
+
+def indicizza_modelli(modelli):
+    """
+    Aggiorna insieme le righe di più modelli e dei loro componenti (dopo
+    un bulk_create, che non invia segnali): due query per tipo, qualunque
+    sia il numero di oggetti.
+    """
+    pk = [modello.pk for modello in modelli]
+    if not pk:
+        return
+    segnaposto = ', '.join(['%s'] * len(pk))
+    with connection.cursor() as cursore:
+        for tipo, colonna in ((MODELLO, 'id'), (COMPONENTE, 'modello_id')):
+            tabella = SQL_TESTI[tipo][0]
+            cursore.execute(
+                f"DELETE FROM {TABELLA} WHERE rowid IN "
+                f"(SELECT id * {TIPI} + {tipo} FROM {tabella} WHERE {colonna} IN ({segnaposto}))", pk)
+            cursore.execute(_inserisci_sql(tipo) + f" WHERE {colonna} IN ({segnaposto})", pk)
+
+
+def rimuovi(oggetto):
+    tipo = MODELLI_INDICIZZATI[type(oggetto)]
+    with connection.cursor() as cursore:
+        cursore.execute(f"DELETE FROM {TABELLA} WHERE rowid = %s", [_rowid(tipo, oggetto.pk)])
+
+
+def ricostruisci():
+    """Ricrea l'intero indice dalle tabelle (dopo importazioni o scritture in blocco)."""
+    with connection.cursor() as cursore:
+        cursore.execute(f"DELETE FROM {TABELLA}")
+        for tipo in SQL_TESTI:
+            cursore.execute(_inserisci_sql(tipo))
+        # Compatta i segmenti dell'indice dopo tante scritture
+        cursore.execute(f"INSERT INTO {TABELLA} ({TABELLA}) VALUES ('optimize')")
+
+
+def espressione_fts(testo):
+    """
+    Traduce il testo cercato in una query FTS5: ogni parola è un prefisso
+    tra virgolette (niente operatori o sintassi FTS dall'utente) e devono
+    comparire tutte.
+    """
+    parole = re.findall(r'\w+', testo)
+    return ' '.join(f'"{parola}"*' for parola in parole)
+
+
+@dataclass
+class Risultato:
+    tipo: int
+    oggetto: object
+    punteggio: float
+
+    @property
+    def url(self):
+        # Un componente non ha una pagina sua: si apre il modello
+        if self.tipo == COMPONENTE:
+            return self.oggetto.modello.get_absolute_url()
+        return self.oggetto.get_absolute_url()
+
+
+def cerca(testo, limite=30):
+    """
+    Clienti, modelli e componenti che contengono tutte le parole cercate,
+    dal più pertinente. Gli oggetti vengono caricati con una query per tipo.
+    """
+    espressione = espressione_fts(testo)
+    if not espressione:
+        return []
+    with connection.cursor() as cursore:
+        cursore.execute(
+            f"SELECT rowid, bm25({TABELLA}, %s, %s) AS punteggio FROM {TABELLA} "
+            f"WHERE {TABELLA} MATCH %s ORDER BY punteggio LIMIT %s",
+            [PESO_TITOLO, PESO_TESTO, espressione, limite],
+        )
+        righe = cursore.fetchall()
+
+    trovati = [(rowid % TIPI, rowid // TIPI, punteggio) for rowid, punteggio in righe]
+    oggetti = {
+        CLIENTE: Cliente.objects.all(),
+        MODELLO: Modello.objects.select_related('cliente'),
+        COMPONENTE: Componente.objects.select_related('modello', 'nome_componente', 'colore'),
+    }
+    for tipo, queryset in oggetti.items():
+        pk = [pk for tipo_trovato, pk, _ in trovati if tipo_trovato == tipo]
+        oggetti[tipo] = queryset.in_bulk(pk) if pk else {}
+    # bm25 è negativo: più è basso, più il risultato è pertinente
+    return [Risultato(tipo, oggetti[tipo][pk], -punteggio)
+            for tipo, pk, punteggio in trovati if pk in oggetti[tipo]]
@@ -0,0 +1,106 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .immagini import elimina_derivati, genera_derivati
+from .materiali import (aggiorna_riepilogo_materiali, allinea_consumi, congela_distinta_base,
+                        incrementa_versione_bom, riallineamento_manuale_attivo, scongela_distinta_base)
+from .models import Articolo, Cliente, Colore, Componente, DettaglioOrdine, Modello, Ordine, TipoComponente
+from .ricerca import indicizza, rimuovi
+
+
+@receiver(post_save, sender=Componente)
+@receiver(post_delete, sender=Componente)
+def componente_modificato(sender, instance, origin=None, **kwargs):
+    # Se si sta eliminando l'intero modello non c'è nulla da invalidare
+    if isinstance(origin, Modello):
+        return
+    incrementa_versione_bom(instance.modello_id)
+
+
+@receiver(post_save, sender=Articolo)
+@receiver(post_delete, sender=Articolo)
+def articolo_modificato(sender, instance, origin=None, **kwargs):
+    # Nelle eliminazioni a cascata ci pensa già il segnale del Componente/Modello
+    if isinstance(origin, (Componente, Modello)):
+        return
+    if Articolo.componente.is_cached(instance):
+        modello_id = instance.componente.modello_id
+    else:
+        modello_id = Componente.objects.filter(pk=instance.componente_id).values_list('modello_id', flat=True).first()
+    incrementa_versione_bom(modello_id)
+
+
+@receiver(post_save, sender=Colore)
+@receiver(post_save, sender=TipoComponente)
+def anagrafica_componente_modificata(sender, instance, created, **kwargs):
+    # Nomi di colori e tipi compaiono nelle distinte in cache e nei PDF: basta
+    # una nuova versione, i totali dei materiali non cambiano
+    if created:
+        return
+    campo = 'colore' if sender is Colore else 'nome_componente'
+    Modello.objects.filter(**{f'componenti__{campo}': instance}).update(bom_versione=F('bom_versione') + 1)
+
+
+@receiver(post_init, sender=Modello)
+def ricorda_foto(sender, instance, **kwargs):
+    # Il nome letto dal database, senza caricare la foto se il campo è differito
+    nome = instance.__dict__.get('foto')
+    instance._foto_caricata = nome if isinstance(nome, str) else None
+
+
+@receiver(post_save, sender=Modello)
+def modello_salvato(sender, instance, **kwargs):
+    # Una foto sostituita o tolta lascia versioni ridotte che nessuno userebbe più
+    if instance._foto_caricata and instance._foto_caricata != instance.foto.name:
+        elimina_derivati(instance.foto, instance._foto_caricata)
+    instance._foto_caricata = instance.foto.name
+    # Alla prima foto (o a una foto nuova) si preparano le versioni ridotte
+    if instance.foto:
+        genera_derivati(instance.foto)
+
+
+@receiver(post_delete, sender=Modello)
+def modello_eliminato(sender, instance, **kwargs):
+    if instance.foto:
+        elimina_derivati(instance.foto)
+
+
+@receiver(post_save, sender=DettaglioOrdine)
+@receiver(post_delete, sender=DettaglioOrdine)
+def dettaglio_ordine_modificato(sender, instance, origin=None, **kwargs):
+    # Se si sta eliminando l'ordine, il riepilogo viene eliminato a cascata
+    if isinstance(origin, (Ordine, Modello)) or riallineamento_manuale_attivo():
+        return
+    ordini = Ordine.objects.filter(pk=instance.ordine_id)
+    if ordini.filter(distinta_congelata_il__isnull=False).exists():
+        allinea_consumi(instance.ordine_id)
+    aggiorna_riepilogo_materiali(ordini)
+
+
+@receiver(post_save, sender=Ordine)
+def ordine_salvato(sender, instance, created, **kwargs):
+    # Alla conferma la distinta base viene congelata; tornando in bozza segue di nuovo il modello
+    if instance.stato in Ordine.STATI_CONGELATI and not instance.distinta_congelata_il:
+        congela_distinta_base(instance)
+    elif instance.stato == 'BOZZA' and instance.distinta_congelata_il:
+        scongela_distinta_base(instance)
+    # Un ordine modificato può puntare a un altro modello (es. una variante)
+    if not created:
+        aggiorna_riepilogo_materiali(Ordine.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Cliente)
+@receiver(post_save, sender=Modello)
+@receiver(post_save, sender=Componente)
+def aggiorna_indice_ricerca(sender, instance, raw=False, **kwargs):
+    # Nel caricamento delle fixture (raw) l'indice si ricostruisce a parte
+    if not raw:
+        indicizza(instance)
+
+
+@receiver(post_delete, sender=Cliente)
+@receiver(post_delete, sender=Modello)
+@receiver(post_delete, sender=Componente)
+def rimuovi_da_indice_ricerca(sender, instance, **kwargs):
+    rimuovi(instance)
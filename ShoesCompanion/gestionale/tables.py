@@ -18,6 +18,16 @@ class ClienteTable(tables.Table):
         sequence = ('nome', 'numero_telefono', 'partita_IVA', 'azioni')
 
 class ModelloTable(tables.Table):
+    # Miniatura pregenerata: l'elenco non scarica mai le foto originali
+    foto = tables.TemplateColumn(
+        template_code='''
+        {% load gestionale_extras %}
+        {% if record.foto %}
+            <img src="{{ record.foto|foto_ridotta:'miniatura' }}" alt="{{ record.nome }}" width="48" height="48" style="object-fit: cover;" class="rounded border" loading="lazy">
+        {% endif %}
+        ''',
+        orderable=False, verbose_name='Foto'
+    )
     azioni = tables.TemplateColumn(
         template_name='gestionale/modelli/modello_actions.html',
         orderable=False, verbose_name='Azioni'
@@ -28,8 +38,8 @@ class ModelloTable(tables.Table):
     class Meta:
         model = Modello
         template_name = "django_tables2/bootstrap5.html"
-        fields = ('nome', 'cliente', 'tipo', 'created_at', 'azioni')
-        sequence = ('nome', 'cliente', 'tipo', 'created_at', 'azioni')
+        fields = ('foto', 'nome', 'cliente', 'tipo', 'created_at', 'azioni')
+        sequence = ('foto', 'nome', 'cliente', 'tipo', 'created_at', 'azioni')
 
 class OrdineTable(tables.Table):
     id = tables.LinkColumn('ordine_detail', args=[A('pk')], verbose_name="Ordine #")
@@ -46,6 +56,8 @@ class OrdineTable(tables.Table):
         </span>
         '''
     )
+    # Richiede il queryset con Ordine.objects.con_totale_paia()
+    totale_paia = tables.Column(verbose_name='Totale Paia')
     azioni = tables.TemplateColumn(
         template_name='gestionale/ordini/ordine_actions.html',
         orderable=False, verbose_name='Azioni'
@@ -54,8 +66,8 @@ class OrdineTable(tables.Table):
     class Meta:
         model = Ordine
         template_name = "django_tables2/bootstrap5.html"
-        fields = ('id', 'modello', 'modello.cliente', 'data_ordine', 'stato', 'quantita_totale', 'azioni')
-        sequence = ('id', 'modello', 'modello.cliente', 'data_ordine', 'stato', 'quantita_totale', 'azioni')
+        fields = ('id', 'modello', 'modello.cliente', 'data_ordine', 'stato', 'totale_paia', 'azioni')
+        sequence = ('id', 'modello', 'modello.cliente', 'data_ordine', 'stato', 'totale_paia', 'azioni')
         # Rinomina l'intestazione della colonna per chiarezza
         verbose_names = {
             'modello.cliente': 'Cliente'
@@ -1,5 +1,7 @@
 from django import template
 
+from gestionale.immagini import url_foto
+
 register = template.Library()
 
 @register.filter(name='get_item')
@@ -9,4 +11,13 @@ def get_item(dictionary, key):
     usando una chiave variabile nel template.
     Uso: {{ mio_dizionario|get_item:mia_chiave }}
     """
-    return dictionary.get(key)
\ No newline at end of file
+    return dictionary.get(key)
+
+@register.filter(name='foto_ridotta')
+def foto_ridotta(foto, formato='dettaglio'):
+    """
+    URL della versione ridotta di una foto ('pdf', 'dettaglio' o 'miniatura'),
+    o dell'originale se la versione ridotta non esiste.
+    Uso: <img src="{{ modello.foto|foto_ridotta:'miniatura' }}">
+    """
+    return url_foto(foto, formato) if foto else ''
@@ -1,3 +1,1405 @@
-from django.test import TestCase
+import datetime
+import difflib
+import os
+import random
+import re
+import tempfile
+import zipfile
+from collections import Counter
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import openpyxl
+from PIL import Image
+from reportlab.platypus import Paragraph
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import layout_pdf
+from . import materiali as materiali_module
+
+from .benchmark import (OGGETTI_URL, catalogo_viste, genera_dati_sintetici, indirizzo_url, misura_url,
+                        url_da_misurare)
+from .bolle import BILANCIATA, SEQUENZIALE, distribuisci_bolle, numero_minimo_bolle
+from .documenti import (CachePDF, cache_pdf, genera_bolle_lavoro, genera_bolle_ordini, pdf_temporaneo,
+                        prepara_ordini_bolle)
+from .esportazione import documenti_da_esportare, zip_documenti
+from .forms import ArticoloFormSet, MatriceMisureForm
+from .immagini import DERIVATI, nome_derivato
+from .importazione import ErroreFile, importa_ordini
+from .lavori import accoda, parametri_bolle, prendi_lavori
+from .materiali import (CacheBOM, MatriceBOM, aggiorna_riepilogo_materiali, aggrega_materiali_sql,
+                        calcola_materiali_ordini, distinta_base_ordine, distinte_base_ordini, materiali_ordine_sql,
+                        riepilogo_materiali, totale_riepilogo_materiali)
+from .models import (Articolo, Cliente, Colore, Componente, ConsumoOrdine, DettaglioOrdine, LavoroDocumento,
+                     MaterialeOrdine, Modello, Ordine, StrutturaModello, Taglia, TipoComponente,
+                     SQ_METER_TO_SQ_FOOT)
+from .paginazione import chiavi_ordinamento
+from . import ricerca
+from .ricerca import cerca
+
+
+class DatiOrdiniMixin:
+    """Crea un piccolo catalogo con due modelli e alcuni ordini per i test sui materiali."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(nome="Cliente Test")
+        cls.nero = Colore.objects.create(nome="Nero", valore_hex="#000000")
+        cls.taglie = [Taglia.objects.create(numero=Decimal(n)) for n in ('37', '38', '38.5', '39', '40')]
+        cls.tomaia = TipoComponente.objects.create(nome="Tomaia")
+        cls.suola = TipoComponente.objects.create(nome="Suola")
+        cls.lacci = TipoComponente.objects.create(nome="Lacci")
+
+        cls.modelli = []
+        for indice_modello in range(2):
+            modello = Modello.objects.create(cliente=cls.cliente, nome=f"Modello {indice_modello}")
+            componenti = [
+                Componente.objects.create(modello=modello, nome_componente=cls.tomaia, colore=cls.nero,
+                                          descrizione="Pelle liscia", cod_componente="PL01", cod_colore="N1"),
+                Componente.objects.create(modello=modello, nome_componente=cls.suola, unita_misura='PAIA'),
+                Componente.objects.create(modello=modello, nome_componente=cls.lacci, unita_misura='METRI'),
+            ]
+            for i, taglia in enumerate(cls.taglie):
+                # L'ultima taglia resta senza misure per verificare gli articoli mancanti
+                if i == len(cls.taglie) - 1:
+                    continue
+                Articolo.objects.create(componente=componenti[0], taglia=taglia,
+                                        superficie_mq=Decimal('0.1250') + Decimal('0.0013') * i + indice_modello)
+                Articolo.objects.create(componente=componenti[1], taglia=taglia, quantita_unitaria=Decimal('1.00'))
+                Articolo.objects.create(componente=componenti[2], taglia=taglia,
+                                        quantita_unitaria=Decimal('1.10') + Decimal('0.05') * i)
+            cls.modelli.append(modello)
+
+        cls.ordini = []
+        for indice_ordine in range(6):
+            ordine = Ordine.objects.create(modello=cls.modelli[indice_ordine % 2],
+                                           stato='CONFERMATO' if indice_ordine % 3 else 'BOZZA')
+            for i, taglia in enumerate(cls.taglie):
+                DettaglioOrdine.objects.create(ordine=ordine, taglia=taglia, quantita=indice_ordine + i + 1)
+            cls.ordini.append(ordine)
+
+
+class CalcoloMaterialiOrdiniTest(DatiOrdiniMixin, TestCase):
+
+    def test_stesso_risultato_di_get_materiali_necessari(self):
+        per_ordine, _ = calcola_materiali_ordini(Ordine.objects.all())
+        for ordine in self.ordini:
+            self.assertEqual(per_ordine[ordine.pk], ordine.get_materiali_necessari())
+
+    def test_totali_sommano_gli_ordini(self):
+        _, totali = calcola_materiali_ordini(Ordine.objects.all())
+        atteso = {}
+        for ordine in self.ordini:
+            for key, misure in ordine.get_materiali_necessari().items():
+                voce = atteso.setdefault(key, {'tot_quantita_unitaria': 0, 'tot_superficie_mq': 0, 'tot_superficie_piedi_quadri': 0})
+                for campo in voce:
+                    voce[campo] += misure[campo]
+        self.assertEqual(set(totali), set(atteso))
+        for key, misure in atteso.items():
+            for campo, valore in misure.items():
+                self.assertEqual(totali[key][campo], valore)
+
+    def test_numero_di_query_costante(self):
+        with self.assertNumQueries(3):
+            calcola_materiali_ordini(Ordine.objects.all())
+        with self.assertNumQueries(3):
+            calcola_materiali_ordini(Ordine.objects.filter(stato='CONFERMATO'))
+
+
+class AggregazioneMaterialiSqlTest(DatiOrdiniMixin, TestCase):
+
+    def test_parita_con_calcolo_python_per_ordine(self):
+        for ordine in self.ordini:
+            self.assertEqual(materiali_ordine_sql(ordine), ordine.get_materiali_necessari())
+
+    def test_parita_per_ordine_e_totali(self):
+        per_ordine, totali = calcola_materiali_ordini(Ordine.objects.all())
+        self.assertEqual(aggrega_materiali_sql(Ordine.objects.all(), per_ordine=True), per_ordine)
+        self.assertEqual(aggrega_materiali_sql(Ordine.objects.all()), totali)
+
+    def test_misure_mancanti_e_quantita_zero(self):
+        ordine = self.ordini[0]
+        Articolo.objects.filter(componente__modello=ordine.modello, taglia=self.taglie[0]).update(superficie_mq=None)
+        self.assertEqual(materiali_ordine_sql(ordine), ordine.get_materiali_necessari())
+
+    def test_due_query(self):
+        with self.assertNumQueries(2):
+            aggrega_materiali_sql(Ordine.objects.all())
+
+
+class MatriceBOMTest(DatiOrdiniMixin, TestCase):
+
+    def bolle_di_prova(self):
+        return [
+            {self.taglie[0]: 3, self.taglie[1]: 2},
+            {self.taglie[2]: 7, self.taglie[4]: 1},
+            {self.taglie[4]: 5},
+            {taglia: i + 1 for i, taglia in enumerate(self.taglie)},
+        ]
+
+    def verifica_parita(self):
+        ordine = self.ordini[1]
+        bom = MatriceBOM.per_modello(ordine.modello)
+        bolle = self.bolle_di_prova()
+        for bolla, materiali in zip(bolle, bom.fabbisogno_bolle(bolle)):
+            self.assertEqual(materiali, ordine.get_materiali_necessari(bolla=bolla))
+        self.assertEqual(bom.fabbisogno(ordine.dettagli.values_list('taglia', 'quantita')),
+                         ordine.get_materiali_necessari())
+
+    def test_parita_con_numpy_o_python(self):
+        self.verifica_parita()
+
+    def test_parita_senza_numpy(self):
+        with mock.patch.object(materiali_module, 'np', None):
+            self.verifica_parita()
+
+    def test_stesso_ordine_di_get_materiali_necessari(self):
+        # I lacci (primi per nome) mancano nella taglia più piccola: get_materiali_necessari li mette in fondo
+        ordine = self.ordini[1]
+        Articolo.objects.filter(componente__modello=ordine.modello, componente__nome_componente=self.lacci,
+                                taglia=self.taglie[0]).delete()
+        bom = MatriceBOM.per_modello(ordine.modello)
+        bolle = self.bolle_di_prova()
+        for bolla, materiali in zip(bolle, bom.fabbisogno_bolle(bolle)):
+            self.assertEqual(list(materiali), list(ordine.get_materiali_necessari(bolla=bolla)))
+        self.assertEqual(list(bom.fabbisogno(ordine.dettagli.values_list('taglia', 'quantita'))),
+                         list(ordine.get_materiali_necessari()))
+
+    def test_bolla_vuota_e_taglia_senza_misure(self):
+        bom = MatriceBOM.per_modello(self.modelli[0])
+        self.assertEqual(bom.fabbisogno({}), {})
+        self.assertEqual(bom.fabbisogno({self.taglie[4]: 10}), {})
+
+    def test_due_query_per_tutte_le_bolle(self):
+        with self.assertNumQueries(2):
+            MatriceBOM.per_modello(self.modelli[0]).fabbisogno_bolle(self.bolle_di_prova())
+
+
+class CacheBOMTest(DatiOrdiniMixin, TestCase):
+
+    def versione(self, modello):
+        modello.refresh_from_db(fields=['bom_versione'])
+        return modello.bom_versione
+
+    def test_hit_miss_e_invalidazione(self):
+        cache = CacheBOM()
+        modello = self.modelli[0]
+        prima = cache.get(modello)
+        self.assertIs(cache.get(modello), prima)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        articolo = Articolo.objects.filter(componente__modello=modello).first()
+        articolo.quantita_unitaria = Decimal('9.99')
+        articolo.save()
+        self.assertIsNot(cache.get(modello), prima)
+        self.assertEqual(cache.statistiche()['voci'], 1)
+
+    def test_eviction_lru(self):
+        cache = CacheBOM(dimensione_massima=1)
+        cache.get(self.modelli[0])
+        cache.get(self.modelli[1])
+        cache.get(self.modelli[0])
+        self.assertEqual((cache.hits, cache.misses), (0, 3))
+
+    def test_versione_incrementata_da_formset_e_cancellazioni(self):
+        modello = self.modelli[0]
+        componente = modello.componenti.get(nome_componente=self.suola)
+        versione = self.versione(modello)
+
+        formset = ArticoloFormSet({
+            'articoli-TOTAL_FORMS': '1', 'articoli-INITIAL_FORMS': '0',
+            'articoli-0-taglia': self.taglie[4].pk, 'articoli-0-quantita_unitaria': '2.00',
+        }, instance=componente, prefix='articoli')
+        self.assertTrue(formset.is_valid(), formset.errors)
+        formset.save()
+        self.assertGreater(self.versione(modello), versione)
+
+        versione = self.versione(modello)
+        componente.delete()
+        self.assertGreater(self.versione(modello), versione)
+
+    def test_duplicate_ha_una_propria_versione(self):
+        copia = self.modelli[0].duplicate("Copia")
+        self.assertGreater(self.versione(copia), 0)
+
+
+class DuplicazioneModelloTest(DatiOrdiniMixin, TestCase):
+
+    @staticmethod
+    def distinta(modello):
+        campi = ('nome_componente', 'unita_misura', 'colore', 'note', 'descrizione', 'cod_componente', 'cod_colore')
+        componenti = sorted(modello.componenti.values_list(*campi))
+        articoli = sorted(Articolo.objects.filter(componente__modello=modello).values_list(
+            'componente__nome_componente', 'taglia', 'superficie_mq', 'superficie_piedi_quadri', 'quantita_unitaria'))
+        return componenti, articoli
+
+    def test_copia_tutti_i_campi(self):
+        originale = self.modelli[0]
+        originale.codice_articolo, originale.forma = "ART9", "F3"
+        originale.save()
+        copia = originale.duplicate("Copia")
+        self.assertEqual((copia.codice_articolo, copia.forma), ("ART9", "F3"))
+        self.assertEqual(self.distinta(copia), self.distinta(originale))
+        self.assertEqual(copia.componenti.get(cod_componente="PL01").descrizione, "Pelle liscia")
+        self.assertIn(ricerca.COMPONENTE, [r.tipo for r in cerca("pl01") if r.oggetto.modello_id == copia.pk])
+
+    def test_query_costanti(self):
+        originale = self.modelli[0]
+        with CaptureQueriesContext(connection) as piccolo:
+            originale.duplicate("Copia 1")
+        for tipo in TipoComponente.objects.all():
+            componente = Componente.objects.create(modello=originale, nome_componente=tipo)
+            for taglia in self.taglie:
+                Articolo.objects.create(componente=componente, taglia=taglia, quantita_unitaria=Decimal('1'))
+        with CaptureQueriesContext(connection) as grande:
+            originale.duplicate("Copia 2")
+        self.assertEqual(len(grande), len(piccolo), differenza_query(piccolo, grande))
+
+
+class MatriceMisureTest(DatiOrdiniMixin, TestCase):
+
+    def setUp(self):
+        self.modello = self.modelli[0]
+        self.form = MatriceMisureForm(modello=self.modello)
+        self.dati = {nome: '' if campo.initial is None else campo.initial for nome, campo in self.form.fields.items()}
+        self.tomaia_modello = self.modello.componenti.get(nome_componente=self.tomaia)
+        self.lacci_modello = self.modello.componenti.get(nome_componente=self.lacci)
+
+    def cella(self, componente, taglia):
+        return f"misura_{componente.pk}_{taglia.pk}"
+
+    def test_salva_solo_le_celle_cambiate(self):
+        self.dati[self.cella(self.tomaia_modello, self.taglie[0])] = '0.2000'
+        self.dati[self.cella(self.lacci_modello, self.taglie[4])] = '1.50'  # taglia senza misure
+        versione = self.modello.bom_versione
+        form = MatriceMisureForm(self.dati, modello=self.modello)
+        self.assertTrue(form.is_valid(), form.errors)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(form.save(), (1, 1))
+
+        articolo = Articolo.objects.get(componente=self.tomaia_modello, taglia=self.taglie[0])
+        self.assertEqual(articolo.superficie_mq, Decimal('0.2000'))
+        self.assertEqual(articolo.superficie_piedi_quadri,
+                         (Decimal('0.2000') * SQ_METER_TO_SQ_FOOT).quantize(Decimal('0.0001')))
+        self.assertEqual(Articolo.objects.get(componente=self.lacci_modello, taglia=self.taglie[4]).quantita_unitaria,
+                         Decimal('1.50'))
+        self.modello.refresh_from_db()
+        self.assertGreater(self.modello.bom_versione, versione)
+        for ordine in Ordine.objects.filter(modello=self.modello, distinta_congelata_il=None):
+            self.assertEqual(riepilogo_materiali(ordine), ordine.get_materiali_necessari())
+
+    def test_query_costanti_e_nessuna_scrittura_senza_modifiche(self):
+        def salva(componente, taglie, valore):
+            dati = dict(self.dati)
+            for taglia in taglie:
+                dati[self.cella(componente, taglia)] = valore
+            form = MatriceMisureForm(dati, modello=self.modello)
+            self.assertTrue(form.is_valid(), form.errors)
+            with CaptureQueriesContext(connection) as queries:
+                form.save()
+            return queries
+        self.assertEqual(len(salva(self.lacci_modello, [], '')), 0)
+        # L'ultima taglia non ha misure: in entrambi i casi un inserimento e un aggiornamento
+        poche = salva(self.lacci_modello, [self.taglie[0], self.taglie[4]], '3.00')
+        tutte = salva(self.tomaia_modello, self.taglie, '0.3000')
+        self.assertEqual(len(tutte), len(poche), differenza_query(poche, tutte))
+
+    def test_valori_non_validi(self):
+        self.client.force_login(User.objects.create_user('modellista'))
+        self.dati[self.cella(self.tomaia_modello, self.taglie[1])] = '-1'
+        response = self.client.post(reverse('modello_misure', args=[self.modello.pk]), self.dati)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'table-danger')
+        self.assertFalse(Articolo.objects.filter(superficie_mq__lt=0).exists())
+
+
+class ComponentiDaStrutturaTest(DatiOrdiniMixin, TestCase):
+
+    def setUp(self):
+        self.struttura = StrutturaModello.objects.create(nome="Stringata")
+        self.struttura.tipi_componente.set([self.tomaia, self.suola, self.lacci])
+        self.client.force_login(User.objects.create_user('catalogo'))
+
+    def test_creazione_con_griglia_misure(self):
+        response = self.client.post(reverse('modello_create'), {
+            'cliente': self.cliente.pk, 'nome': "Derby", 'tipo': 'ELEGANTE', 'struttura': self.struttura.pk,
+            'taglia_da': self.taglie[1].pk, 'taglia_a': self.taglie[3].pk,
+        })
+        modello = Modello.objects.get(nome="Derby")
+        self.assertRedirects(response, modello.get_absolute_url())
+        self.assertEqual(modello.componenti.count(), 3)
+        articoli = Articolo.objects.filter(componente__modello=modello)
+        self.assertEqual(articoli.count(), 9)
+        self.assertFalse(articoli.exclude(superficie_mq=None).exists())
+
+    def test_query_costanti(self):
+        def crea(nomi, taglie):
+            modelli = Modello.objects.bulk_create([Modello(cliente=self.cliente, nome=nome) for nome in nomi])
+            with CaptureQueriesContext(connection) as queries:
+                self.struttura.crea_componenti(modelli, taglie)
+            return queries
+        piccolo = crea(["A"], self.taglie[:1])
+        # 150 articoli: su SQLite bulk_create li divide in più INSERT solo oltre i 999 parametri
+        grande = crea([f"B{i}" for i in range(10)], self.taglie)
+        self.assertEqual(len(grande), len(piccolo), differenza_query(piccolo, grande))
+        self.assertEqual(Articolo.objects.filter(componente__modello__nome__startswith="B").count(), 150)
+
+    def test_modelli_in_blocco(self):
+        dati = {'cliente': self.cliente.pk, 'struttura': self.struttura.pk, 'tipo': 'SANDALO',
+                'righe': "Estate 1; ES01; F2\n\nEstate 2\n", 'taglia_da': self.taglie[0].pk,
+                'taglia_a': self.taglie[-1].pk}
+        response = self.client.post(reverse('modelli_in_blocco'), dati)
+        self.assertEqual(response.status_code, 302)
+        estate = Modello.objects.get(nome="Estate 1")
+        self.assertEqual((estate.codice_articolo, estate.forma, estate.tipo), ("ES01", "F2", 'SANDALO'))
+        self.assertEqual(Articolo.objects.filter(componente__modello__nome__startswith="Estate").count(), 30)
+        self.assertEqual([r.oggetto for r in cerca("es01")], [estate])
+
+        # Nomi già presenti o ripetuti: nessun modello creato
+        for righe in ("Estate 2\nAutunno", "Autunno\nAutunno", "Inverno;A;B;C"):
+            response = self.client.post(reverse('modelli_in_blocco'), {**dati, 'righe': righe})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.context['form'].errors['righe'])
+        self.assertFalse(Modello.objects.filter(nome__in=["Autunno", "Inverno"]).exists())
+
+
+class RiepilogoMaterialiTest(DatiOrdiniMixin, TestCase):
+
+    def test_aggiornato_dai_dettagli(self):
+        ordine = self.ordini[0]
+        self.assertEqual(riepilogo_materiali(ordine), ordine.get_materiali_necessari())
+
+        dettaglio = ordine.dettagli.first()
+        dettaglio.quantita += 10
+        dettaglio.save()
+        self.assertEqual(riepilogo_materiali(ordine), ordine.get_materiali_necessari())
+
+        dettaglio.delete()
+        DettaglioOrdine.objects.create(ordine=ordine, taglia=dettaglio.taglia, quantita=1)
+        self.assertEqual(riepilogo_materiali(ordine), ordine.get_materiali_necessari())
+
+    def test_aggiornato_dalle_misure_del_modello(self):
+        ordine = self.ordini[3]  # in bozza: segue la distinta base attuale
+        articolo = Articolo.objects.filter(componente__modello=ordine.modello, superficie_mq__isnull=False).first()
+        articolo.superficie_mq = Decimal('0.5000')
+        articolo.superficie_piedi_quadri = None
+        with self.captureOnCommitCallbacks(execute=True):
+            articolo.save()
+        self.assertEqual(riepilogo_materiali(ordine), ordine.get_materiali_necessari())
+
+    def test_una_ricostruzione_per_transazione(self):
+        ordine = self.ordini[3]
+        articoli = list(Articolo.objects.filter(componente__modello=ordine.modello, quantita_unitaria__isnull=False))
+        with mock.patch('gestionale.materiali.aggiorna_riepilogo_materiali',
+                        wraps=aggiorna_riepilogo_materiali) as aggiorna:
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    for articolo in articoli:
+                        articolo.quantita_unitaria += 1
+                        articolo.save()
+                self.assertEqual(aggiorna.call_count, 0)
+        self.assertGreater(len(articoli), 1)
+        self.assertEqual(aggiorna.call_count, 1)
+        self.assertEqual(riepilogo_materiali(ordine), ordine.get_materiali_necessari())
+
+    def test_lettura_con_una_query(self):
+        with self.assertNumQueries(2):  # riepilogo + colori
+            riepilogo_materiali(self.ordini[0])
+
+    def test_totale_uguale_al_ricalcolo(self):
+        attivi = Ordine.objects.exclude(stato__in=['COMPLETATO', 'ANNULLATO'])
+        self.assertEqual(totale_riepilogo_materiali(attivi), aggrega_materiali_sql(attivi))
+
+    def test_comando_ricalcolo_e_verifica(self):
+        MaterialeOrdine.objects.filter(ordine=self.ordini[2]).delete()
+        with self.assertRaises(CommandError):
+            call_command('ricalcola_materiali', '--verifica', stdout=StringIO())
+        call_command('ricalcola_materiali', stdout=StringIO())
+        call_command('ricalcola_materiali', '--verifica', stdout=StringIO())
+
+
+class DistintaCongelataTest(DatiOrdiniMixin, TestCase):
+
+    def conferma(self, ordine):
+        self.client.force_login(User.objects.create_user('operatore'))
+        self.client.post(reverse('ordine_conferma', args=[ordine.pk]))
+        ordine.refresh_from_db()
+
+    def test_conferma_congela_i_consumi(self):
+        ordine = self.ordini[0]
+        materiali_prima = ordine.get_materiali_necessari()
+        self.conferma(ordine)
+        self.assertEqual(ordine.stato, 'CONFERMATO')
+        self.assertIsNotNone(ordine.distinta_congelata_il)
+        # 3 componenti x 4 taglie con misure
+        self.assertEqual(ConsumoOrdine.objects.filter(ordine=ordine).count(), 12)
+
+        Articolo.objects.filter(componente__modello=ordine.modello).update(quantita_unitaria=Decimal('5.00'))
+        Articolo.objects.filter(componente__modello=ordine.modello).first().save()
+        self.assertEqual(riepilogo_materiali(ordine), materiali_prima)
+        self.assertNotEqual(ordine.get_materiali_necessari(), materiali_prima)
+
+    def test_dettagli_modificati_dopo_la_conferma(self):
+        ordine = self.ordini[0]
+        self.conferma(ordine)
+        dettaglio = ordine.dettagli.get(taglia=self.taglie[0])
+        dettaglio.quantita = 50
+        dettaglio.save()
+        ordine.dettagli.filter(taglia=self.taglie[1]).delete()
+        self.assertEqual(riepilogo_materiali(ordine), ordine.get_materiali_necessari())
+
+    def test_bolle_dalla_distinta_congelata(self):
+        ordine = self.ordini[0]
+        self.conferma(ordine)
+        bolla = {self.taglie[0]: 2, self.taglie[2]: 3}
+        atteso = ordine.get_materiali_necessari(bolla=bolla)
+        Componente.objects.filter(modello=ordine.modello).update(descrizione="Cambiata")
+        with self.assertNumQueries(1):
+            bom = distinta_base_ordine(ordine)
+        self.assertEqual(bom.fabbisogno(bolla), atteso)
+
+    def test_ritorno_in_bozza(self):
+        ordine = self.ordini[0]
+        self.conferma(ordine)
+        ordine.stato = 'BOZZA'
+        ordine.save()
+        self.assertIsNone(ordine.distinta_congelata_il)
+        self.assertFalse(ConsumoOrdine.objects.filter(ordine=ordine).exists())
+
+
+class DettagliOrdineInBloccoTest(DatiOrdiniMixin, TestCase):
+
+    def dettagli(self, ordine):
+        return dict(ordine.dettagli.values_list('taglia_id', 'quantita'))
+
+    def test_upsert_ed_eliminazione(self):
+        for ordine in (self.ordini[0], self.ordini[1]):  # in bozza e con la distinta congelata
+            t = [taglia.pk for taglia in self.taglie]
+            ordine.salva_dettagli({t[0]: 50, t[1]: 0})
+            self.assertEqual(self.dettagli(ordine), {t[0]: 50})
+            self.assertEqual(riepilogo_materiali(ordine), ordine.get_materiali_necessari())
+
+            ordine.salva_dettagli({t[0]: 50, t[3]: 7})
+            self.assertEqual(self.dettagli(ordine), {t[0]: 50, t[3]: 7})
+            self.assertEqual(riepilogo_materiali(ordine), ordine.get_materiali_necessari())
+
+    def test_query_costanti(self):
+        with CaptureQueriesContext(connection) as una_taglia:
+            self.ordini[0].salva_dettagli({self.taglie[0].pk: 3})
+        # Entrambi tolgono almeno una taglia: la DELETE parte solo se ci sono righe da eliminare
+        with CaptureQueriesContext(connection) as tutte:
+            self.ordini[3].salva_dettagli({taglia.pk: 3 for taglia in self.taglie[:-1]})
+        self.assertEqual(len(tutte), len(una_taglia), differenza_query(una_taglia, tutte))
+
+    def test_vista_modifica(self):
+        ordine = self.ordini[0]
+        self.client.force_login(User.objects.create_user('ufficio'))
+        esistenti = list(ordine.dettagli.all())
+        dati = {'modello': ordine.modello_id, 'data_ordine': '2024-05-01T10:00', 'stato': 'BOZZA',
+                'dettagli-TOTAL_FORMS': len(esistenti), 'dettagli-INITIAL_FORMS': len(esistenti)}
+        for i, dettaglio in enumerate(esistenti):
+            dati.update({f'dettagli-{i}-id': dettaglio.pk, f'dettagli-{i}-taglia': dettaglio.taglia_id,
+                         f'dettagli-{i}-quantita': 10 + i})
+            # Due taglie tolte dal form
+            if i in (1, 3):
+                dati[f'dettagli-{i}-DELETE'] = 'on'
+        response = self.client.post(reverse('ordine_update', args=[ordine.pk]), dati)
+        self.assertRedirects(response, ordine.get_absolute_url())
+        self.assertEqual(self.dettagli(ordine),
+                         {d.taglia_id: 10 + i for i, d in enumerate(esistenti) if i not in (1, 3)})
+        self.assertEqual(riepilogo_materiali(ordine), ordine.get_materiali_necessari())
+
+
+class ImportazioneOrdiniTest(DatiOrdiniMixin, TestCase):
+
+    INTESTAZIONE = "Cliente;Modello;Data consegna;Stato;Note;37;38;38,5;39\n"
+
+    def file(self, righe, intestazione=INTESTAZIONE, nome='ordini.csv'):
+        return SimpleUploadedFile(nome, (intestazione + "".join(righe)).encode('utf-8-sig'))
+
+    def importa(self, righe, **kwargs):
+        file = self.file(righe, **kwargs)
+        return importa_ordini(file, file.name)
+
+    def test_crea_ordini_e_dettagli(self):
+        esito = self.importa([
+            "cliente test;MODELLO 0;15/06/2025;;Primavera;10;;5;2\n",
+            ";;;;;;;;\n",
+            "Cliente Test;Modello 1;;Confermato;;1;1;1;1\n",
+        ])
+        self.assertEqual((esito.ordini, esito.dettagli, esito.errori), (2, 7, []))
+        bozza, confermato = Ordine.objects.filter(note="Primavera").get(), Ordine.objects.latest('pk')
+        self.assertEqual(bozza.modello, self.modelli[0])
+        self.assertEqual(bozza.data_consegna, datetime.date(2025, 6, 15))
+        self.assertEqual(dict(bozza.dettagli.values_list('taglia__numero', 'quantita')),
+                         {Decimal('37'): 10, Decimal('38.5'): 5, Decimal('39'): 2})
+        self.assertEqual(confermato.stato, 'CONFERMATO')
+        self.assertIsNotNone(confermato.distinta_congelata_il)
+        self.assertTrue(ConsumoOrdine.objects.filter(ordine=confermato).exists())
+        for ordine in (bozza, confermato):
+            self.assertEqual(riepilogo_materiali(ordine), ordine.get_materiali_necessari())
+
+    def test_errori_per_riga_senza_scrivere(self):
+        esito = self.importa([
+            "Cliente Test;Modello 0;;;;1;;;\n",
+            "Cliente X;Modello 0;;;;1;;;\n",
+            "Cliente Test;Modello 9;31/02/2025;;;1;;;\n",
+            "Cliente Test;Modello 1;;;;-1;2.5;abc;\n",
+            "Cliente Test;Modello 1;;;;;;;\n",
+            "Cliente Test;Modello 1;;Spedito;;;;;1\n",
+        ])
+        self.assertEqual(esito.ordini, 0)
+        self.assertEqual([riga for riga, _ in esito.errori], [3, 4, 5, 6, 7])
+        self.assertIn("Cliente X", esito.errori[0][1])
+        self.assertIn("Modello 9", esito.errori[1][1])
+        self.assertIn("31/02/2025", esito.errori[1][1])
+        self.assertEqual(esito.errori[2][1].count("quantità"), 3)
+        self.assertIn("nessuna quantità", esito.errori[3][1])
+        self.assertIn("Spedito", esito.errori[4][1])
+        self.assertEqual(Ordine.objects.count(), len(self.ordini))
+
+    def test_intestazione_non_valida(self):
+        for intestazione in ("Cliente;Colore;37\n", "Cliente;Modello;37;37,0\n", "Cliente;Modello;52\n"):
+            with self.assertRaises(ErroreFile):
+                self.importa([], intestazione=intestazione)
+        with self.assertRaises(ErroreFile):
+            self.importa([], nome='ordini.ods')
+
+    def xlsx(self, righe):
+        cartella = openpyxl.Workbook()
+        for riga in righe:
+            cartella.active.append(riga)
+        contenuto = BytesIO()
+        cartella.save(contenuto)
+        return SimpleUploadedFile('ordini.xlsx', contenuto.getvalue())
+
+    def test_xlsx(self):
+        # Excel restituisce le date come datetime, e intestazioni e quantità come numeri
+        file = self.xlsx([
+            ["Cliente", "Modello", "Data consegna", "Stato", 37, 38, 38.5, "39"],
+            ["Cliente Test", "Modello 0", datetime.datetime(2025, 6, 15), None, 10, None, 5, 2.0],
+            [None] * 8,
+            ["Cliente Test", "Modello 1", None, "Confermato", 1, 1, 1, 1],
+        ])
+        esito = importa_ordini(file, file.name)
+        self.assertEqual((esito.ordini, esito.dettagli, esito.errori), (2, 7, []))
+        bozza, confermato = Ordine.objects.order_by('-pk')[1], Ordine.objects.latest('pk')
+        self.assertEqual(bozza.data_consegna, datetime.date(2025, 6, 15))
+        self.assertEqual(dict(bozza.dettagli.values_list('taglia__numero', 'quantita')),
+                         {Decimal('37'): 10, Decimal('38.5'): 5, Decimal('39'): 2})
+        self.assertEqual(confermato.stato, 'CONFERMATO')
+        for ordine in (bozza, confermato):
+            self.assertEqual(riepilogo_materiali(ordine), ordine.get_materiali_necessari())
+
+    def test_query_costanti(self):
+        # Entro un blocco e sotto il limite di parametri di SQLite per le INSERT in blocco
+        riga = "Cliente Test;Modello 0;;;;3;4;5;6\n"
+        with CaptureQueriesContext(connection) as poche:
+            self.importa([riga] * 2)
+        with CaptureQueriesContext(connection) as tante:
+            self.importa([riga] * 20)
+        self.assertEqual(len(tante), len(poche), differenza_query(poche, tante))
+
+    def test_vista(self):
+        self.client.force_login(User.objects.create_user('ufficio'))
+        response = self.client.post(reverse('ordini_importa'),
+                                    {'file': self.file(["Cliente Test;Modello 0;;;;;;;x\n"])})
+        self.assertContains(response, "nessun ordine importato")
+        self.assertContains(response, "quantità &#x27;x&#x27; non valida")
+
+        response = self.client.post(reverse('ordini_importa'),
+                                    {'file': self.file(["Cliente Test;Modello 0;;;;;;;8\n"])})
+        self.assertRedirects(response, reverse('ordine_list'))
+
+        response = self.client.post(reverse('ordini_importa'), {'file': self.xlsx([
+            ["Cliente", "Modello", 38.5], ["Cliente Test", "Modello 1", 4]])})
+        self.assertRedirects(response, reverse('ordine_list'))
+
+        with mock.patch('gestionale.forms.openpyxl', None):
+            response = self.client.post(reverse('ordini_importa'), {'file': self.file([], nome='ordini.xlsx')})
+        self.assertTrue(response.context['form'].errors['file'])
+
+
+class BolleMultipleTest(DatiOrdiniMixin, TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('pianificatore'))
+
+    def test_distinte_base_ordini(self):
+        ordini = list(Ordine.objects.filter(pk__in=[o.pk for o in self.ordini]))
+        distinte = distinte_base_ordini(ordini)
+        for ordine in ordini:
+            bolla = {self.taglie[0]: 3, self.taglie[3]: 1}
+            self.assertEqual(distinte[ordine.pk].fabbisogno(bolla), ordine.get_materiali_necessari(bolla=bolla))
+
+    def test_pdf_unico_per_tutti_i_confermati(self):
+        dati = {'stato': 'CONFERMATO', 'max_totale': 10, 'max_per_taglia': 4}
+        response = self.client.post(reverse('ordini_genera_bolle'), dati)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        contenuto = b''.join(response.streaming_content)
+        response.close()
+        self.assertTrue(contenuto.startswith(b'%PDF'))
+        self.assertEqual(int(response['Content-Length']), len(contenuto))
+
+    @override_settings(PDF_IN_MEMORIA_KB=1)
+    def test_pdf_grande_passa_su_disco(self):
+        pdf = pdf_temporaneo()
+        self.addCleanup(pdf.close)
+        with mock.patch('gestionale.views.pdf_temporaneo', return_value=pdf):
+            response = self.client.post(reverse('ordini_genera_bolle'), {'stato': 'CONFERMATO', 'max_totale': 10})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(pdf._rolled)
+            self.assertEqual(int(response['Content-Length']), len(b''.join(response.streaming_content)))
+
+    def test_query_indipendenti_dal_numero_di_ordini(self):
+        dati = {'stato': 'CONFERMATO', 'max_totale': 10}
+        self.client.post(reverse('ordini_genera_bolle'), dati)  # riempie la cache delle distinte
+        with CaptureQueriesContext(connection) as prima:
+            self.client.post(reverse('ordini_genera_bolle'), dati)
+        for i in range(6, 12):
+            ordine = Ordine.objects.create(modello=self.modelli[i % 2], stato='CONFERMATO')
+            DettaglioOrdine.objects.create(ordine=ordine, taglia=self.taglie[i % 4], quantita=7)
+        with CaptureQueriesContext(connection) as dopo:
+            self.client.post(reverse('ordini_genera_bolle'), dati)
+        self.assertEqual(len(prima), len(dopo))
+
+    def test_una_pagina_per_bolla_e_cornice_condivisa(self):
+        ordini = list(prepara_ordini_bolle(Ordine.objects.filter(pk__in=[self.ordini[1].pk, self.ordini[2].pk])))
+        destinazione = BytesIO()
+        numero_bolle = genera_bolle_ordini(ordini, destinazione, max_totale=10)
+        pdf = destinazione.getvalue()
+        self.assertEqual(pdf.count(b'/Type /Page\n'), numero_bolle)
+        # La parte fissa della bolla è un solo form, richiamato da ogni pagina
+        self.assertEqual(pdf.count(b'/Subtype /Form'), 1)
+
+    def test_paragrafi_ripetuti_composti_una_volta(self):
+        ordine = Ordine.objects.select_related('modello', 'modello__cliente').get(pk=self.ordini[1].pk)
+        with mock.patch.object(Paragraph, 'wrap', autospec=True, side_effect=Paragraph.wrap) as wrap:
+            genera_bolle_lavoro(ordine, BytesIO(), max_totale=5)
+        # Nome e descrizione dei tre componenti, una volta per tutto il documento
+        self.assertEqual(wrap.call_count, 6)
+
+    def test_nessun_ordine(self):
+        dati = {'stato': 'COMPLETATO', 'max_totale': 10}
+        response = self.client.post(reverse('ordini_genera_bolle'), dati)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Nessun ordine corrisponde")
+
+
+def distribuzione_storica(quantita_per_taglia, max_totale, max_per_taglia=None):
+    """Algoritmo originale di crea_distribuzione_bolle, come riferimento."""
+    bolle = []
+    da_distribuire = dict(quantita_per_taglia)
+    while any(q > 0 for q in da_distribuire.values()):
+        nuova_bolla = {}
+        paia_in_bolla = 0
+        for taglia, quantita_rimanente in da_distribuire.items():
+            if quantita_rimanente == 0:
+                continue
+            limite_taglia = max_per_taglia if max_per_taglia else quantita_rimanente
+            da_aggiungere = min(quantita_rimanente, limite_taglia, max_totale - paia_in_bolla)
+            if da_aggiungere > 0:
+                nuova_bolla[taglia] = da_aggiungere
+                paia_in_bolla += da_aggiungere
+                da_distribuire[taglia] -= da_aggiungere
+        if nuova_bolla:
+            bolle.append(nuova_bolla)
+    return bolle
+
+
+class DistribuzioneBolleTest(SimpleTestCase):
+    """
+    Vincoli verificati su 300 ordini casuali, sempre gli stessi (seme fisso):
+    un errore non viene ridotto al caso minimo, ma subTest ne mostra i dati.
+    I casi limite sono coperti da test espliciti.
+    """
+
+    def casi_casuali(self, n=300):
+        generatore = random.Random(20240501)
+        for _ in range(n):
+            n_taglie = generatore.randint(1, 20)
+            coppie = [(t, generatore.choice([0, generatore.randint(1, 5), generatore.randint(1, 200)]))
+                      for t in range(n_taglie)]
+            max_totale = generatore.randint(1, 60)
+            max_per_taglia = generatore.choice([None, generatore.randint(1, 15)])
+            yield coppie, max_totale, max_per_taglia
+
+    def verifica_vincoli(self, bolle, coppie, max_totale, max_per_taglia):
+        totali = Counter()
+        for bolla in bolle:
+            self.assertTrue(bolla)
+            self.assertLessEqual(sum(bolla.values()), max_totale)
+            for taglia, quantita in bolla.items():
+                self.assertGreater(quantita, 0)
+                if max_per_taglia:
+                    self.assertLessEqual(quantita, max_per_taglia)
+                totali[taglia] += quantita
+        # Le quantità si conservano
+        self.assertEqual(totali, Counter({t: q for t, q in coppie if q}))
+
+    def test_sequenziale_uguale_all_algoritmo_storico(self):
+        for coppie, max_totale, max_per_taglia in self.casi_casuali():
+            with self.subTest(coppie=coppie, max_totale=max_totale, max_per_taglia=max_per_taglia):
+                bolle = distribuisci_bolle(coppie, max_totale, max_per_taglia, SEQUENZIALE)
+                self.verifica_vincoli(bolle, coppie, max_totale, max_per_taglia)
+                self.assertEqual(bolle, distribuzione_storica(coppie, max_totale, max_per_taglia))
+
+    def test_bilanciata_minima_e_uniforme(self):
+        for coppie, max_totale, max_per_taglia in self.casi_casuali():
+            with self.subTest(coppie=coppie, max_totale=max_totale, max_per_taglia=max_per_taglia):
+                bolle = distribuisci_bolle(coppie, max_totale, max_per_taglia, BILANCIATA)
+                self.verifica_vincoli(bolle, coppie, max_totale, max_per_taglia)
+                quantita = [q for _, q in coppie]
+                self.assertEqual(len(bolle), numero_minimo_bolle(quantita, max_totale, max_per_taglia))
+                self.assertLessEqual(len(bolle), len(distribuzione_storica(coppie, max_totale, max_per_taglia)))
+                if bolle:
+                    paia = [sum(b.values()) for b in bolle]
+                    self.assertLessEqual(max(paia) - min(paia), 1)
+                    for taglia, _ in coppie:
+                        per_bolla = [b.get(taglia, 0) for b in bolle]
+                        self.assertLessEqual(max(per_bolla) - min(per_bolla), 1)
+
+    def test_taglia_singola(self):
+        self.assertEqual(distribuisci_bolle([(37, 25)], 10, modalita=SEQUENZIALE), [{37: 10}, {37: 10}, {37: 5}])
+        self.assertEqual(distribuisci_bolle([(37, 25)], 10, modalita=BILANCIATA), [{37: 9}, {37: 8}, {37: 8}])
+        # Con il limite per taglia più basso di quello per bolla decide il primo
+        self.assertEqual(distribuisci_bolle([(37, 25)], 10, 4, SEQUENZIALE), [{37: 4}] * 6 + [{37: 1}])
+        self.assertEqual(distribuisci_bolle([(37, 25)], 10, 4, BILANCIATA), [{37: 4}] * 4 + [{37: 3}] * 3)
+        self.assertEqual(numero_minimo_bolle([25], 10, 4), 7)
+
+    def test_quantita_a_zero(self):
+        coppie = [(37, 0), (38, 7), (39, 0), (40, 3)]
+        self.assertEqual(distribuisci_bolle(coppie, 5, modalita=SEQUENZIALE), [{38: 5}, {38: 2, 40: 3}])
+        self.assertEqual(distribuisci_bolle(coppie, 5, modalita=BILANCIATA), [{38: 4, 40: 1}, {38: 3, 40: 2}])
+        self.assertEqual(numero_minimo_bolle([q for _, q in coppie], 5), 2)
+
+    def test_limite_per_taglia_oltre_il_limite_per_bolla(self):
+        # max_per_taglia > max_totale non limita nulla: come senza limite per taglia
+        coppie = [(37, 30), (38, 5)]
+        for modalita in (SEQUENZIALE, BILANCIATA):
+            with self.subTest(modalita=modalita):
+                bolle = distribuisci_bolle(coppie, 10, 50, modalita)
+                self.verifica_vincoli(bolle, coppie, 10, 50)
+                self.assertEqual(bolle, distribuisci_bolle(coppie, 10, None, modalita))
+                self.assertEqual(len(bolle), 4)
+        self.assertEqual(numero_minimo_bolle([30, 5], 10, 50), 4)
+
+    def test_ordine_vuoto_e_limiti_non_validi(self):
+        self.assertEqual(distribuisci_bolle([(37, 0)], 10), [])
+        self.assertEqual(distribuisci_bolle([], 10, modalita=BILANCIATA), [])
+        with self.assertRaises(ValueError):
+            distribuisci_bolle([(37, 5)], 0)
+        with self.assertRaises(ValueError):
+            distribuisci_bolle([(37, 5)], 10, modalita='ALTRO')
+
+    def test_ordine_grande_in_tempo_lineare(self):
+        coppie = [(t, 400) for t in range(30)]  # 12.000 paia
+        bolle = distribuisci_bolle(coppie, 10, 2, SEQUENZIALE)
+        self.verifica_vincoli(bolle, coppie, 10, 2)
+        self.assertEqual(len(distribuisci_bolle(coppie, 10, 2, BILANCIATA)), 1200)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(prefix='test_cache_pdf_'))
+class CachePDFTest(DatiOrdiniMixin, TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('ufficio'))
+        cache_pdf.svuota()
+        self.addCleanup(cache_pdf.svuota)
+        cache_pdf.hits = cache_pdf.misses = 0
+
+    def scarica(self, nome_url, pk, dati=None):
+        if dati is None:
+            response = self.client.get(reverse(nome_url, args=[pk]))
+        else:
+            response = self.client.post(reverse(nome_url, args=[pk]), dati)
+        self.assertEqual(response.status_code, 200)
+        contenuto = b''.join(response.streaming_content)
+        response.close()
+        self.assertTrue(contenuto.startswith(b'%PDF'))
+        self.assertEqual(int(response['Content-Length']), len(contenuto))
+        return contenuto
+
+    def test_seconda_richiesta_dalla_cache(self):
+        for nome_url, pk in [('scheda_modello_pdf', self.modelli[0].pk),
+                             ('scheda_materiali_pdf', self.ordini[1].pk),
+                             ('bolla_ordine_pdf', self.ordini[1].pk)]:
+            primo = self.scarica(nome_url, pk)
+            self.assertEqual(self.scarica(nome_url, pk), primo)
+        self.assertEqual((cache_pdf.misses, cache_pdf.hits), (3, 3))
+
+    def test_modifiche_invalidano_il_documento(self):
+        ordine = self.ordini[3]
+        self.scarica('bolla_ordine_pdf', ordine.pk)
+        modifiche = [
+            lambda: Articolo.objects.filter(componente__modello=ordine.modello).first().save(),
+            lambda: Componente.objects.filter(modello=ordine.modello).first().save(),
+            lambda: Modello.objects.get(pk=ordine.modello_id).save(),
+            lambda: DettaglioOrdine.objects.filter(ordine=ordine).update(quantita=99),
+            lambda: Colore.objects.get(pk=self.nero.pk).save(),
+            lambda: TipoComponente.objects.get(nome='Suola').save(),
+        ]
+        for i, modifica in enumerate(modifiche, 2):
+            modifica()
+            self.scarica('bolla_ordine_pdf', ordine.pk)
+            self.assertEqual(cache_pdf.misses, i)
+        self.assertEqual(cache_pdf.hits, 0)
+
+    def test_bolle_per_vincoli_di_suddivisione(self):
+        ordine = self.ordini[1]
+        self.scarica('ordine_genera_bolle', ordine.pk, {'max_totale': 10})
+        self.scarica('ordine_genera_bolle', ordine.pk, {'max_totale': 10})
+        self.scarica('ordine_genera_bolle', ordine.pk, {'max_totale': 10, 'modalita': BILANCIATA})
+        self.assertEqual((cache_pdf.misses, cache_pdf.hits), (2, 1))
+
+    def test_eliminazione_dei_meno_recenti(self):
+        cache = CachePDF(sottocartella='cache_pdf_prova', dimensione_massima=3500)
+        self.addCleanup(cache.svuota)
+        for i, chiave in enumerate(['a' * 64, 'b' * 64, 'c' * 64]):
+            cache.ottieni(chiave, lambda f: f.write(b'x' * 1000)).close()
+            os.utime(cache.percorso(chiave), (1000 + i, 1000 + i))
+        cache.ottieni('a' * 64, lambda f: None).close()  # usato di recente
+        cache.ottieni('d' * 64, lambda f: f.write(b'x' * 1000)).close()
+        presenti = [c for c in 'abcd' if os.path.exists(cache.percorso(c * 64))]
+        self.assertEqual(presenti, ['a', 'c', 'd'])
+        self.assertLessEqual(cache.statistiche()['dimensione'], 3500)
+
+    def test_errore_di_generazione_non_lascia_file(self):
+        cache = CachePDF(sottocartella='cache_pdf_prova')
+        self.addCleanup(cache.svuota)
+
+        def genera(file):
+            file.write(b'%PDF parziale')
+            raise RuntimeError()
+        with self.assertRaises(RuntimeError):
+            cache.ottieni('e' * 64, genera)
+        self.assertEqual(os.listdir(os.path.dirname(cache.percorso('e' * 64))), [])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(prefix='test_lavori_'), LAVORI_SOGLIA_BOLLE=3)
+class LavoriInBackgroundTest(DatiOrdiniMixin, TestCase):
+
+    def setUp(self):
+        self.utente = User.objects.create_user('pianificazione')
+        self.client.force_login(self.utente)
+        cache_pdf.svuota()
+        self.addCleanup(cache_pdf.svuota)
+
+    def esegui_coda(self):
+        call_command('esegui_lavori', processi=0, una_volta=True, stdout=StringIO())
+
+    def test_bolle_pesanti_accodate_e_scaricate(self):
+        ordine = self.ordini[1]
+        response = self.client.post(reverse('ordine_genera_bolle', args=[ordine.pk]), {'max_totale': 2})
+        lavoro = LavoroDocumento.objects.get()
+        self.assertRedirects(response, lavoro.get_absolute_url())
+        self.assertEqual((lavoro.stato, lavoro.created_by), ('IN_CODA', self.utente))
+        self.assertEqual(self.client.get(reverse('lavoro_stato', args=[lavoro.pk])).json()['download_url'], None)
+
+        self.esegui_coda()
+        lavoro.refresh_from_db()
+        self.assertEqual(lavoro.stato, 'COMPLETATO')
+        stato = self.client.get(reverse('lavoro_stato', args=[lavoro.pk])).json()
+        response = self.client.get(stato['download_url'])
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        response.close()
+
+    def test_bolle_leggere_subito(self):
+        response = self.client.post(reverse('ordine_genera_bolle', args=[self.ordini[1].pk]), {'max_totale': 100})
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        response.close()
+        self.assertFalse(LavoroDocumento.objects.exists())
+
+    def test_bolle_di_piu_ordini(self):
+        response = self.client.post(reverse('ordini_genera_bolle'), {'stato': 'CONFERMATO', 'max_totale': 5})
+        lavoro = LavoroDocumento.objects.get(tipo='bolle_ordini')
+        self.assertRedirects(response, lavoro.get_absolute_url())
+        self.esegui_coda()
+        lavoro.refresh_from_db()
+        self.assertEqual(lavoro.stato, 'COMPLETATO')
+        with lavoro.file.open('rb') as pdf:
+            self.assertEqual(pdf.read(4), b'%PDF')
+
+    def test_errore_registrato_senza_dettagli_tecnici(self):
+        lavoro = accoda('bolle_lavoro', {'ordine': 0, **parametri_bolle(5)}, 'bolle.pdf', self.utente)
+        with self.assertLogs('gestionale.lavori', 'ERROR') as log:
+            self.esegui_coda()
+        self.assertIn('Traceback', log.output[0])
+        lavoro.refresh_from_db()
+        self.assertEqual(lavoro.stato, 'ERRORE')
+        self.assertEqual(lavoro.errore, "Il documento si riferisce a dati che non esistono più.")
+        self.assertEqual(self.client.get(reverse('lavoro_stato', args=[lavoro.pk])).json()['errore'], lavoro.errore)
+        self.assertNotContains(self.client.get(lavoro.get_absolute_url()), 'Traceback')
+        self.assertEqual(self.client.get(reverse('lavoro_download', args=[lavoro.pk])).status_code, 404)
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp(prefix='test_lavori_'), LAVORI_SOGLIA_DOCUMENTI=3)
+    def test_esportazione_pesante_accodata(self):
+        parametri = {'documenti': ['bolla_ordine', 'scheda_materiali'], 'cliente': self.cliente.pk, 'stato': 'CONFERMATO'}
+        response = self.client.get(reverse('esporta_documenti'), parametri)
+        lavoro = LavoroDocumento.objects.get(tipo='esportazione')
+        self.assertRedirects(response, lavoro.get_absolute_url())
+
+        self.esegui_coda()
+        lavoro.refresh_from_db()
+        self.assertEqual(lavoro.stato, 'COMPLETATO')
+        response = self.client.get(reverse('lavoro_download', args=[lavoro.pk]))
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archivio = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        response.close()
+        confermati = [o.pk for o in self.ordini if o.stato == 'CONFERMATO']
+        self.assertEqual(len(archivio.namelist()), 2 * len(confermati))
+        self.assertIsNone(archivio.testzip())
+
+    def test_lavoro_preso_una_sola_volta(self):
+        lavoro = accoda('bolle_lavoro', {'ordine': self.ordini[1].pk, **parametri_bolle(5)}, 'bolle.pdf')
+        self.assertEqual(prendi_lavori(5), [lavoro.pk])
+        self.assertEqual(prendi_lavori(5), [])
+
+    def test_lavoro_di_altri_utenti_non_visibile(self):
+        lavoro = accoda('bolle_lavoro', {'ordine': self.ordini[1].pk, **parametri_bolle(5)}, 'bolle.pdf', self.utente)
+        self.client.force_login(User.objects.create_user('altro'))
+        self.assertEqual(self.client.get(lavoro.get_absolute_url()).status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(prefix='test_esportazione_'), ESPORTAZIONE_PROCESSI=0)
+class EsportazioneDocumentiTest(DatiOrdiniMixin, TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('ufficio'))
+        self.addCleanup(cache_pdf.svuota)
+
+    def scarica_zip(self, parametri):
+        response = self.client.get(reverse('esporta_documenti'), parametri)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        return zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+
+    def test_documenti_degli_ordini(self):
+        parametri = {'documenti': ['bolla_ordine', 'scheda_materiali'], 'cliente': self.cliente.pk, 'stato': 'CONFERMATO'}
+        archivio = self.scarica_zip(parametri)
+        confermati = [o.pk for o in self.ordini if o.stato == 'CONFERMATO']
+        attesi = {f"{tipo}_{pk}.pdf" for tipo in ('bolla_ordine', 'scheda_materiali') for pk in confermati}
+        self.assertEqual(set(archivio.namelist()), attesi)
+        for nome in archivio.namelist():
+            self.assertTrue(archivio.read(nome).startswith(b'%PDF'))
+        self.assertIsNone(archivio.testzip())
+
+    def test_catalogo_del_cliente(self):
+        archivio = self.scarica_zip({'documenti': 'scheda_modello', 'cliente': self.cliente.pk})
+        self.assertEqual(sorted(archivio.namelist()), sorted(f"scheda_modello_{m.pk}.pdf" for m in self.modelli))
+
+    def test_ordini_indicati(self):
+        ordini = f"{self.ordini[0].pk},{self.ordini[1].pk}"
+        archivio = self.scarica_zip({'documenti': ['bolla_ordine', 'scheda_modello'], 'ordini': ordini})
+        self.assertEqual(sorted(archivio.namelist()), sorted([
+            f"bolla_ordine_{self.ordini[0].pk}.pdf", f"bolla_ordine_{self.ordini[1].pk}.pdf",
+            f"scheda_modello_{self.modelli[0].pk}.pdf", f"scheda_modello_{self.modelli[1].pk}.pdf",
+        ]))
+
+    def test_errori_elencati_nell_archivio(self):
+        documenti = documenti_da_esportare(ordini=[self.ordini[0].pk, 0], tipi=['scheda_materiali'])
+        archivio = zipfile.ZipFile(BytesIO(b''.join(zip_documenti(documenti, processi=0))))
+        self.assertEqual(archivio.namelist(), [f"scheda_materiali_{self.ordini[0].pk}.pdf", 'ERRORI.txt'])
+        self.assertIn(b'scheda_materiali_0.pdf', archivio.read('ERRORI.txt'))
+
+    def test_schede_modello_senza_cliente(self):
+        response = self.client.get(reverse('esporta_documenti'), {'documenti': 'scheda_modello'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.streaming)
+        self.assertContains(response, "scegli un cliente")
+
+
+def foto_di_prova(larghezza=2400, altezza=1800, formato='PNG', nome='scarpa.png', colore=(200, 30, 30)):
+    """Foto grande come quelle scattate col telefono, generata al volo."""
+    buffer = BytesIO()
+    immagine = Image.new('RGB', (larghezza, altezza), colore)
+    (immagine.convert('RGBA') if formato == 'PNG' else immagine).save(buffer, formato)
+    return SimpleUploadedFile(nome, buffer.getvalue(), content_type=Image.MIME[formato])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(prefix='test_immagini_'))
+class DerivatiFotoTest(DatiOrdiniMixin, TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('ufficio'))
+        self.modello = self.modelli[0]
+        self.modello.foto = foto_di_prova()
+        self.modello.save()
+        self.addCleanup(self.modello.foto.delete, save=False)
+
+    def test_versioni_ridotte_al_caricamento(self):
+        for formato, lato in DERIVATI.items():
+            nome = nome_derivato(self.modello.foto.name, formato)
+            self.assertTrue(default_storage.exists(nome))
+            with Image.open(default_storage.path(nome)) as immagine:
+                self.assertEqual(immagine.format, 'JPEG')
+                self.assertEqual(max(immagine.size), lato)
+                self.assertEqual(immagine.size[0] * 3, immagine.size[1] * 4)
+
+    def test_pagine_e_pdf_usano_le_versioni_ridotte(self):
+        response = self.client.get(reverse('modello_detail', args=[self.modello.pk]))
+        self.assertContains(response, default_storage.url(nome_derivato(self.modello.foto.name, 'dettaglio')))
+        response = self.client.get(reverse('modello_list'))
+        self.assertContains(response, default_storage.url(nome_derivato(self.modello.foto.name, 'miniatura')))
+
+        with mock.patch('gestionale.layout_pdf.Image', wraps=layout_pdf.Image) as immagine:
+            self.client.get(reverse('scheda_modello_pdf', args=[self.modello.pk])).close()
+        self.assertEqual(immagine.call_args.args[0],
+                         default_storage.path(nome_derivato(self.modello.foto.name, 'pdf')))
+
+    def test_senza_versione_ridotta_si_usa_l_originale(self):
+        default_storage.delete(nome_derivato(self.modello.foto.name, 'dettaglio'))
+        response = self.client.get(reverse('modello_detail', args=[self.modello.pk]))
+        self.assertContains(response, self.modello.foto.url)
+
+    def test_comando_di_recupero_ed_eliminazione(self):
+        nomi = [nome_derivato(self.modello.foto.name, formato) for formato in DERIVATI]
+        for nome in nomi:
+            default_storage.delete(nome)
+        output = StringIO()
+        call_command('genera_derivati_foto', stdout=output)
+        self.assertIn(f"versioni ridotte create: {len(DERIVATI)}", output.getvalue())
+        self.assertTrue(all(default_storage.exists(nome) for nome in nomi))
+
+        self.modello.delete()
+        self.assertFalse(any(default_storage.exists(nome) for nome in nomi))
+
+    def test_foto_con_lo_stesso_nome(self):
+        # scarpa.png e scarpa.jpg: ognuna ha le sue versioni ridotte
+        altro = self.modelli[1]
+        altro.foto = foto_di_prova(formato='JPEG', nome='scarpa.jpg', colore=(30, 30, 200))
+        altro.save()
+        self.addCleanup(altro.foto.delete, save=False)
+        png, jpg = (nome_derivato(modello.foto.name, 'miniatura') for modello in (self.modello, altro))
+        self.assertNotEqual(png, jpg)
+        with Image.open(default_storage.path(jpg)) as immagine:
+            rosso, _, blu = immagine.getpixel((0, 0))
+        self.assertGreater(blu, rosso)
+
+        self.modello.delete()
+        self.assertFalse(default_storage.exists(png))
+        self.assertTrue(default_storage.exists(jpg))
+
+    def test_foto_sostituita(self):
+        vecchi = [nome_derivato(self.modello.foto.name, formato) for formato in DERIVATI]
+        vecchia = self.modello.foto.name
+        self.modello = Modello.objects.get(pk=self.modello.pk)
+        self.modello.foto = foto_di_prova(nome='nuova.png')
+        self.modello.save()
+        self.addCleanup(self.modello.foto.delete, save=False)
+        default_storage.delete(vecchia)
+        self.assertFalse(any(default_storage.exists(nome) for nome in vecchi))
+        self.assertTrue(all(default_storage.exists(nome_derivato(self.modello.foto.name, formato))
+                            for formato in DERIVATI))
+
+
+class BenchmarkDocumentiTest(TestCase):
+
+    def test_misura_tutti_i_documenti_senza_lasciare_dati(self):
+        output = StringIO()
+        call_command('benchmark_documenti', componenti=3, taglie=4, ordini=2, paia=3, ripetizioni=1, stdout=output)
+        righe = output.getvalue().splitlines()
+        self.assertEqual(len(righe), 8)
+        for riga in righe[2:]:
+            # tempo, query, picco di memoria e dimensione del PDF
+            self.assertEqual(len(riga[36:].split()), 4)
+        self.assertFalse(Modello.objects.exists())
+
+
+class BenchmarkVisteTest(TestCase):
+
+    def test_misura_ogni_url_senza_lasciare_dati(self):
+        output = StringIO()
+        call_command('benchmark_viste', modelli=2, componenti=2, taglie=2, ordini=2, stdout=output)
+        righe = output.getvalue().splitlines()
+        self.assertEqual(len([riga for riga in righe[2:] if riga.strip()]), len(url_da_misurare()) + 1)
+        self.assertNotIn("risposta", output.getvalue())
+        self.assertFalse(Modello.objects.exists())
+        self.assertFalse(User.objects.exists())
+
+
+class TotalePaiaAnnotatoTest(DatiOrdiniMixin, TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('ufficio', is_staff=True, is_superuser=True))
+
+    def test_annotazione_uguale_alla_proprieta(self):
+        for ordine in Ordine.objects.con_totale_paia():
+            self.assertEqual(ordine.totale_paia, Ordine.objects.get(pk=ordine.pk).quantita_totale)
+        vuoto = Ordine.objects.create(modello=self.modelli[0])
+        self.assertEqual(Ordine.objects.con_totale_paia().get(pk=vuoto.pk).totale_paia, 0)
+
+    def test_elenco_ordini_a_query_costanti(self):
+        url = reverse('ordine_list')
+        with CaptureQueriesContext(connection) as prima:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        for i in range(30):
+            ordine = Ordine.objects.create(modello=self.modelli[i % 2])
+            DettaglioOrdine.objects.create(ordine=ordine, taglia=self.taglie[i % 5], quantita=i + 1)
+        with CaptureQueriesContext(connection) as dopo:
+            response = self.client.get(url)
+        self.assertEqual(len(prima), len(dopo))
+        self.assertEqual(len(response.context['table'].page.object_list), 20)
+
+    def test_ordinamento_per_totale_paia(self):
+        response = self.client.get(reverse('ordine_list'), {'sort': '-totale_paia'})
+        totali = [riga.record.totale_paia for riga in response.context['table'].page.object_list]
+        self.assertEqual(totali, sorted(totali, reverse=True))
+        self.assertEqual(totali[0], max(o.quantita_totale for o in self.ordini))
+
+    def test_home_dashboard_e_admin(self):
+        for url in (reverse('home'), reverse('report_dashboard'), reverse('admin:gestionale_ordine_changelist')):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        modello = self.client.get(reverse('report_dashboard')).context['modelli_popolari'][0]
+        ordini = [o for o in self.ordini if o.modello_id == modello.pk]
+        self.assertEqual(modello.num_ordini, len(ordini))
+        self.assertEqual(modello.totale_paia, sum(o.quantita_totale for o in ordini))
+
+
+def _sql_normalizzato(sql):
+    # Numeri e stringhe cambiano tra i due cataloghi: conta la forma della query
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    return re.sub(r'\(\?(?:, \?)+\)', '(...)', sql)
+
+
+def differenza_query(prima, dopo):
+    """Diff leggibile tra le query (normalizzate) di due esecuzioni della stessa vista."""
+    return "\n".join(difflib.unified_diff(
+        [_sql_normalizzato(q['sql']) for q in prima], [_sql_normalizzato(q['sql']) for q in dopo],
+        'catalogo piccolo', 'catalogo grande', lineterm='', n=1,
+    ))
+
+
+def elenco_query(queries):
+    """Query normalizzate, ciascuna con il numero di ripetizioni."""
+    conteggio = Counter(_sql_normalizzato(q['sql']) for q in queries)
+    return "\n".join(f"{volte:>4} x {sql}" for sql, volte in conteggio.items())
+
+
+class StatisticheModelliClienteTest(DatiOrdiniMixin, TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('ufficio'))
+
+    def test_statistiche_uguali_ai_conteggi(self):
+        vuoto = Modello.objects.create(cliente=self.cliente, nome="Senza ordini")
+        for modello in Modello.objects.con_statistiche():
+            ordini = modello.ordini.all()
+            self.assertEqual(modello.num_componenti, modello.componenti.count())
+            self.assertEqual(modello.num_ordini, ordini.count())
+            self.assertEqual(modello.totale_paia, sum(o.quantita_totale for o in ordini))
+            self.assertEqual(modello.ultimo_ordine, max((o.data_ordine for o in ordini), default=None))
+        self.assertEqual(Modello.objects.con_statistiche().get(pk=vuoto.pk).totale_paia, 0)
+
+    def test_dettaglio_cliente_a_pagine_e_query_costanti(self):
+        url = reverse('cliente_detail', args=[self.cliente.pk])
+        with CaptureQueriesContext(connection) as prima:
+            self.client.get(url)
+        for i in range(45):
+            Modello.objects.create(cliente=self.cliente, nome=f"Extra {i:02d}")
+        with CaptureQueriesContext(connection) as dopo:
+            response = self.client.get(url, {'page': 3})
+        self.assertEqual(len(prima), len(dopo))
+        pagina = response.context['modelli_page']
+        self.assertEqual((pagina.paginator.count, len(pagina.object_list)), (47, 7))
+        self.assertContains(response, "Pagina 3 di 3")
+
+
+class PaginazioneKeysetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.utente = User.objects.create_user('ufficio')
+        dati = genera_dati_sintetici(n_modelli=7, n_componenti=1, n_taglie=2, n_ordini=47, prefisso='KS')
+        cls.clienti = [dati['cliente'], Cliente.objects.create(nome="KS Altro")]
+        Modello.objects.filter(pk__in=[m.pk for m in dati['modelli'][:3]]).update(cliente=cls.clienti[1])
+        # Ordini con la stessa data: l'ordine tra loro lo decide la chiave primaria
+        stessa_data = timezone.now()
+        Ordine.objects.filter(pk__in=[o.pk for o in dati['ordini'][10:30]]).update(data_ordine=stessa_data)
+
+    def setUp(self):
+        self.client.force_login(self.utente)
+
+    def scorri(self, url, parametri=None):
+        """Segue i link 'successivi' e poi 'precedenti'; restituisce le pagine viste nei due versi."""
+        avanti, indietro, cursore = [], [], None
+        while True:
+            table = self.client.get(url, {**(parametri or {}), **({'cursore': cursore} if cursore else {})}).context['table']
+            avanti.append([riga.record.pk for riga in table.page.object_list])
+            if not table.page.has_next():
+                break
+            cursore = table.page.next_page_number()
+        while table.page.has_previous():
+            cursore = table.page.previous_page_number()
+            table = self.client.get(url, {**(parametri or {}), 'cursore': cursore}).context['table']
+            indietro.append([riga.record.pk for riga in table.page.object_list])
+        return avanti, indietro
+
+    def controlla_elenco(self, url, atteso, parametri=None):
+        avanti, indietro = self.scorri(url, parametri)
+        self.assertEqual(sum(avanti, []), atteso)
+        self.assertTrue(all(len(pagina) == 20 for pagina in avanti[:-1]))
+        self.assertEqual(indietro, avanti[-2::-1])
+
+    def test_ordini_in_ordine_di_data_con_parimerito(self):
+        atteso = list(Ordine.objects.order_by('-data_ordine', '-pk').values_list('pk', flat=True))
+        self.controlla_elenco(reverse('ordine_list'), atteso)
+
+    def test_ordinamento_per_relazione_e_filtri(self):
+        cliente = self.clienti[0]
+        atteso = list(Ordine.objects.filter(modello__cliente=cliente)
+                      .order_by('-modello__nome', '-pk').values_list('pk', flat=True))
+        self.controlla_elenco(reverse('ordine_list'), atteso, {'sort': '-modello', 'modello__cliente': cliente.pk})
+        atteso = list(Modello.objects.order_by('cliente__nome', 'pk').values_list('pk', flat=True))
+        self.controlla_elenco(reverse('modello_list'), atteso, {'sort': 'cliente'})
+
+    def test_pagina_in_fondo_costa_quanto_la_prima(self):
+        url = reverse('ordine_list')
+        with CaptureQueriesContext(connection) as prima_pagina:
+            table = self.client.get(url).context['table']
+        self.assertTrue(all('COUNT' not in q['sql'] and 'OFFSET' not in q['sql'] for q in prima_pagina))
+        table = self.client.get(url, {'cursore': table.page.next_page_number()}).context['table']
+        with CaptureQueriesContext(connection) as ultima_pagina:
+            self.client.get(url, {'cursore': table.page.next_page_number()})
+        self.assertEqual(len(prima_pagina), len(ultima_pagina))
+
+    def test_cursore_di_altro_ordinamento_o_illeggibile(self):
+        url = reverse('cliente_list')
+        response = self.client.get(url, {'cursore': 'non-valido'})
+        self.assertEqual(response.status_code, 200)
+        table = self.client.get(reverse('ordine_list')).context['table']
+        # Cambiando colonna si riparte dalla prima pagina
+        response = self.client.get(reverse('ordine_list'), {'sort': 'stato', 'cursore': table.page.next_page_number()})
+        self.assertFalse(response.context['table'].page.has_previous())
+
+    def test_colonne_senza_chiave_restano_a_pagine(self):
+        response = self.client.get(reverse('ordine_list'), {'sort': '-totale_paia', 'page': 3})
+        table = response.context['table']
+        self.assertEqual((table.page.number, len(table.page.object_list)), (3, 7))
+        self.assertIsNone(chiavi_ordinamento(Cliente.objects.order_by('numero_telefono')))
+
+
+class RicercaGlobaleTest(DatiOrdiniMixin, TestCase):
+
+    def trovati(self, testo):
+        return [(risultato.tipo, risultato.oggetto.pk) for risultato in cerca(testo)]
+
+    def test_codici_descrizioni_e_prefissi(self):
+        componente = self.modelli[0].componenti.get(cod_componente="PL01")
+        self.assertIn((ricerca.COMPONENTE, componente.pk), self.trovati("pl01"))
+        self.assertIn((ricerca.COMPONENTE, componente.pk), self.trovati("pelle lis"))
+        self.assertEqual(self.trovati("Cliente"), [(ricerca.CLIENTE, self.cliente.pk)])
+
+    def test_accenti_e_pertinenza(self):
+        modello = Modello.objects.create(cliente=self.cliente, nome="Décolleté Gioiello", forma="F12")
+        Componente.objects.create(modello=self.modelli[1], nome_componente=self.tomaia,
+                                  descrizione="Raso per décolleté")
+        risultati = self.trovati("decollete")
+        # Il nome pesa più della descrizione
+        self.assertEqual(risultati[0], (ricerca.MODELLO, modello.pk))
+        self.assertEqual(len(risultati), 2)
+
+    def test_indice_segue_modifiche_ed_eliminazioni(self):
+        modello = self.modelli[1]
+        modello.codice_articolo = "ZX900"
+        modello.save()
+        self.assertEqual(self.trovati("zx900"), [(ricerca.MODELLO, modello.pk)])
+        self.cliente.delete()
+        self.assertEqual(self.trovati("zx900"), [])
+        self.assertEqual(self.trovati("pl01"), [])
+
+    def test_sintassi_fts_ignorata(self):
+        for testo in ('"', 'NEAR(', 'pelle AND', '*', '-x', "l'uno"):
+            self.assertIsInstance(cerca(testo), list)
+        self.assertEqual(cerca('  '), [])
+
+    def test_ricostruzione_dopo_scritture_in_blocco(self):
+        Componente.objects.filter(cod_componente="PL01").update(cod_componente="QQ77")
+        self.assertEqual(self.trovati("qq77"), [])
+        call_command('ricostruisci_indice_ricerca', stdout=StringIO())
+        self.assertEqual(len(self.trovati("qq77")), 2)
+
+    def test_pagina_risultati(self):
+        self.client.force_login(User.objects.create_user('ufficio'))
+        response = self.client.get(reverse('ricerca'), {'q': 'pl01'})
+        self.assertContains(response, self.modelli[0].get_absolute_url())
+        self.assertContains(response, "Componente")
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(prefix='test_budget_query_'), ESPORTAZIONE_PROCESSI=0)
+class BudgetQueryVisteTest(TestCase):
+    """
+    Budget di query per ogni URL con nome: ogni pagina (PDF compresi) viene
+    chiamata su un catalogo piccolo e su uno molto più grande. Il numero di
+    query deve restare entro il budget e non deve crescere con i dati; se
+    cresce l'errore mostra le query in più. I tempi, che dipendono dalla
+    macchina, si misurano con il comando benchmark_viste.
+    """
+
+    # Query massime per una GET (sessione e utente compresi)
+    BUDGET_QUERY = 10
+    BUDGET_QUERY_URL = {
+        'home': 12,
+        'bolla_ordine_pdf': 12,
+    }
+    # Viste con query proporzionali ai dati, da correggere
+    CRESCITA_AMMESSA = set()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.utente = User.objects.create_superuser('budget', password='x')
+
+    def setUp(self):
+        self.client.force_login(self.utente)
+        self.addCleanup(cache_pdf.svuota)
+
+    def misura(self, pattern, catalogo):
+        url = indirizzo_url(pattern, catalogo, self.utente)
+        queries, _, response = misura_url(self.client, url)
+        self.assertLess(response.status_code, 400, f"{url}: risposta {response.status_code}")
+        return queries
+
+    def test_ogni_url_entro_il_budget(self):
+        urls = url_da_misurare()
+        # Prima tutte le pagine sul catalogo piccolo, poi sullo stesso database ingrandito
+        piccolo = catalogo_viste('PICCOLO', self.utente, n_modelli=2, n_componenti=2, n_taglie=2, n_ordini=2)
+        misure_piccolo = {pattern.name: self.misura(pattern, piccolo) for pattern in urls}
+        grande = catalogo_viste('GRANDE', self.utente, n_modelli=25, n_componenti=12, n_taglie=15, n_ordini=60)
+        for pattern in urls:
+            with self.subTest(url=pattern.name):
+                prima = misure_piccolo[pattern.name]
+                dopo = self.misura(pattern, grande)
+                budget = self.BUDGET_QUERY_URL.get(pattern.name, self.BUDGET_QUERY)
+                if pattern.name not in self.CRESCITA_AMMESSA:
+                    self.assertLessEqual(
+                        len(dopo), len(prima),
+                        f"{pattern.name}: {len(prima)} query sul catalogo piccolo, {len(dopo)} sul grande\n"
+                        + differenza_query(prima, dopo))
+                    self.assertLessEqual(
+                        len(dopo), budget, f"{pattern.name}: {len(dopo)} query, budget {budget}\n" + elenco_query(dopo))
+
+    def test_url_nuovi_hanno_i_parametri(self):
+        # Un URL aggiunto con parametri va associato a un oggetto del catalogo (o escluso con il motivo)
+        for pattern in url_da_misurare():
+            if pattern.pattern.converters and pattern.name != 'password_reset_confirm':
+                self.assertTrue(any(pattern.name in nomi for nomi in OGGETTI_URL.values()), pattern.name)
+
+    def test_differenza_query_leggibile(self):
+        prima = [{'sql': 'SELECT * FROM "ordine" WHERE "id" = 1'}]
+        dopo = prima + [{'sql': 'SELECT * FROM "dettaglio" WHERE "ordine_id" IN (1, 2, 3)'}] * 2
+        diff = differenza_query(prima, dopo)
+        self.assertIn('+SELECT * FROM "dettaglio" WHERE "ordine_id" IN (...)', diff)
+        self.assertNotIn('-SELECT', diff)
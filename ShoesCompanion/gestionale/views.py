@@ -1,29 +1,39 @@
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Count, Sum
+from django.core.paginator import Paginator
+from django.db.models import Count, Prefetch, Sum
 from django.forms import inlineformset_factory
 from django.contrib import messages
-from django.http import HttpResponse
+from django.http import FileResponse, Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse, reverse_lazy
 from django.views import generic
 from django.utils import timezone
+from django.conf import settings
 
-from io import BytesIO
 from reportlab.pdfgen import canvas
 
 from decimal import Decimal
 
+from .bolle import SEQUENZIALE, numero_minimo_bolle
+from .documenti import cache_pdf, chiave_pdf, documento_pdf, genera_bolle_ordini, pdf_temporaneo
+from .esportazione import TIPI_MODELLO, documenti_da_esportare, zip_documenti
+from .lavori import accoda, parametri_bolle, soglia_bolle, soglia_documenti
+from .paginazione import pagina_tabella
+from .ricerca import CLIENTE, COMPONENTE, MODELLO, cerca
+from .importazione import ErroreFile, importa_ordini
 from .filters import (ClienteFilter, ColoreFilter, ComponenteFilter,
                     ModelloFilter, OrdineFilter, TagliaFilter,
                     TipoComponenteFilter)
-from .forms import (ClienteForm, ColoreForm, ComponenteForm, DettaglioOrdineForm,
-                    ModelloForm, OrdineMainForm, DettaglioOrdineFormSet, ArticoloFormSet,
-                    TagliaForm, TipoComponenteForm)
-from .models import (Articolo, Cliente, Colore, Componente, DettaglioOrdine,
+from .forms import (ClienteForm, ColoreForm, ComponenteForm, DettaglioOrdineForm, EsportaDocumentiForm,
+                    ImportaOrdiniForm, MatriceMisureForm, ModelliInBloccoForm, ModelloCreateForm,
+                    ModelloForm, OrdineMainForm, DettaglioOrdineFormSet, ArticoloFormSet, TagliaForm,
+                    TipoComponenteForm)
+from .models import (Articolo, Cliente, Colore, Componente, DettaglioOrdine, LavoroDocumento,
                    Modello, Ordine, Taglia, TipoComponente)
 from .tables import (ClienteTable, ColoreTable, ModelloTable, OrdineTable,
                    TagliaTable, TipoComponenteTable)
+from .materiali import riepilogo_materiali, totale_riepilogo_materiali
 
 # ==============================================================================
 # VISTA HOME
@@ -37,7 +47,7 @@ def home(request):
         'tipi_componente_count': TipoComponente.objects.count(),
         'ordini_attivi_count': Ordine.objects.exclude(stato__in=['COMPLETATO', 'ANNULLATO']).count(),
         'scarpe_da_produrre': DettaglioOrdine.objects.filter(ordine__stato='CONFERMATO').aggregate(total=Sum('quantita'))['total'] or 0,
-        'ordini_recenti': Ordine.objects.select_related('modello', 'modello__cliente').order_by('-data_ordine')[:5],
+        'ordini_recenti': Ordine.objects.select_related('modello', 'modello__cliente').con_totale_paia().order_by('-data_ordine')[:5],
     }
     stati_ordine_data = Ordine.objects.values('stato').annotate(count=Count('id')).order_by('stato')
     stati_grafico = {stato_key: 0 for stato_key, stato_display in Ordine.STATO_ORDINE_CHOICES}
@@ -52,20 +62,43 @@ def home(request):
 # VISTE CRUD PRINCIPALI
 # ==============================================================================
 
-# --- Viste Cliente ---
-class ClienteListView(LoginRequiredMixin, generic.ListView):
-    model = Cliente
-    template_name = 'gestionale/clienti/cliente_list.html'
-    paginate_by = 20
+class ElencoPaginatoMixin:
+    """
+    Elenco con i filtri di django-filter e la tabella ordinabile di
+    django-tables2, paginato per chiave quando l'ordinamento lo permette
+    (vedi paginazione.py): la pagina N costa quanto la prima.
+    """
+    filterset_class = None
+    table_class = None
+    righe_per_pagina = 20
+
+    def get_queryset_elenco(self):
+        return self.get_queryset()
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['filter'] = ClienteFilter(self.request.GET, queryset=self.get_queryset())
-        context['table'] = ClienteTable(context['filter'].qs)
+        context['filter'] = self.filterset_class(self.request.GET, queryset=self.get_queryset_elenco())
+        context['table'] = pagina_tabella(self.table_class(context['filter'].qs), self.request, self.righe_per_pagina)
         return context
 
+# --- Viste Cliente ---
+class ClienteListView(LoginRequiredMixin, ElencoPaginatoMixin, generic.ListView):
+    model = Cliente
+    template_name = 'gestionale/clienti/cliente_list.html'
+    filterset_class = ClienteFilter
+    table_class = ClienteTable
+
 class ClienteDetailView(LoginRequiredMixin, generic.DetailView):
     model = Cliente
     template_name = 'gestionale/clienti/cliente_detail.html'
+    queryset = Cliente.objects.select_related('created_by')
+    modelli_per_pagina = 20
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Modelli a pagine, con componenti, ordini e paia contati nella stessa query
+        modelli = Paginator(self.object.modelli.con_statistiche(), self.modelli_per_pagina)
+        context['modelli_page'] = modelli.get_page(self.request.GET.get('page'))
+        return context
 
 class ClienteCreateView(LoginRequiredMixin, generic.CreateView):
     model = Cliente
@@ -90,20 +123,19 @@ class ClienteDeleteView(LoginRequiredMixin, generic.DeleteView):
 
 
 # --- Viste Modello ---
-class ModelloListView(LoginRequiredMixin, generic.ListView):
+class ModelloListView(LoginRequiredMixin, ElencoPaginatoMixin, generic.ListView):
     model = Modello
     template_name = 'gestionale/modelli/modello_list.html'
-    paginate_by = 20
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        queryset = self.get_queryset().select_related('cliente')
-        context['filter'] = ModelloFilter(self.request.GET, queryset=queryset)
-        context['table'] = ModelloTable(context['filter'].qs)
-        return context
+    filterset_class = ModelloFilter
+    table_class = ModelloTable
+    def get_queryset_elenco(self):
+        return self.get_queryset().select_related('cliente')
 
 class ModelloDetailView(LoginRequiredMixin, generic.DetailView):
     model = Modello
     template_name = 'gestionale/modelli/modello_detail.html'
+    queryset = Modello.objects.select_related('cliente', 'created_by').prefetch_related(
+        Prefetch('componenti', queryset=Componente.objects.select_related('nome_componente', 'colore')))
 
 # In views.py
 from .models import Modello, Componente # Aggiungi Componente
@@ -111,7 +143,7 @@ from django.db import transaction
 
 class ModelloCreateView(LoginRequiredMixin, generic.CreateView):
     model = Modello
-    form_class = ModelloForm
+    form_class = ModelloCreateForm
     template_name = 'gestionale/modelli/modello_form.html'
     
     def form_valid(self, form):
@@ -131,10 +163,10 @@ class ModelloCreateView(LoginRequiredMixin, generic.CreateView):
                 # 3. Salva l'oggetto Modello principale nel database
                 self.object.save()
 
-                # 4. Ora che il modello esiste, crea i suoi componenti base
-                tipi_componente_da_creare = struttura_scelta.tipi_componente.all()
-                for tipo_comp in tipi_componente_da_creare:
-                    Componente.objects.create(modello=self.object, nome_componente=tipo_comp)
+                # 4. Ora che il modello esiste, crea i suoi componenti base (ed eventualmente
+                #    la griglia delle misure) con un inserimento in blocco
+                if struttura_scelta:
+                    struttura_scelta.crea_componenti([self.object], form.taglie_griglia())
         
         except Exception as e:
             # Se qualcosa va storto, mostra un messaggio di errore
@@ -149,6 +181,22 @@ class ModelloCreateView(LoginRequiredMixin, generic.CreateView):
     def get_success_url(self):
         return reverse('modello_detail', kwargs={'pk': self.object.pk})
 
+class ModelliInBloccoView(LoginRequiredMixin, generic.FormView):
+    """Crea una collezione di modelli con i componenti della stessa struttura."""
+    form_class = ModelliInBloccoForm
+    template_name = 'gestionale/modelli/modelli_in_blocco.html'
+
+    def form_valid(self, form):
+        dati = form.cleaned_data
+        with transaction.atomic():
+            modelli = Modello.objects.bulk_create([
+                Modello(cliente=dati['cliente'], tipo=dati['tipo'], created_by=self.request.user, **riga)
+                for riga in dati['righe']
+            ])
+            componenti = dati['struttura'].crea_componenti(modelli, form.taglie_griglia())
+        messages.success(self.request, f"Creati {len(modelli)} modelli con {len(componenti)} componenti.")
+        return redirect(f"{reverse('modello_list')}?cliente={dati['cliente'].pk}")
+
 class ModelloUpdateView(LoginRequiredMixin, generic.UpdateView):
     model = Modello
     form_class = ModelloForm
@@ -204,7 +252,9 @@ def manage_articoli_componente(request, componente_id):
     if request.method == 'POST':
         formset = ArticoloFormSet(request.POST, instance=componente, prefix='articoli')
         if formset.is_valid():
-            formset.save()
+            # In una transazione il riepilogo materiali degli ordini si ricalcola una volta sola, al commit
+            with transaction.atomic():
+                formset.save()
             messages.success(request, "Misure salvate con successo.")
             return redirect('modello_detail', pk=componente.modello.pk)
         else:
@@ -224,24 +274,52 @@ def manage_articoli_componente(request, componente_id):
     }
     return render(request, 'gestionale/componenti/manage_articoli.html', context)
 
+@login_required
+def matrice_misure_modello(request, pk):
+    """Tutte le misure del modello (componenti x taglie) in una sola pagina e un solo salvataggio."""
+    modello = get_object_or_404(Modello.objects.select_related('cliente'), pk=pk)
+    form = MatriceMisureForm(request.POST or None, modello=modello)
+    if request.method == 'POST':
+        if form.is_valid():
+            creati, aggiornati = form.save()
+            messages.success(request, f"Misure salvate: {creati} nuove, {aggiornati} modificate.")
+            return redirect('modello_detail', pk=modello.pk)
+        messages.error(request, "Errore nella compilazione dei dati. Controlla le celle evidenziate.")
+    return render(request, 'gestionale/modelli/matrice_misure.html', {'modello': modello, 'form': form})
+
+@login_required
+def importa_ordini_view(request):
+    """Crea gli ordini da un foglio delle taglie; con degli errori non crea nulla e li elenca per riga."""
+    form = ImportaOrdiniForm(request.POST or None, request.FILES or None)
+    esito = None
+    if request.method == 'POST' and form.is_valid():
+        file = form.cleaned_data['file']
+        try:
+            esito = importa_ordini(file, file.name, utente=request.user)
+        except ErroreFile as e:
+            form.add_error('file', str(e))
+        else:
+            if not esito.errori_totali:
+                messages.success(request, f"Importati {esito.ordini} ordini ({esito.dettagli} righe per taglia).")
+                return redirect('ordine_list')
+    return render(request, 'gestionale/ordini/importa_ordini.html', {'form': form, 'esito': esito})
+
 # --- Viste Ordine ---
-class OrdineListView(LoginRequiredMixin, generic.ListView):
+class OrdineListView(LoginRequiredMixin, ElencoPaginatoMixin, generic.ListView):
     model = Ordine
     template_name = 'gestionale/ordini/ordine_list.html'
-    paginate_by = 20
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        queryset = Ordine.objects.select_related('modello', 'modello__cliente').all()
-        context['filter'] = OrdineFilter(self.request.GET, queryset=queryset)
-        context['table'] = OrdineTable(context['filter'].qs)
-        return context
+    filterset_class = OrdineFilter
+    table_class = OrdineTable
+    def get_queryset_elenco(self):
+        return Ordine.objects.select_related('modello', 'modello__cliente').con_totale_paia()
 
 class OrdineDetailView(LoginRequiredMixin, generic.DetailView):
     model = Ordine
     template_name = 'gestionale/ordini/ordine_detail.html'
+    queryset = Ordine.objects.select_related('modello', 'modello__cliente').prefetch_related('dettagli__taglia')
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['materiali_necessari'] = self.object.get_materiali_necessari()
+        context['materiali_necessari'] = riepilogo_materiali(self.object)
         return context
     
 from .forms import OrdineMainForm, QuantitaPerTagliaForm # Assicurati di importarlo
@@ -345,15 +423,12 @@ class OrdineCreateView(LoginRequiredMixin, generic.CreateView):
                 form.save_m2m() # Necessario se il form avesse campi many-to-many
 
                 # Crea i dettagli dell'ordine (quantità per taglia)
-                dettagli_creati_count = 0
-                for taglia_id, quantita in quantita_form.get_dettagli_data():
-                    if quantita > 0:
-                        DettaglioOrdine.objects.create(ordine=ordine, taglia_id=taglia_id, quantita=quantita)
-                        dettagli_creati_count += 1
-                
+                dettagli = dict(quantita_form.get_dettagli_data())
+
                 # Se non sono state inserite quantità, annulla tutto e mostra un errore.
-                if dettagli_creati_count == 0:
+                if not dettagli:
                     raise ValueError("È necessario specificare la quantità per almeno una taglia.")
+                ordine.salva_dettagli(dettagli)
 
                 messages.success(self.request, f"Ordine #{ordine.id} creato con successo.")
                 return redirect(reverse('ordine_detail', kwargs={'pk': ordine.pk}))
@@ -399,22 +474,13 @@ class OrdineUpdateView(LoginRequiredMixin, generic.UpdateView):
                 taglia = dettaglio_form.cleaned_data.get('taglia')
                 quantita = dettaglio_form.cleaned_data.get('quantita')
                 if taglia and quantita:
-                    taglie_aggregate[taglia] = taglie_aggregate.get(taglia, 0) + quantita
-
-        self.object = form.save()
-
-        # Sincronizza il database con i dati aggregati
-        taglie_da_mantenere = []
-        for taglia, quantita_totale in taglie_aggregate.items():
-            dettaglio, created = DettaglioOrdine.objects.update_or_create(
-                ordine=self.object,
-                taglia=taglia,
-                defaults={'quantita': quantita_totale}
-            )
-            taglie_da_mantenere.append(taglia.pk)
+                    taglie_aggregate[taglia.pk] = taglie_aggregate.get(taglia.pk, 0) + quantita
 
-        # Elimina i dettagli per le taglie non più presenti nel form
-        self.object.dettagli.exclude(taglia__pk__in=taglie_da_mantenere).delete()
+        with transaction.atomic():
+            self.object = form.save()
+            # Sincronizza il database con i dati aggregati; le taglie non più
+            # presenti nel form vengono eliminate
+            self.object.salva_dettagli(taglie_aggregate)
 
         return redirect(self.get_success_url())
 
@@ -432,7 +498,9 @@ def ordine_conferma(request, pk):
         ordine = get_object_or_404(Ordine, pk=pk)
         if ordine.stato == 'BOZZA':
             ordine.stato = 'CONFERMATO'
-            ordine.save()
+            # Il salvataggio congela anche la distinta base: tutto o niente
+            with transaction.atomic():
+                ordine.save()
     return redirect('ordine_detail', pk=pk)
 
 @login_required
@@ -531,6 +599,8 @@ class ColoreListView(LoginRequiredMixin, generic.ListView):
 class ColoreDetailView(LoginRequiredMixin, generic.DetailView):
     model = Colore
     template_name = 'gestionale/colori/colore_detail.html'
+    queryset = Colore.objects.prefetch_related(
+        Prefetch('componente_set', queryset=Componente.objects.select_related('nome_componente', 'modello')))
 
 class ColoreCreateView(LoginRequiredMixin, generic.CreateView):
     model = Colore
@@ -599,6 +669,8 @@ class TipoComponenteListView(LoginRequiredMixin, generic.ListView):
 class TipoComponenteDetailView(LoginRequiredMixin, generic.DetailView):
     model = TipoComponente
     template_name = 'gestionale/tipicomponente/tipocomponente_detail.html'
+    queryset = TipoComponente.objects.prefetch_related(
+        Prefetch('componente_set', queryset=Componente.objects.select_related('modello', 'modello__cliente', 'colore')))
 
 class TipoComponenteCreateView(LoginRequiredMixin, generic.CreateView):
     model = TipoComponente
@@ -623,17 +695,7 @@ class TipoComponenteDeleteView(LoginRequiredMixin, generic.DeleteView):
 # VISTE REPORT E PDF
 # ==============================================================================
 
-# Import per ReportLab / PDF
-from io import BytesIO
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
-from reportlab.lib.units import cm
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
-
-# In gestionale/views.py
-from decimal import Decimal # Assicurati che questo import sia presente all'inizio del file
+# La costruzione dei PDF è in gestionale/documenti.py
 
 @login_required
 def report_dashboard(request):
@@ -643,28 +705,9 @@ def report_dashboard(request):
     """
     
     # --- 1. Calcolo Aggregato dei Materiali da Ordinare ---
+    # Somma fatta dal database sul riepilogo materializzato, indipendente dal numero di ordini attivi.
     ordini_attivi = Ordine.objects.exclude(stato__in=['COMPLETATO', 'ANNULLATO'])
-    
-    materiali_da_ordinare = {}
-
-    for ordine in ordini_attivi:
-        materiali_per_ordine = ordine.get_materiali_necessari()
-        
-        for key, misure in materiali_per_ordine.items():
-            # La riga seguente è la correzione chiave.
-            # .setdefault() garantisce che 'master_entry' abbia sempre un valore.
-            # Se la chiave (es. 'Tomaia', 'Pelle Nera') non esiste nel dizionario,
-            # la crea con i valori di default. Altrimenti, restituisce quella esistente.
-            master_entry = materiali_da_ordinare.setdefault(key, {
-                'tot_superficie_mq': Decimal('0.0'),
-                'tot_superficie_piedi_quadri': Decimal('0.0'),
-                'unita_prodotte': 0
-            })
-            
-            # Ora possiamo aggiungere i valori con la certezza che 'master_entry' esista.
-            master_entry['tot_superficie_mq'] += misure.get('tot_superficie_mq', Decimal('0.0'))
-            master_entry['tot_superficie_piedi_quadri'] += misure.get('tot_superficie_piedi_quadri', Decimal('0.0'))
-            master_entry['unita_prodotte'] += misure.get('unita_prodotte', 0)
+    materiali_da_ordinare = totale_riepilogo_materiali(ordini_attivi)
 
     # --- 2. Altre Statistiche (già corrette) ---
     ordini_per_stato_qs = Ordine.objects.values('stato').annotate(
@@ -672,8 +715,13 @@ def report_dashboard(request):
         total_pairs=Sum('dettagli__quantita') 
     ).order_by('stato')
     
-    modelli_popolari = Modello.objects.annotate(num_ordini=Count('ordini')).order_by('-num_ordini')[:5]
-    clienti_attivi = Cliente.objects.annotate(num_ordini=Count('modelli__ordini')).order_by('-num_ordini')[:5]
+    # distinct: la join con i dettagli per le paia moltiplicherebbe il conteggio degli ordini
+    modelli_popolari = Modello.objects.annotate(
+        num_ordini=Count('ordini', distinct=True), totale_paia=Sum('ordini__dettagli__quantita', default=0)
+    ).order_by('-num_ordini')[:5]
+    clienti_attivi = Cliente.objects.annotate(
+        num_ordini=Count('modelli__ordini', distinct=True), totale_paia=Sum('modelli__ordini__dettagli__quantita', default=0)
+    ).order_by('-num_ordini')[:5]
 
     context = {
         'materiali_da_ordinare': materiali_da_ordinare,
@@ -684,315 +732,53 @@ def report_dashboard(request):
     }
     return render(request, 'gestionale/report/dashboard.html', context)
 
-def _pdf_base_elements(title_text):
-    """Funzione helper per creare stili e titolo comuni per i PDF."""
-    styles = getSampleStyleSheet()
-    style_title = ParagraphStyle(name='Title', fontSize=15, alignment=TA_CENTER, spaceBottom=50, fontName='Helvetica-Bold')
-    style_heading = ParagraphStyle(name='Heading2', fontSize=14, fontName='Helvetica-Bold', spaceBefore=12, spaceAfter=6)
-    
-    elements = [Paragraph(title_text, style_title)]
-    return elements, styles
+def risposta_pdf(file, nome_file):
+    """Risposta con il PDF come allegato: il file viene letto a blocchi e chiuso da Django."""
+    return FileResponse(file, as_attachment=True, filename=nome_file, content_type='application/pdf')
 
 @login_required
 def bolla_ordine_pdf(request, pk):
     ordine = get_object_or_404(Ordine.objects.select_related('modello', 'modello__cliente'), pk=pk)
-    
-    buffer = BytesIO()
-    # Usiamo margini più stretti per far stare tutto comodamente
-    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=1.5*cm, bottomMargin=1.5*cm, leftMargin=1.5*cm, rightMargin=1.5*cm)
-    
-    elements, styles = _pdf_base_elements("Bolla d'Ordine")
-
-    # Stili personalizzati aggiuntivi
-    style_header_field = ParagraphStyle(name='HeaderField', fontSize=8, fontName='Helvetica')
-    style_header_value = ParagraphStyle(name='HeaderValue', fontSize=10, fontName='Helvetica-Bold',bottomMargin=1.5*cm)
-    style_section = ParagraphStyle(name='Section', fontSize=10, fontName='Helvetica-Bold', spaceBefore=8, spaceAfter=4)
-    style_component_label = ParagraphStyle(name='ComponentLabel', fontSize=9, fontName='Helvetica-Bold')
-    style_component_value = ParagraphStyle(name='ComponentValue', fontSize=9, fontName='Helvetica', leading=11)
-    
-    # --- INTESTAZIONE DETTAGLIATA ---
-    info_header_data = [
-        [
-            Paragraph(f"<b>Ordine N:</b> {ordine.id}<br/>"
-                      f"<b>Data:</b> {ordine.data_ordine.strftime('%d/%m/%Y')}<br/>"
-                      f"<b>Cliente:</b> {ordine.modello.cliente.nome}", styles['Normal']),
-            Paragraph(f"<b>Modello:</b> {ordine.modello.nome}<br/>"
-                      f"<b>Articolo:</b> {ordine.modello.codice_articolo or '-'}<br/>"
-                      f"<b>Forma:</b> {ordine.modello.forma or '-'}", styles['Normal']),
-            Image(ordine.modello.foto.path, width=4*cm, height=4*cm) if ordine.modello.foto else Paragraph("Nessuna Foto", styles['Italic'])
-        ]
-    ]
-    info_table = Table(info_header_data, colWidths=[7*cm, 7*cm, 4*cm])
-    info_table.setStyle(TableStyle([('VALIGN', (0,0), (-1,-1), 'TOP')]))
-    elements.append(info_table)
-
-    # --- TABELLA NUMERAZIONE COMPLETA ---
-    elements.append(Paragraph("Dettagli Quantità per Taglia", style_section))
-    
-    tutte_le_taglie = Taglia.objects.order_by('numero').all()
-    dettagli_map = {d.taglia_id: d for d in ordine.dettagli.all()}
-
-    header_row = [Paragraph(str(t), style_header_field) for t in tutte_le_taglie]
-    quantita_row = [Paragraph(str(dettagli_map.get(t.pk).quantita if t.pk in dettagli_map else ''), style_header_value) for t in tutte_le_taglie]
-    
-    col_width = (18 * cm) / len(tutte_le_taglie) # Larghezza colonne dinamica
-    numerazione_table = Table([header_row, quantita_row], colWidths=[col_width]*len(header_row))
-    numerazione_table.setStyle(TableStyle([
-        ('GRID', (0,0), (-1,-1), 1, colors.black),
-        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-        ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
-        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold')
-    ]))
-    elements.append(numerazione_table)
-    
-    # Aggiungiamo il totale paia
-    elements.append(Spacer(1, 0.2*cm))
-    elements.append(Paragraph(f"<b>TOTALE PAIA: {ordine.quantita_totale}</b>", ParagraphStyle(name='Total', alignment=TA_RIGHT, fontName='Helvetica-Bold')))
-    elements.append(Spacer(1, 0.5*cm))
-
-    # --- SEZIONE COMPONENTI DINAMICA ---
-    elements.append(Paragraph("Distinta Componenti", style_section))
-    
-    componenti_del_modello = ordine.modello.componenti.select_related('nome_componente', 'colore').all()
-    if componenti_del_modello:
-        componenti_data = [[
-            Paragraph('COMPONENTE', style_header_field),
-            Paragraph('MATERIALE / DETTAGLI', style_header_field)
-        ]]
-        for comp in componenti_del_modello:
-            colore_info = f"<br/><b>Colore:</b> {comp.colore.nome if comp.colore else '-'}"
-            codici_info = f"<br/><b>Cod. Art:</b> {comp.cod_componente or '-'} / <b>Cod. Col:</b> {comp.cod_colore or '-'}"
-            descrizione_par = Paragraph(f"{comp.descrizione or '-'}{colore_info}{codici_info}", style_component_value)
-            
-            componenti_data.append([
-                Paragraph(comp.nome_componente.nome, style_component_label),
-                descrizione_par
-            ])
-        
-        componenti_table = Table(componenti_data, colWidths=[5*cm, 13*cm])
-        componenti_table.setStyle(TableStyle([
-            ('GRID', (0,0), (-1,-1), 1, colors.black),
-            ('VALIGN', (0,0), (-1,-1), 'TOP'),
-            ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
-            ('BOTTOMPADDING', (0,0), (-1,-1), 4),
-            ('TOPPADDING', (0,0), (-1,-1), 4),
-        ]))
-        elements.append(componenti_table)
-    else:
-        elements.append(Paragraph("Nessun componente di base definito per questo modello.", styles['Italic']))
-        
-    # --- NOTE ---
-    if ordine.note:
-        elements.append(Spacer(1, 0.5*cm))
-        note_table = Table([[Paragraph('NOTE ORDINE', style_section)], [Paragraph(ordine.note, style_component_value)]], colWidths=[18*cm], rowHeights=[None, 2*cm])
-        note_table.setStyle(TableStyle([('BOX', (0,0), (-1,-1), 1, colors.black), ('VALIGN', (0,0), (-1,-1), 'TOP')]))
-        elements.append(note_table)
-
-    doc.build(elements)
-    
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="bolla_ordine_{pk}.pdf"'
-    response.write(buffer.getvalue())
-    buffer.close()
-    return response
+    return risposta_pdf(documento_pdf('bolla_ordine', ordine), f"bolla_ordine_{pk}.pdf")
 
 @login_required
 def scheda_materiali_pdf(request, pk):
     ordine = get_object_or_404(Ordine.objects.select_related('modello', 'modello__cliente'), pk=pk)
-    materiali = ordine.get_materiali_necessari()
-    
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=2*cm, bottomMargin=2*cm, leftMargin=2*cm, rightMargin=2*cm)
-    
-    elements, styles = _pdf_base_elements("")
-    
-    style_title = ParagraphStyle(
-        name='Title', 
-        fontSize=20, 
-        fontName='Helvetica-Bold', 
-        alignment=TA_CENTER,
-        spaceAfter=1*cm  # MODIFICA: Aggiunto 1 cm di spazio SOTTO il titolo
-    )
-    
-    # --- NUOVO STILE PER LE INTESTAZIONI DELLA TABELLA ---
-    style_table_header = ParagraphStyle(
-        name='TableHeader',
-        fontName='Helvetica-Bold',
-        fontSize=9,
-        textColor=colors.whitesmoke
-    )
-
-    # --- INTESTAZIONE CON DETTAGLI ORDINE E FOTO ---
-    quantita_totale = ordine.dettagli.aggregate(Sum('quantita'))['quantita__sum'] or 0
-    
-    info_header_data = [
-        [
-            Paragraph(f"<b>Ordine N:</b> {ordine.id}<br/>"
-                      f"<b>Data:</b> {ordine.data_ordine.strftime('%d/%m/%Y')}<br/>"
-                      f"<b>Cliente:</b> {ordine.modello.cliente.nome}", styles['Normal']),
-            Paragraph(f"<b>Modello:</b> {ordine.modello.nome}<br/>"
-                      f"<b>Articolo:</b> {ordine.modello.codice_articolo or '-'}<br/>"
-                      f"<b>Totale Paia:</b> {quantita_totale}", styles['Normal']),
-            Image(ordine.modello.foto.path, width=4*cm, height=4*cm) if ordine.modello.foto else Paragraph("Nessuna Foto", styles['Italic'])
-        ]
-    ]
-    info_table = Table(info_header_data, colWidths=[7*cm, 6*cm, 4*cm])
-    info_table.setStyle(TableStyle([('VALIGN', (0,0), (-1,-1), 'TOP')]))
-    elements.append(info_table)
-    elements.append(Spacer(1, 1*cm))
-
-    # --- TABELLA MATERIALI DINAMICA ---
-    elements.append(Paragraph("Riepilogo Fabbisogno per Componente", styles['h2']))
-
-    if materiali:
-        # Usa il nuovo stile nelle intestazioni
-        data_materiali = [[
-            Paragraph('COMPONENTE', style_table_header),
-            Paragraph('MATERIALE / DETTAGLI', style_table_header),
-            Paragraph('QUANTITÀ TOTALE', style_table_header)
-        ]]
-        
-        for key, misure in sorted(materiali.items()):
-            nome_comp, colore, desc, cod_comp, cod_col = key
-            
-            colore_info = f"<br/><b>Colore:</b> {colore.nome if colore else '-'}"
-            codici_info = f"<br/><b>Cod. Art:</b> {cod_comp or '-'} / <b>Cod. Col:</b> {cod_col or '-'}"
-            descrizione_par = Paragraph(f"{desc or '-'}{colore_info}{codici_info}", styles['Normal'])
-            
-            if misure['unita_misura'] == 'SUPERFICIE':
-                quantita_str = (
-                    f"<b>{misure['tot_superficie_mq']:.4f}</b> m²<br/>"
-                    f"<i>({misure['tot_superficie_piedi_quadri']:.4f} ft²)</i>"
-                )
-            else:
-                quantita_str = f"<b>{misure['tot_quantita_unitaria']:.2f}</b> {misure['unita_misura_display']}"
-            
-            quantita_par = Paragraph(quantita_str, styles['Normal'])
-            
-            data_materiali.append([
-                Paragraph(nome_comp, styles['Normal']),
-                descrizione_par,
-                quantita_par
-            ])
-            
-        table_materiali = Table(data_materiali, colWidths=[4*cm, 9*cm, 4*cm])
-        table_materiali.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.darkgrey),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-            ('GRID', (0,0), (-1,-1), 1, colors.black),
-            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-            ('BOTTOMPADDING', (0,0), (-1,-1), 6),
-            ('TOPPADDING', (0,0), (-1,-1), 6),
-            ('ALIGN', (2,1), (2,-1), 'RIGHT'),
-        ]))
-        elements.append(table_materiali)
-    else:
-        elements.append(Paragraph("Nessun materiale calcolato per questo ordine.", styles['Italic']))
-    
-    doc.build(elements)
-    
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="scheda_materiali_{pk}.pdf"'
-    response.write(buffer.getvalue())
-    buffer.close()
-    return response
-
+    return risposta_pdf(documento_pdf('scheda_materiali', ordine), f"scheda_materiali_{pk}.pdf")
 
 @login_required
 def scheda_modello_pdf(request, pk):
     modello = get_object_or_404(Modello.objects.select_related('cliente'), pk=pk)
-    
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=2*cm, bottomMargin=2*cm, leftMargin=2*cm, rightMargin=2*cm)
-    
-    elements, styles = _pdf_base_elements("Scheda Tecnica Modello")
-    
-    # Stili personalizzati aggiuntivi
-    styles.add(ParagraphStyle(name='Italic', fontName='Helvetica-Oblique', fontSize=9))
-    styles.add(ParagraphStyle(name='ComponentHeader', fontName='Helvetica-Bold', fontSize=10, spaceBefore=8, spaceAfter=4))
-    styles.add(ParagraphStyle(name='ComponentDetails', fontName='Helvetica', fontSize=8, leading=10))
-
-    # --- INTESTAZIONE CON DETTAGLI MODELLO ---
-    info_header_data = [
-        [
-            Paragraph(f"<b>Modello:</b> {modello.nome}<br/>"
-                      f"<b>Articolo:</b> {modello.codice_articolo or '-'}<br/>"
-                      f"<b>Forma:</b> {modello.forma or '-'}", styles['Normal']),
-            Paragraph(f"<b>Cliente:</b> {modello.cliente.nome}<br/>"
-                      f"<b>Tipo:</b> {modello.get_tipo_display()}", styles['Normal']),
-            Image(modello.foto.path, width=4*cm, height=4*cm) if modello.foto else Paragraph("Nessuna Foto", styles['Italic'])
-        ]
-    ]
-    info_table = Table(info_header_data, colWidths=[7*cm, 6*cm, 4*cm])
-    info_table.setStyle(TableStyle([('VALIGN', (0,0), (-1,-1), 'TOP')]))
-    elements.append(info_table)
-    elements.append(Spacer(1, 0.8*cm))
-    
-    # --- SEZIONE COMPONENTI E MISURE ---
-    elements.append(Paragraph("Distinta Base e Misure per Taglia", styles['h2']))
-    
-    tutte_le_taglie = Taglia.objects.order_by('numero').all()
+    return risposta_pdf(documento_pdf('scheda_modello', modello), f"scheda_modello_{pk}.pdf")
 
-    for componente in modello.componenti.select_related('nome_componente', 'colore').all():
-        elements.append(Spacer(1, 0.5*cm))
-        
-        # Dettagli componente
-        colore_info = f"<b>Colore:</b> {componente.colore.nome if componente.colore else '-'}"
-        codici_info = f"<b>Cod. Art:</b> {componente.cod_componente or '-'} / <b>Cod. Col:</b> {componente.cod_colore or '-'}"
-        component_details_text = f"{componente.descrizione or '-'}<br/>{colore_info}<br/>{codici_info}"
-        
-        component_header_table = Table([
-            [
-                Paragraph(f"{componente.nome_componente.nome}", styles['ComponentHeader']),
-                Paragraph(component_details_text, styles['ComponentDetails'])
-            ]
-        ], colWidths=[5*cm, 12*cm])
-        component_header_table.setStyle(TableStyle([('VALIGN', (0,0), (-1,-1), 'MIDDLE')]))
-        elements.append(component_header_table)
-        elements.append(Spacer(1, 0.2*cm))
-        
-        # Tabella Misure per il componente
-        articoli_map = {art.taglia_id: art for art in componente.articoli.all()}
-        
-        if componente.unita_misura == 'SUPERFICIE':
-            data_articoli = [['Taglia', 'Superficie (m²)', 'Superficie (ft²)']]
-            for taglia in tutte_le_taglie:
-                articolo = articoli_map.get(taglia.pk)
-                mq_str = f"{articolo.superficie_mq:.4f}" if articolo and articolo.superficie_mq is not None else "N/D"
-                pq_str = f"{articolo.superficie_piedi_quadri:.4f}" if articolo and articolo.superficie_piedi_quadri is not None else "N/D"
-                data_articoli.append([str(taglia), mq_str, pq_str])
-            col_widths = [2*cm, 3*cm, 3*cm]
-        else: # PEZZI, PAIA, METRI
-            data_articoli = [['Taglia', f"Quantità ({componente.get_unita_misura_display()})"]]
-            for taglia in tutte_le_taglie:
-                articolo = articoli_map.get(taglia.pk)
-                qta_str = f"{articolo.quantita_unitaria:.2f}" if articolo and articolo.quantita_unitaria is not None else "N/D"
-                data_articoli.append([str(taglia), qta_str])
-            col_widths = [2*cm, 4*cm]
-            
-        table_articoli = Table(data_articoli, colWidths=col_widths)
-        table_articoli.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
-            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-            ('GRID', (0,0), (-1,-1), 0.5, colors.darkgrey),
-            ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-            ('FONTSIZE', (0,0), (-1,-1), 8),
-        ]))
-        elements.append(table_articoli)
-
-    # --- SEZIONE NOTE FINALE ---
-    if modello.note:
-        elements.append(Spacer(1, 1*cm))
-        elements.append(Paragraph("Note sul Modello", styles['h2']))
-        elements.append(Paragraph(modello.note.replace('\n', '<br/>'), styles['BodyText']))
-        
-    doc.build(elements)
-    
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="scheda_modello_{pk}.pdf"'
-    response.write(buffer.getvalue())
-    buffer.close()
-    return response
+@login_required
+def esporta_documenti(request):
+    """
+    Archivio ZIP con i PDF scelti (bolle, schede materiali, schede modello),
+    generati in parallelo e inviati in streaming man mano che sono pronti.
+    Oltre LAVORI_SOGLIA_DOCUMENTI documenti l'archivio viene preparato in background.
+    """
+    form = EsportaDocumentiForm(request.GET or None)
+    if form.is_valid():
+        tipi = form.cleaned_data['documenti']
+        ordini = [] if set(tipi) <= set(TIPI_MODELLO) else list(form.ordini_selezionati().values_list('pk', flat=True))
+        modelli = list(form.modelli_selezionati().values_list('pk', flat=True)) if set(tipi) & set(TIPI_MODELLO) else []
+        documenti = documenti_da_esportare(ordini, modelli, tipi)
+        limite = getattr(settings, 'ESPORTAZIONE_MAX_DOCUMENTI', 500)
+        if not documenti:
+            form.add_error(None, "Nessun documento corrisponde ai criteri indicati.")
+        elif len(documenti) > limite:
+            form.add_error(None, f"Troppi documenti ({len(documenti)}): restringi la selezione a {limite} al massimo.")
+        elif len(documenti) > soglia_documenti():
+            lavoro = accoda('esportazione', {'documenti': documenti},
+                            f"documenti_{timezone.now():%Y%m%d_%H%M}.zip", request.user)
+            messages.info(request, f"{len(documenti)} documenti: l'archivio viene preparato in background.")
+            return redirect(lavoro)
+        else:
+            response = StreamingHttpResponse(zip_documenti(documenti), content_type='application/zip')
+            response['Content-Disposition'] = f'attachment; filename="documenti_{timezone.now():%Y%m%d_%H%M}.zip"'
+            return response
+    return render(request, 'gestionale/report/esporta_documenti.html', {'form': form})
 
 from .models import StrutturaModello # Aggiungi l'import
 from .forms import StrutturaModelloForm # Aggiungi l'import
@@ -1002,6 +788,7 @@ class StrutturaModelloListView(LoginRequiredMixin, generic.ListView):
     model = StrutturaModello
     template_name = 'gestionale/strutture/strutturamodello_list.html'
     context_object_name = 'strutture'
+    queryset = StrutturaModello.objects.prefetch_related('tipi_componente')
 
 class StrutturaModelloDetailView(LoginRequiredMixin, generic.DetailView):
     model = StrutturaModello
@@ -1031,63 +818,8 @@ def load_modello_components(request, modello_id):
     componenti_formset = ComponentePerOrdineFormSet(instance=modello, prefix='componenti')
     return render(request, 'gestionale/ordini/partials/componenti_formset.html', {'componenti_formset': componenti_formset})
 
-def crea_distribuzione_bolle(dettagli_ordine, max_totale, max_per_taglia=None):
-    """
-    Algoritmo per suddividere un ordine in bolle di lavoro ottimizzate.
-    """
-    bolle = []
-    # Crea un dizionario con le quantità rimanenti da distribuire, ordinato per taglia
-    da_distribuire = {
-        d.taglia: d.quantita 
-        for d in dettagli_ordine.order_by('taglia__numero')
-    }
-
-    while any(q > 0 for q in da_distribuire.values()):
-        nuova_bolla = {}
-        paia_in_bolla = 0
-        
-        for taglia, quantita_rimanente in da_distribuire.items():
-            if quantita_rimanente == 0:
-                continue
-
-            # Calcola quanti paia di questa taglia possiamo aggiungere
-            limite_taglia = max_per_taglia if max_per_taglia else quantita_rimanente
-            spazio_disponibile = max_totale - paia_in_bolla
-            
-            da_aggiungere = min(quantita_rimanente, limite_taglia, spazio_disponibile)
-
-            if da_aggiungere > 0:
-                nuova_bolla[taglia] = da_aggiungere
-                paia_in_bolla += da_aggiungere
-                da_distribuire[taglia] -= da_aggiungere
-        
-        if nuova_bolla:
-            bolle.append(nuova_bolla)
-            
-    return bolle
-
 from django.views.generic.edit import FormView
-from .forms import BollaSplitForm
-from .models import Ordine
-from io import BytesIO
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import cm
-from reportlab.lib.enums import TA_CENTER
-
-
-# In gestional/views.py
-
-# 1. AGGIUNGI 'landscape' AGLI IMPORT DI REPORTLAB
-from reportlab.lib.pagesizes import A4, landscape
-# Aggiungi 'ceil' agli import all'inizio del file
-from math import ceil
-
-
-# Aggiungi 'Image' agli import di reportlab
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak, Image
+from .forms import BollaSplitForm, BolleMultipleForm
 
 class GeneraBolleView(LoginRequiredMixin, FormView):
     form_class = BollaSplitForm
@@ -1095,120 +827,116 @@ class GeneraBolleView(LoginRequiredMixin, FormView):
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['ordine'] = get_object_or_404(Ordine, pk=self.kwargs['pk'])
+        context['ordine'] = get_object_or_404(
+            Ordine.objects.select_related('modello', 'modello__cliente').prefetch_related('dettagli__taglia'),
+            pk=self.kwargs['pk'])
         return context
 
     def form_valid(self, form):
         ordine = get_object_or_404(Ordine.objects.select_related('modello', 'modello__cliente'), pk=self.kwargs['pk'])
         max_totale = form.cleaned_data['max_totale']
         max_per_taglia = form.cleaned_data.get('max_per_taglia')
+        modalita = form.cleaned_data.get('modalita') or SEQUENZIALE
+
+        parametri = parametri_bolle(max_totale, max_per_taglia, modalita)
+        chiave = chiave_pdf('bolle_lavoro', ordine, **parametri)
+        quantita = list(ordine.dettagli.values_list('quantita', flat=True))
+        # Le bolle già in cache si scaricano subito; le altre, se sono tante, in background
+        if not cache_pdf.contiene(chiave) and numero_minimo_bolle(quantita, max_totale, max_per_taglia) > soglia_bolle():
+            lavoro = accoda('bolle_lavoro', {'ordine': ordine.pk, **parametri},
+                            f"bolle_lavoro_ordine_{ordine.pk}.pdf", self.request.user)
+            messages.info(self.request, "Le bolle sono molte: il PDF viene preparato in background.")
+            return redirect(lavoro)
+        return risposta_pdf(documento_pdf('bolle_lavoro', ordine, chiave=chiave, **parametri),
+                            f"bolle_lavoro_ordine_{ordine.pk}.pdf")
+
+
+class GeneraBolleMultipleView(LoginRequiredMixin, FormView):
+    """
+    Bolle di lavoro di più ordini (es. tutti i confermati di un cliente o di
+    una settimana di consegna) in un unico PDF, raggruppate per modello.
+    """
+    form_class = BolleMultipleForm
+    template_name = 'gestionale/ordini/genera_bolle_multiple_form.html'
 
-        dettagli = ordine.dettagli.select_related('taglia').all()
-        bolle_distribuite = crea_distribuzione_bolle(dettagli, max_totale, max_per_taglia)
-        
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=1*cm, bottomMargin=1*cm, leftMargin=1*cm, rightMargin=1*cm)
-        
-        styles = getSampleStyleSheet()
-        style_title = ParagraphStyle(name='Title', fontSize=14, fontName='Helvetica-Bold', alignment=TA_CENTER, spaceAfter=6)
-        style_header_field = ParagraphStyle(name='HeaderField', fontSize=7, fontName='Helvetica')
-        style_header_value = ParagraphStyle(name='HeaderValue', fontSize=9, fontName='Helvetica-Bold')
-        style_section = ParagraphStyle(name='Section', fontSize=9, fontName='Helvetica-Bold', spaceBefore=6, spaceAfter=2)
-        style_component_label = ParagraphStyle(name='ComponentLabel', fontSize=8, fontName='Helvetica-Bold')
-        style_component_value = ParagraphStyle(name='ComponentValue', fontSize=8, fontName='Helvetica', leading=10) # Aggiunto leading per spaziatura
-
-        elements = []
-        total_bolle = len(bolle_distribuite)
-        
-        # Recupera tutte le taglie una sola volta
-        tutte_le_taglie = Taglia.objects.order_by('numero').all()
-
-        for i, bolla in enumerate(bolle_distribuite, 1):
-            # --- INTESTAZIONE ---
-            header_data = [
-                [Paragraph('BOLLA DI LAVORAZIONE', style_title), '', ''],
-                [Paragraph(f'ORDINE N. {ordine.id}', style_header_value), '', Paragraph(f'BOLLA N. {i}/{total_bolle}', style_header_value)],
-                [Paragraph('ARTICOLO', style_header_field), Paragraph('DATA ORDINE', style_header_field), Paragraph('DATA CONSEGNA', style_header_field)],
-                [
-                    Paragraph(ordine.modello.codice_articolo or '-', style_header_value),
-                    Paragraph(ordine.data_ordine.strftime('%d/%m/%Y'), style_header_value),
-                    Paragraph(ordine.data_consegna.strftime('%d/%m/%Y') if ordine.data_consegna else '-', style_header_value)
-                ],
-                [Paragraph('CLIENTE', style_header_field), '', Paragraph('PAIA', style_header_field)],
-                [Paragraph(ordine.modello.cliente.nome, style_header_value), '', Paragraph(str(sum(bolla.values())), style_header_value)],
-                [Paragraph('MODELLO', style_header_field), Paragraph('FORMA', style_header_field), ''],
-                [Paragraph(ordine.modello.nome, style_header_value), Paragraph(ordine.modello.forma or '-', style_header_value), '']
-            ]
-            header_table = Table(header_data, colWidths=[6.5*cm, 6.5*cm, 6*cm])
-            header_table.setStyle(TableStyle([
-                ('SPAN', (0,0), (2,0)), ('ALIGN', (2,1), (2,1), 'RIGHT'),
-                ('LINEBELOW', (0,1), (2,1), 0.5, colors.black), ('LINEBELOW', (0,3), (2,3), 0.5, colors.black),
-                ('LINEBELOW', (0,5), (2,5), 0.5, colors.black), ('LINEBELOW', (0,7), (1,7), 0.5, colors.black),
-                ('BOTTOMPADDING', (0,0), (-1,-1), 1), ('TOPPADDING', (0,0), (-1,-1), 1),
-            ]))
-            elements.append(header_table)
-
-            # --- NUMERAZIONE (Modificata per mostrare sempre tutte le taglie) ---
-            elements.append(Paragraph('NUMERAZIONE', style_section))
-            header_row = [Paragraph(str(t), style_header_field) for t in tutte_le_taglie]
-            quantita_row = [Paragraph(str(bolla.get(t, '')), style_header_value) for t in tutte_le_taglie]
-            col_width = (19 * cm) / len(tutte_le_taglie) # Calcola larghezza colonne dinamicamente
-            numerazione_table = Table([header_row, quantita_row], colWidths=[col_width]*len(header_row))
-            numerazione_table.setStyle(TableStyle([('GRID', (0,0), (-1,-1), 1, colors.black), ('ALIGN', (0,0), (-1,-1), 'CENTER')]))
-            elements.append(numerazione_table)
-            
-            # --- SEZIONE COMPONENTI DINAMICA CON QUANTITÀ (Modificata) ---
-            elements.append(Spacer(1, 0.4*cm))
-            materiali_per_bolla = ordine.get_materiali_necessari(bolla=bolla)
-            componenti_data = [[
-                Paragraph('COMPONENTE', style_header_field),
-                Paragraph('MATERIALE / CODICI', style_header_field),
-                Paragraph('QUANTITÀ NECESSARIA', style_header_field)
-            ]]
-
-            for key, misure in materiali_per_bolla.items():
-                nome_comp, colore, desc, cod_comp, cod_col = key
-                colore_info = f"<br/><b>Colore:</b> {colore.nome if colore else '-'}"
-                codici_info = f"<br/><b>Cod. Art:</b> {cod_comp or '-'} / <b>Cod. Col:</b> {cod_col or '-'}"
-                descrizione_par = Paragraph(f"{desc or '-'}{colore_info}{codici_info}", style_component_value)
-                
-                # Logica per mostrare entrambe le superfici o altre unità
-                if misure['unita_misura'] == 'SUPERFICIE':
-                    quantita_str = (
-                        f"{misure['tot_superficie_mq']:.4f} m²<br/>"
-                        f"{misure['tot_superficie_piedi_quadri']:.4f} ft²"
-                    )
-                else:
-                    quantita_str = f"{misure['tot_quantita_unitaria']:.2f} {misure['unita_misura_display']}"
-                
-                quantita_par = Paragraph(quantita_str, style_component_value)
-                componenti_data.append([Paragraph(nome_comp, style_component_label), descrizione_par, quantita_par])
-            
-            componenti_table = Table(componenti_data, colWidths=[4*cm, 11*cm, 4*cm])
-            componenti_table.setStyle(TableStyle([
-                ('GRID', (0,0), (-1,-1), 1, colors.black), ('VALIGN', (0,0), (-1,-1), 'TOP'),
-                ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
-                ('BOTTOMPADDING', (0,0), (-1,-1), 4), ('TOPPADDING', (0,0), (-1,-1), 4),
-            ]))
-            elements.append(componenti_table)
-            
-            # --- NOTE E FOOTER (invariati) ---
-            elements.append(Spacer(1, 0.4*cm))
-            note_table = Table([[Paragraph('NOTE', style_section)], [Paragraph(ordine.note or '', style_component_value)]], colWidths=[19*cm], rowHeights=[None, 2*cm])
-            note_table.setStyle(TableStyle([('BOX', (0,0), (-1,-1), 1, colors.black), ('VALIGN', (0,1), (0,1), 'TOP')]))
-            elements.append(note_table)
-            elements.append(Spacer(1, 0.5*cm))
-            footer_table = Table([[Paragraph('TIMBRO', style_section), Paragraph('CARTELLINO', style_section)]], colWidths=[9.5*cm, 9.5*cm], rowHeights=[2.5*cm])
-            footer_table.setStyle(TableStyle([('BOX', (0,0), (-1,-1), 1, colors.black), ('VALIGN', (0,0), (-1,-1), 'TOP')]))
-            elements.append(footer_table)
-            
-            if i < total_bolle:
-                elements.append(PageBreak())
+    def form_valid(self, form):
+        ordini = list(form.ordini_selezionati())
+        if not ordini:
+            form.add_error(None, "Nessun ordine corrisponde ai criteri indicati.")
+            return self.form_invalid(form)
+        max_totale = form.cleaned_data['max_totale']
+        max_per_taglia = form.cleaned_data.get('max_per_taglia')
+        modalita = form.cleaned_data.get('modalita') or SEQUENZIALE
 
-        doc.build(elements)
-        
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="bolle_lavoro_ordine_{ordine.pk}.pdf"'
-        response.write(buffer.getvalue())
-        buffer.close()
-        return response
\ No newline at end of file
+        stima = sum(numero_minimo_bolle([d.quantita for d in o.dettagli.all()], max_totale, max_per_taglia) for o in ordini)
+        if stima > soglia_bolle():
+            lavoro = accoda('bolle_ordini', {'ordini': [o.pk for o in ordini], **parametri_bolle(max_totale, max_per_taglia, modalita)},
+                            f"bolle_lavoro_{timezone.now():%Y%m%d}.pdf", self.request.user)
+            messages.info(self.request, f"{len(ordini)} ordini, circa {stima} bolle: il PDF viene preparato in background.")
+            return redirect(lavoro)
+
+        # Nessuna copia del PDF in memoria: FileResponse lo invia a blocchi e calcola Content-Length
+        pdf = pdf_temporaneo()
+        try:
+            numero_bolle = genera_bolle_ordini(ordini, pdf, max_totale, max_per_taglia, modalita)
+        except Exception:
+            pdf.close()
+            raise
+        if not numero_bolle:
+            pdf.close()
+            form.add_error(None, "Gli ordini selezionati non hanno paia da produrre.")
+            return self.form_invalid(form)
+        pdf.seek(0)
+        return risposta_pdf(pdf, f"bolle_lavoro_{timezone.now():%Y%m%d}.pdf")
+
+
+# ==============================================================================
+# RICERCA
+# ==============================================================================
+
+@login_required
+def ricerca(request):
+    """Ricerca globale su clienti, modelli e codici/descrizioni dei componenti."""
+    testo = request.GET.get('q', '').strip()
+    risultati = cerca(testo) if testo else []
+    return render(request, 'gestionale/ricerca/risultati.html', {
+        'testo': testo,
+        'risultati': risultati,
+        'CLIENTE': CLIENTE, 'MODELLO': MODELLO, 'COMPONENTE': COMPONENTE,
+    })
+
+
+# ==============================================================================
+# LAVORI IN BACKGROUND
+# ==============================================================================
+
+def _lavoro_visibile(request, pk):
+    """Un lavoro è visibile solo a chi lo ha creato (e allo staff)."""
+    lavoro = get_object_or_404(LavoroDocumento, pk=pk)
+    if not request.user.is_staff and lavoro.created_by_id != request.user.pk:
+        raise Http404
+    return lavoro
+
+@login_required
+def lavoro_detail(request, pk):
+    lavoro = _lavoro_visibile(request, pk)
+    return render(request, 'gestionale/lavori/lavoro_detail.html', {'lavoro': lavoro})
+
+@login_required
+def lavoro_stato(request, pk):
+    lavoro = _lavoro_visibile(request, pk)
+    return JsonResponse({
+        'id': lavoro.pk,
+        'stato': lavoro.stato,
+        'stato_display': lavoro.get_stato_display(),
+        'download_url': reverse('lavoro_download', args=[lavoro.pk]) if lavoro.stato == 'COMPLETATO' else None,
+        'errore': lavoro.errore if lavoro.stato == 'ERRORE' else None,
+    })
+
+@login_required
+def lavoro_download(request, pk):
+    lavoro = _lavoro_visibile(request, pk)
+    if lavoro.stato != 'COMPLETATO' or not lavoro.file:
+        raise Http404("Il documento non è ancora pronto.")
+    # PDF o archivio ZIP: il tipo viene ricavato dal nome del file
+    return FileResponse(lavoro.file.open('rb'), as_attachment=True, filename=lavoro.nome_file)